@@ -27,6 +27,11 @@ import time
 from datetime import datetime
 import base64
 
+try:
+    import uvloop  # 可选：pip install uvloop
+except ImportError:
+    uvloop = None
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -543,15 +548,27 @@ class ModelServer:
         
         return runner, site
 
-async def main():
+def parse_args():
     parser = argparse.ArgumentParser(description='Cloud Model Server')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Host to bind')
     parser.add_argument('--port', type=int, default=5000, help='Port to bind')
     parser.add_argument('--llama-host', type=str, default=None, help='LLaMA server host')
     parser.add_argument('--llama-port', type=int, default=None, help='LLaMA server port')
-    
-    args = parser.parse_args()
-    
+    parser.add_argument('--loop', type=str, choices=['asyncio', 'uvloop'],
+                        default=os.environ.get('CLOUD_SERVER_EVENT_LOOP', 'asyncio'),
+                        help='Event loop implementation (uvloop falls back to asyncio if not installed)')
+    return parser.parse_args()
+
+def install_event_loop_policy(name):
+    """在创建事件循环之前安装事件循环策略；uvloop 未安装时回退到默认 asyncio 循环"""
+    if name == 'uvloop':
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return 'uvloop'
+        logger.warning("未安装 uvloop，使用默认 asyncio 事件循环")
+    return 'asyncio'
+
+async def main(args):
     server = ModelServer(args.host, args.port, args.llama_host, args.llama_port)
     runner, site = await server.start()
     
@@ -564,4 +581,7 @@ async def main():
         await runner.cleanup()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    args = parse_args()
+    loop_name = install_event_loop_policy(args.loop)
+    logger.info(f"使用事件循环: {loop_name}")
+    asyncio.run(main(args))
@@ -0,0 +1,110 @@
+"""
+Runs a batch of prompts against a mock vLLM (httpx.MockTransport, no network) three ways and reports
+prompts/sec, the peak number of HTTP requests open at once and the peak Python heap (tracemalloc):
+
+  gather     one coroutine per prompt under a single asyncio.gather (the previous implementation)
+  engine     BatchEngine with bounded workers and duplicate prompts folded
+  packed     BatchEngine sending --pack-size prompts per /completions call
+
+The mock models a vLLM instance with --server-slots sequences decoding at once: every request
+occupies a slot for --latency-ms plus --per-prompt-ms for each extra prompt packed into it, and
+requests beyond the slots wait inside the "server" with their connection open.
+
+Run from the device/ directory:
+    python -m local_server.benchmarks.bench_batch_engine [--prompts 10000] [--duplicates 0.2]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import tracemalloc
+
+import httpx
+
+from local_server.services.batch_engine import BatchEngine
+from local_server.services.task_scheduler import TaskScheduler
+from local_server.services.vllm_service import VLLMService
+
+class MockVLLM:
+    def __init__(self, server_slots: int, latency: float, per_prompt: float):
+        self.slots = asyncio.Semaphore(server_slots)
+        self.latency = latency
+        self.per_prompt = per_prompt
+        self.open_requests = 0
+        self.peak_open_requests = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.open_requests += 1
+        self.peak_open_requests = max(self.peak_open_requests, self.open_requests)
+        try:
+            body = json.loads(request.content)
+            prompts = body["prompt"] if "prompt" in body else [body["messages"][0]["content"]]
+            async with self.slots:
+                await asyncio.sleep(self.latency + self.per_prompt * (len(prompts) - 1))
+            if "prompt" in body:
+                return httpx.Response(200, json={"choices": [{"index": i, "text": f"echo {p}"} for i, p in enumerate(prompts)]})
+            return httpx.Response(200, json={"choices": [{"message": {"content": f"echo {prompts[0]}"}}]})
+        finally:
+            self.open_requests -= 1
+
+async def _run_gather(service: VLLMService, prompts):
+    async def one(prompt):
+        response = await service.generate_response(prompt)
+        return response["choices"][0]["message"]["content"]
+    return len(await asyncio.gather(*(one(prompt) for prompt in prompts)))
+
+async def _run_engine(service: VLLMService, prompts, concurrency: int, pack_size: int):
+    engine = BatchEngine(service, TaskScheduler(backend_concurrency=concurrency, class_concurrency={}, class_weights={}),
+                         max_concurrency=concurrency, pack_size=pack_size)
+    count = 0
+    async for _ in engine.run(prompts):
+        count += 1 # Consumed as they arrive; nothing is kept
+    return count
+
+async def bench(mode: str, args, prompts):
+    mock = MockVLLM(args.server_slots, args.latency_ms / 1000, args.per_prompt_ms / 1000)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(mock.handle), limits=limits) as client:
+        service = VLLMService(client)
+        tracemalloc.start()
+        start = time.perf_counter()
+        if mode == "gather":
+            completed = await _run_gather(service, prompts)
+        else:
+            completed = await _run_engine(service, prompts, args.concurrency, args.pack_size if mode == "packed" else 1)
+        elapsed = time.perf_counter() - start
+        peak_heap = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return completed / elapsed, mock.peak_open_requests, peak_heap
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch engine throughput benchmark against a mock vLLM")
+    parser.add_argument("--prompts", type=int, default=10000)
+    parser.add_argument("--duplicates", type=float, default=0.2, help="Fraction of prompts repeating an earlier one")
+    parser.add_argument("--concurrency", type=int, default=32, help="BatchEngine workers and scheduler slots")
+    parser.add_argument("--pack-size", type=int, default=8)
+    parser.add_argument("--server-slots", type=int, default=32, help="Sequences the mock vLLM decodes at once")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--per-prompt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO) # Per-request logging would dominate the measurement
+
+    rng = random.Random(0)
+    prompts = []
+    for i in range(args.prompts):
+        if prompts and rng.random() < args.duplicates:
+            prompts.append(rng.choice(prompts))
+        else:
+            prompts.append(f"Summarize document {i} in one sentence.")
+
+    print(f"{args.prompts:,} prompts ({len(set(prompts)):,} unique), mock vLLM: {args.server_slots} slots, "
+          f"{args.latency_ms:.0f} ms/request + {args.per_prompt_ms:.0f} ms per packed prompt")
+    print(f"{'mode':>8} {'prompts/sec':>12} {'peak open requests':>19} {'peak heap MiB':>14}")
+    for mode in ("gather", "engine", "packed"):
+        rate, peak_open, peak_heap = asyncio.run(bench(mode, args, prompts))
+        print(f"{mode:>8} {rate:>12,.0f} {peak_open:>19,} {peak_heap / 2**20:>14,.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Drives the TCP command server (remote_command_to_local round trips over concurrent connections) and
+the cloud server's aiohttp JSON API under each available event loop, and reports requests/sec and
+p50/p99 latency side by side. Each loop runs in its own subprocess so the loop policy is clean.
+
+The cloud server currently exposes /api/works but no /api/completion route (completion is proxied to
+llama-server), so only /api/works is driven; the HTTP section is skipped when aiohttp is missing.
+
+Run from the device/ directory:
+    python -m local_server.benchmarks.bench_event_loop [--requests 20000] [--connections 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from local_server.communication.framing import JsonLineCodec
+from local_server.communication.protocol_models import BaseMessage, RemoteCommandToLocalPayload
+from local_server.communication.tcp_server import handle_client_connection
+from local_server.utils.event_loop import available_event_loops, install_event_loop_policy
+
+CLOUD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "cloud")
+
+def _percentile_ms(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))] * 1000
+
+async def _status_handler(message_dict, writer):
+    return {"original_command_action": "get_local_status", "status": "success", "data": {"ok": True}}
+
+async def bench_tcp(total: int, connections: int):
+    server = await asyncio.start_server(
+        lambda r, w: handle_client_connection(r, w, _status_handler, "bench", None), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    codec = JsonLineCodec()
+    frame = codec.encode(BaseMessage(
+        message_type="remote_command_to_local",
+        payload=RemoteCommandToLocalPayload(command_action="get_local_status").model_dump()))
+    latencies = []
+
+    async def client(count: int):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(frame)
+            await writer.drain()
+            await reader.readline()
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(total // connections) for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+    server.close()
+    await server.wait_closed()
+    return len(latencies) / elapsed, latencies
+
+async def bench_http(total: int, connections: int):
+    try:
+        import aiohttp
+        from aiohttp import web
+        sys.path.insert(0, os.path.abspath(CLOUD_DIR))
+        from cloud_model_server import ModelServer
+    except ImportError as e:
+        return None, str(e)
+
+    server = ModelServer("127.0.0.1", 0, None, None)
+    runner = web.AppRunner(server.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}/api/works"
+    latencies = []
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections)) as session:
+        async def client(count: int):
+            for _ in range(count):
+                start = time.perf_counter()
+                async with session.get(url) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(total // connections) for _ in range(connections)))
+        elapsed = time.perf_counter() - start
+    await runner.cleanup()
+    return len(latencies) / elapsed, latencies
+
+async def run_child(args):
+    import logging
+    logging.disable(logging.INFO) # Per-request logging would dominate the measurement
+    results = {}
+    rate, latencies = await bench_tcp(args.requests, args.connections)
+    results["tcp_command"] = [rate, _percentile_ms(latencies, 50), _percentile_ms(latencies, 99)]
+    rate, latencies = await bench_http(args.requests // 4, args.connections)
+    if rate is None:
+        results["http_api_works"] = f"skipped ({latencies})"
+    else:
+        results["http_api_works"] = [rate, _percentile_ms(latencies, 50), _percentile_ms(latencies, 99)]
+    print(json.dumps(results))
+
+def main():
+    parser = argparse.ArgumentParser(description="Event loop implementation benchmark")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--child-loop", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_loop:
+        install_event_loop_policy(args.child_loop)
+        asyncio.run(run_child(args))
+        return
+
+    loops = available_event_loops()
+    if len(loops) == 1:
+        print("uvloop is not installed; reporting the default asyncio loop only.")
+    print(f"{'loop':>8} {'workload':>16} {'req/sec':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for loop_name in loops:
+        output = subprocess.run(
+            [sys.executable, "-m", "local_server.benchmarks.bench_event_loop", "--child-loop", loop_name,
+             "--requests", str(args.requests), "--connections", str(args.connections)],
+            capture_output=True, text=True, check=True).stdout
+        for workload, result in json.loads(output.strip().splitlines()[-1]).items():
+            if isinstance(result, str):
+                print(f"{loop_name:>8} {workload:>16} {result}")
+            else:
+                print(f"{loop_name:>8} {workload:>16} {result[0]:>10,.0f} {result[1]:>8.2f} {result[2]:>8.2f}")
+
+if __name__ == "__main__":
+    main()
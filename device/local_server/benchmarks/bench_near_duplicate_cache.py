@@ -0,0 +1,94 @@
+"""
+Builds a NearDuplicateCache with synthetic prompts (mixed English/Chinese, ~60 characters each) and
+reports insert throughput, lookup latency (p50/p99) for near-duplicate hits and for misses, and the
+growth in peak RSS while the index is built (Unix only; reported as n/a elsewhere).
+
+Signatures for the bulk load are computed once and inserted with add_signature, so the build time
+measures hashing and index maintenance separately.
+
+Run from the device/ directory:
+    python -m local_server.benchmarks.bench_near_duplicate_cache [--entries 1000000] [--lookups 2000]
+"""
+import argparse
+import random
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+from local_server.services.near_duplicate_cache import NearDuplicateCache, np
+
+_LATIN = "abcdefghijklmnopqrstuvwxyz"
+_HAN = "的一是不了人我在有他这为之大来以个中上们到说国和地也子时道出而要于就下得可你年生自会那后能对着事其里所去行过家"
+
+def _vocabulary(rng: random.Random, size: int = 5000):
+    words = ["".join(rng.choice(_LATIN) for _ in range(rng.randint(3, 9))) for _ in range(size // 2)]
+    words += ["".join(rng.choice(_HAN) for _ in range(rng.randint(2, 4))) for _ in range(size - size // 2)]
+    return words
+
+def _percentile_ms(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))] * 1000
+
+def _prompt(rng: random.Random, words) -> str:
+    return " ".join(rng.choice(words) for _ in range(10))
+
+def _peak_rss_bytes() -> int:
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # Kilobytes on Linux
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate prompt cache benchmark")
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = _vocabulary(rng)
+    cache = NearDuplicateCache(threshold=args.threshold, num_perm=args.num_perm, bands=args.bands,
+                               shingle_size=3, max_entries=args.entries)
+    print(f"numpy: {'yes' if np is not None else 'no (pure-Python MinHash)'}")
+
+    prompts = [_prompt(rng, words) for _ in range(args.entries)]
+    start = time.perf_counter()
+    signatures = [cache.hasher.signature(prompt) for prompt in prompts]
+    hash_seconds = time.perf_counter() - start
+    print(f"signatures: {args.entries:,} in {hash_seconds:.1f}s ({args.entries / hash_seconds:,.0f}/s)")
+
+    rss_before = _peak_rss_bytes()
+    start = time.perf_counter()
+    for index, signature in enumerate(signatures):
+        cache.add_signature(signature, {"result_text": f"answer {index}", "source": "cloud_refined_success"})
+    build_seconds = time.perf_counter() - start
+    index_bytes = _peak_rss_bytes() - rss_before
+    print(f"index build: {build_seconds:.1f}s ({args.entries / build_seconds:,.0f} inserts/s)")
+    if resource is None:
+        print("index memory: n/a")
+    else:
+        # Signatures already existed before the build, so this is band buckets, entries and cached values.
+        print(f"index memory: {index_bytes / 2**20:,.0f} MiB ({index_bytes / args.entries:,.0f} B/entry)")
+
+    hit_latencies, miss_latencies, hits = [], [], 0
+    for _ in range(args.lookups):
+        stored = prompts[rng.randrange(args.entries)]
+        start = time.perf_counter()
+        value, _ = cache.lookup(stored + "?")
+        hit_latencies.append(time.perf_counter() - start)
+        hits += value is not None
+
+        start = time.perf_counter()
+        cache.lookup(_prompt(rng, words))
+        miss_latencies.append(time.perf_counter() - start)
+
+    print(f"near-duplicate lookups: {hits}/{args.lookups} hit, p50 {_percentile_ms(hit_latencies, 50):.3f} ms, "
+          f"p99 {_percentile_ms(hit_latencies, 99):.3f} ms")
+    print(f"unrelated lookups: p50 {_percentile_ms(miss_latencies, 50):.3f} ms, p99 {_percentile_ms(miss_latencies, 99):.3f} ms")
+
+if __name__ == "__main__":
+    main()
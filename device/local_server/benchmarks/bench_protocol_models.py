@@ -0,0 +1,77 @@
+"""
+Measures the per-message cost of building and parsing protocol messages, before and after the
+fast path in protocol_models (cheap task_id/timestamp factories, envelope-only parsing with
+cached TypeAdapters, and the trusted-peer mode, which skips the envelope checks). Parsing is measured
+for the two message types the device receives most: remote commands and streamed refinement chunks.
+
+Run from the device/ directory:
+    python -m local_server.benchmarks.bench_protocol_models [--messages 50000]
+"""
+import argparse
+import datetime
+import time
+import uuid
+
+from local_server.communication.protocol_models import (
+    BaseMessage, HeartbeatPayload, RemoteCommandToLocalPayload, QueryLocalModelDirectDetails, CloudRefinementChunkPayload,
+    new_task_id, utc_timestamp, parse_incoming_message, validate_model
+)
+
+def legacy_task_id() -> str:
+    return str(uuid.uuid4())
+
+def legacy_timestamp() -> str:
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+def make_command_dict() -> dict:
+    details = QueryLocalModelDirectDetails(prompt="Summarise the attached quarterly report. " * 20, vllm_params={"max_tokens": 256})
+    payload = RemoteCommandToLocalPayload(command_action="query_local_model_direct", command_details=details.model_dump())
+    return BaseMessage(message_type="remote_command_to_local", payload=payload.model_dump()).model_dump()
+
+def make_chunk_dict() -> dict:
+    payload = CloudRefinementChunkPayload(sequence=42, delta=" refined")
+    return BaseMessage(message_type="cloud_refinement_chunk", payload=payload.model_dump()).model_dump()
+
+def parse_legacy(message_dict: dict):
+    base_msg = BaseMessage(**message_dict)
+    if base_msg.message_type == "remote_command_to_local":
+        cmd_payload = RemoteCommandToLocalPayload(**base_msg.payload)
+        return QueryLocalModelDirectDetails(**cmd_payload.command_details)
+    return CloudRefinementChunkPayload(**base_msg.payload)
+
+def parse_fast(message_dict: dict, trusted: bool):
+    incoming = parse_incoming_message(message_dict, trusted=trusted)
+    if incoming.message_type == "remote_command_to_local":
+        cmd_payload = incoming.parsed_payload()
+        return validate_model(QueryLocalModelDirectDetails, cmd_payload.command_details)
+    return incoming.parsed_payload(CloudRefinementChunkPayload) # As TCPRemoteClient reads streamed chunks
+
+def rate(fn, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Protocol model fast-path benchmark")
+    parser.add_argument("--messages", type=int, default=50000)
+    args = parser.parse_args()
+    n = args.messages
+
+    print(f"{'operation':>28} {'before/sec':>12} {'after/sec':>12} {'trusted/sec':>12}")
+    print(f"{'task_id':>28} {rate(legacy_task_id, n):>12,.0f} {rate(new_task_id, n):>12,.0f} {'-':>12}")
+    print(f"{'timestamp':>28} {rate(legacy_timestamp, n):>12,.0f} {rate(utc_timestamp, n):>12,.0f} {'-':>12}")
+
+    heartbeat_payload = HeartbeatPayload(local_server_id="bench", status="ok").model_dump()
+    build_before = lambda: BaseMessage(task_id=legacy_task_id(), timestamp=legacy_timestamp(), message_type="heartbeat", payload=heartbeat_payload)
+    build_after = lambda: BaseMessage(message_type="heartbeat", payload=heartbeat_payload)
+    print(f"{'build heartbeat message':>28} {rate(build_before, n):>12,.0f} {rate(build_after, n):>12,.0f} {'-':>12}")
+
+    for label, message_dict in (("parse command", make_command_dict()), ("parse chunk", make_chunk_dict())):
+        before = rate(lambda: parse_legacy(message_dict), n)
+        after = rate(lambda: parse_fast(message_dict, trusted=False), n)
+        trusted = rate(lambda: parse_fast(message_dict, trusted=True), n)
+        print(f"{label:>28} {before:>12,.0f} {after:>12,.0f} {trusted:>12,.0f}")
+
+if __name__ == "__main__":
+    main()
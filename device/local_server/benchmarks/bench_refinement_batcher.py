@@ -0,0 +1,95 @@
+"""
+Sends refinement requests arriving as a Poisson process (--rate per second) to a mock cloud, once
+directly (one local_request_cloud_refinement per request, as before) and once through a
+RefinementBatcher per window size, and reports the cloud messages sent per second and the per-item
+latency (p50/p99) each caller saw.
+
+The mock cloud answers a message after --rtt-ms (network plus per-message overhead) plus
+--per-item-ms for every request in it, so batching saves messages but an item can wait up to one
+window and for the other items in its batch.
+
+Run from the device/ directory:
+    python -m local_server.benchmarks.bench_refinement_batcher [--requests 2000] [--rate 200] [--windows 5,20,50]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from local_server.services.refinement_batcher import RefinementBatcher
+from local_server.communication.protocol_models import (
+    LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload, ConfidenceAssessmentData,
+    CloudBatchRefinementResponseToLocalPayload, BatchRefinementResult
+)
+
+class MockCloud:
+    def __init__(self, rtt: float, per_item: float):
+        self.rtt = rtt
+        self.per_item = per_item
+        self.messages = 0
+
+    async def request_cloud_refinement(self, request_data, timeout=None):
+        self.messages += 1
+        await asyncio.sleep(self.rtt + self.per_item)
+        return CloudRefinementResponseToLocalPayload(status="success", refined_result=request_data.original_user_prompt)
+
+    async def request_cloud_batch_refinement(self, batch, timeout=None):
+        self.messages += 1
+        await asyncio.sleep(self.rtt + self.per_item * len(batch.requests))
+        return CloudBatchRefinementResponseToLocalPayload(batch_id=batch.batch_id, results=[
+            BatchRefinementResult(request_id=item.request_id, status="success", refined_result=item.original_user_prompt)
+            for item in batch.requests
+        ])
+
+def _percentile_ms(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))] * 1000
+
+async def bench(args, window_ms):
+    cloud = MockCloud(args.rtt_ms / 1000, args.per_item_ms / 1000)
+    refine = cloud.request_cloud_refinement if window_ms is None else RefinementBatcher(cloud, window_ms=window_ms, max_batch_size=args.max_batch).refine
+    rng = random.Random(0)
+    latencies = []
+
+    async def one(i):
+        request = LocalRequestCloudRefinementPayload(
+            original_user_prompt=f"prompt {i}", local_model_draft_result="draft",
+            confidence_assessment=ConfidenceAssessmentData(requires_cloud_refinement=True))
+        start = time.perf_counter()
+        await refine(request)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    callers = []
+    for i in range(args.requests):
+        callers.append(asyncio.create_task(one(i)))
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*callers)
+    elapsed = time.perf_counter() - start
+    return cloud.messages, cloud.messages / elapsed, _percentile_ms(latencies, 50), _percentile_ms(latencies, 99)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cloud refinement batching benchmark against a mock cloud")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200.0, help="Mean refinement requests per second")
+    parser.add_argument("--windows", default="5,20,50", help="Comma-separated batching windows (ms)")
+    parser.add_argument("--max-batch", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=40.0)
+    parser.add_argument("--per-item-ms", type=float, default=2.0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{args.requests:,} requests at ~{args.rate:g}/s, mock cloud: {args.rtt_ms:g} ms/message + {args.per_item_ms:g} ms/item")
+    print(f"{'mode':>12} {'messages':>9} {'msgs/sec':>9} {'reduction':>10} {'p50 ms':>8} {'p99 ms':>8} {'p50 cost':>9}")
+    baseline = None
+    for window_ms in [None] + [float(w) for w in args.windows.split(",") if w]:
+        messages, rate, p50, p99 = asyncio.run(bench(args, window_ms))
+        if baseline is None:
+            baseline = (messages, p50)
+        label = "unbatched" if window_ms is None else f"window {window_ms:g}ms"
+        reduction = 1 - messages / baseline[0]
+        print(f"{label:>12} {messages:>9,} {rate:>9,.1f} {reduction:>9.0%} {p50:>8.1f} {p99:>8.1f} {p50 - baseline[1]:>+9.1f}")
+
+if __name__ == "__main__":
+    main()
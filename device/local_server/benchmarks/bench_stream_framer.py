@@ -0,0 +1,63 @@
+"""
+Micro-benchmark for receive-side framing: the legacy `str +=` / `split("\\n", 1)` buffer versus the
+shared FrameDecoder, for single frames of 1 KB to 10 MB delivered in socket-sized chunks.
+
+Run from the device/ directory:
+    python -m local_server.benchmarks.bench_stream_framer [--chunk-size 4096] [--legacy-max-bytes 2097152]
+"""
+import argparse
+import time
+
+from local_server.communication.framing import FrameDecoder
+
+FRAME_SIZES = [1024, 16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 10 * 1024 * 1024]
+
+def make_stream(frame_size: int) -> bytes:
+    unit = "Owl chat history 你好世界，请总结以下内容。".encode("utf-8")
+    return (unit * (frame_size // len(unit) + 1))[:frame_size].decode("utf-8", errors="ignore").encode("utf-8") + b"\n"
+
+def legacy_str_buffer(stream: bytes, chunk_size: int) -> int:
+    # Mirrors the receive loops before FrameDecoder (and breaks on characters split across chunks,
+    # which is why errors="ignore" is needed here at all).
+    message_buffer = ""
+    frames = 0
+    for offset in range(0, len(stream), chunk_size):
+        message_buffer += stream[offset:offset + chunk_size].decode("utf-8", errors="ignore")
+        while "\n" in message_buffer:
+            _message_str, message_buffer = message_buffer.split("\n", 1)
+            frames += 1
+    return frames
+
+def frame_decoder(stream: bytes, chunk_size: int) -> int:
+    decoder = FrameDecoder(max_frame_size=len(stream) + 1)
+    frames = 0
+    for offset in range(0, len(stream), chunk_size):
+        decoder.feed(stream[offset:offset + chunk_size])
+        while decoder.next_frame() is not None:
+            frames += 1
+    return frames
+
+def timed(func, stream: bytes, chunk_size: int) -> float:
+    start = time.perf_counter()
+    assert func(stream, chunk_size) == 1
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream framer micro-benchmark")
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--legacy-max-bytes", type=int, default=2 * 1024 * 1024,
+                        help="Skip the quadratic legacy path above this frame size")
+    args = parser.parse_args()
+
+    print(f"{'frame bytes':>12} {'legacy ms':>12} {'decoder ms':>12} {'speedup':>9}")
+    for frame_size in FRAME_SIZES:
+        stream = make_stream(frame_size)
+        decoder_s = timed(frame_decoder, stream, args.chunk_size)
+        if frame_size <= args.legacy_max_bytes:
+            legacy_s = timed(legacy_str_buffer, stream, args.chunk_size)
+            print(f"{frame_size:>12,} {legacy_s * 1000:>12.2f} {decoder_s * 1000:>12.2f} {legacy_s / decoder_s:>8.1f}x")
+        else:
+            print(f"{frame_size:>12,} {'skipped':>12} {decoder_s * 1000:>12.2f} {'-':>9}")
+
+if __name__ == "__main__":
+    main()
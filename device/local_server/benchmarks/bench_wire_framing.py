@@ -0,0 +1,56 @@
+"""
+Compares newline-delimited JSON with the length-prefixed framings, with and without per-frame
+compression, for typical local_request_cloud_refinement payloads: messages/sec for
+encode+decode+validate and bytes on the wire.
+
+Run from the device/ directory:
+    python -m local_server.benchmarks.bench_wire_framing [--messages 20000]
+"""
+import argparse
+import time
+
+from local_server.communication.framing import FRAME_HEADER, FRAMING_JSON, get_codec, supported_compressions, supported_framings
+from local_server.communication.protocol_models import BaseMessage, LocalRequestCloudRefinementPayload
+
+def make_refinement_message(draft_chars: int) -> BaseMessage:
+    payload = LocalRequestCloudRefinementPayload(
+        original_user_prompt="请帮我总结这份季度销售报告，并指出主要风险和改进建议。" * 3,
+        local_model_draft_result=("本季度销售额同比增长12%，主要来自华东地区。" * 200)[:draft_chars],
+        confidence_assessment={
+            "rouge_l_score": 0.24,
+            "keyword_triggers_found": ["风险"],
+            "requires_cloud_refinement": True,
+            "details": {"rouge_threshold_used": 0.3, "reason_for_refinement": "ROUGE-L F1 score below threshold."}
+        },
+    )
+    return BaseMessage(message_type="local_request_cloud_refinement", payload=payload.model_dump())
+
+def run(framing: str, compression, message: BaseMessage, count: int):
+    codec = get_codec(framing, compression)
+    frame = codec.encode(message)
+    body = frame[FRAME_HEADER.size:] if codec.length_prefixed else frame.rstrip(b"\n")
+    flags = FRAME_HEADER.unpack_from(frame)[1] if codec.length_prefixed else 0
+    start = time.perf_counter()
+    for _ in range(count):
+        frame = codec.encode(message)
+        decoded = BaseMessage(**codec.decode(body, flags))
+        LocalRequestCloudRefinementPayload(**decoded.payload)
+    elapsed = time.perf_counter() - start
+    return count / elapsed, len(frame)
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire framing benchmark")
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'draft chars':>12} {'framing':>12} {'compression':>12} {'msgs/sec':>12} {'bytes/msg':>10}")
+    for draft_chars in (256, 2048, 8192):
+        message = make_refinement_message(draft_chars)
+        for framing in reversed(supported_framings()):
+            compressions = [None] if framing == FRAMING_JSON else [None] + supported_compressions()
+            for compression in compressions:
+                rate, size = run(framing, compression, message, args.messages)
+                print(f"{draft_chars:>12} {framing:>12} {compression or 'none':>12} {rate:>12,.0f} {size:>10,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Sends small frames (heartbeat-sized) over a loopback socket from many concurrent producers, first with
+write()+drain() per message, then through OutboundWriteQueue, and reports msgs/sec and socket writes.
+
+Run from the device/ directory:
+    python -m local_server.benchmarks.bench_write_coalescing [--messages 50000] [--producers 32]
+"""
+import argparse
+import asyncio
+import time
+
+from local_server.communication.framing import JsonLineCodec
+from local_server.communication.protocol_models import BaseMessage, HeartbeatPayload
+from local_server.communication.write_queue import OutboundWriteQueue
+
+async def run(mode: str, total: int, producers: int):
+    sink_done = asyncio.Event()
+
+    async def _sink(reader: asyncio.StreamReader, sink_writer: asyncio.StreamWriter):
+        while await reader.read(1 << 16):
+            pass
+        sink_writer.close()
+        sink_done.set()
+
+    server = await asyncio.start_server(_sink, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    frame = JsonLineCodec().encode(BaseMessage(message_type="heartbeat", payload=HeartbeatPayload(local_server_id="bench", status="ok").model_dump()))
+    per_producer = total // producers
+    lock = asyncio.Lock()
+    queue = OutboundWriteQueue(writer, "bench", flush_interval=0, max_batch_bytes=256 * 1024, max_queued_bytes=8 * 1024 * 1024)
+    writes = 0
+
+    async def direct_producer():
+        nonlocal writes
+        for _ in range(per_producer):
+            async with lock:
+                writer.write(frame)
+                await writer.drain()
+                writes += 1
+            await asyncio.sleep(0) # Stand-in for the producer's own work between messages
+
+    async def queued_producer():
+        for _ in range(per_producer):
+            await queue.enqueue(frame)
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    producer = direct_producer if mode == "direct" else queued_producer
+    await asyncio.gather(*(producer() for _ in range(producers)))
+    await queue.close()
+    elapsed = time.perf_counter() - start
+    if mode != "direct":
+        writes = queue.writes
+
+    writer.close()
+    await writer.wait_closed()
+    await sink_done.wait()
+    server.close()
+    await server.wait_closed()
+    return per_producer * producers / elapsed, writes
+
+async def main_async(args):
+    print(f"{'mode':>8} {'msgs/sec':>12} {'writes':>8}")
+    for mode in ("direct", "queued"):
+        rate, writes = await run(mode, args.messages, args.producers)
+        print(f"{mode:>8} {rate:>12,.0f} {writes:>8,}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbound write coalescing benchmark")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--producers", type=int, default=32)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
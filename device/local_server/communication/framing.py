@@ -0,0 +1,354 @@
+import json
+import struct
+import logging
+import time
+import zlib
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..core.config import settings
+from .protocol_models import BaseMessage
+
+try:
+    import msgpack # Optional: pip install msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard # Optional: pip install zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Framing modes. "json" is the original newline-delimited JSON protocol and is always available;
+# every other mode is opt-in and is only used after both peers agree on it via a hello exchange.
+FRAMING_JSON = "json"
+FRAMING_MSGPACK = "msgpack"
+FRAMING_JSON_FRAMED = "json_framed" # JSON bodies in length-prefixed frames, so they can carry compression flags
+
+# Per-frame compression, only available on length-prefixed framings (the flags byte marks compressed bodies).
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+FRAME_FLAG_ZLIB = 0x01
+FRAME_FLAG_ZSTD = 0x02
+
+HELLO_MESSAGE_TYPE = "protocol_hello"
+HELLO_ACK_MESSAGE_TYPE = "protocol_hello_ack"
+
+# Socket read size for the receive loops. Larger than a typical frame so most reads complete one or more frames.
+READ_CHUNK_SIZE = 64 * 1024
+
+# Binary frame header: 4-byte big-endian body length followed by a 1-byte flags field (FRAME_FLAG_*, 0 = raw body).
+FRAME_HEADER = struct.Struct(">IB")
+
+class FramingError(Exception):
+    """Raised when a frame cannot be encoded or decoded."""
+    pass
+
+class CompressionStats:
+    """Running totals for one connection's compressor, reported through pool stats and connection logs."""
+    def __init__(self):
+        self.frames_considered = 0 # Frames at or above the size threshold
+        self.frames_compressed = 0 # Of those, frames that were actually sent compressed
+        self.bytes_in = 0 # Raw size of compressed frames
+        self.bytes_out = 0 # Wire size of compressed frames
+        self.compress_seconds = 0.0
+        self.frames_decompressed = 0
+        self.decompress_seconds = 0.0
+
+    @property
+    def ratio(self) -> Optional[float]:
+        return self.bytes_out / self.bytes_in if self.bytes_in else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "frames_considered": self.frames_considered,
+            "frames_compressed": self.frames_compressed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.ratio, 4) if self.ratio is not None else None,
+            "compress_ms": round(self.compress_seconds * 1000, 3),
+            "frames_decompressed": self.frames_decompressed,
+            "decompress_ms": round(self.decompress_seconds * 1000, 3),
+        }
+
+class FrameCompressor:
+    """Compresses frame bodies of at least `min_bytes`; bodies that do not shrink are sent raw."""
+    def __init__(self, algorithm: str, min_bytes: int, level: Optional[int] = None):
+        if algorithm not in supported_compressions():
+            raise FramingError(f"Compression '{algorithm}' is not available in this process")
+        self.algorithm = algorithm
+        self.min_bytes = min_bytes
+        self.stats = CompressionStats()
+        if algorithm == COMPRESSION_ZSTD:
+            self.flag = FRAME_FLAG_ZSTD
+            self._zstd = zstandard.ZstdCompressor(level=level if level is not None else 3)
+        else:
+            self.flag = FRAME_FLAG_ZLIB
+            self._zlib_level = level if level is not None else 6
+
+    def compress(self, body: bytes) -> Tuple[bytes, int]:
+        if len(body) < self.min_bytes:
+            return body, 0
+        start = time.perf_counter()
+        if self.flag == FRAME_FLAG_ZSTD:
+            compressed = self._zstd.compress(body)
+        else:
+            compressed = zlib.compress(body, self._zlib_level)
+        self.stats.compress_seconds += time.perf_counter() - start
+        self.stats.frames_considered += 1
+        if len(compressed) >= len(body):
+            return body, 0
+        self.stats.frames_compressed += 1
+        self.stats.bytes_in += len(body)
+        self.stats.bytes_out += len(compressed)
+        return compressed, self.flag
+
+def decompress_body(body: bytes, flags: int, max_size: int) -> bytes:
+    """Undoes FrameCompressor.compress. Output is capped at max_size so a small frame cannot expand without bound."""
+    if flags == 0:
+        return body
+    try:
+        if flags == FRAME_FLAG_ZLIB:
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(body, max_size)
+            if decompressor.unconsumed_tail:
+                raise FrameTooLargeError(f"Decompressed frame exceeds {max_size} bytes")
+            return data
+        if flags == FRAME_FLAG_ZSTD:
+            if zstandard is None:
+                raise FramingError("Received a zstd-compressed frame but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(body, max_output_size=max_size)
+    except FramingError:
+        raise
+    except Exception as e:
+        raise FramingError(f"Failed to decompress frame (flags={flags:#x}): {e}") from e
+    raise FramingError(f"Unknown frame flags: {flags:#x}")
+
+class JsonLineCodec:
+    """Newline-delimited JSON, the protocol's default framing."""
+    name = FRAMING_JSON
+    length_prefixed = False
+    compressor = None
+
+    def encode(self, message: BaseMessage) -> bytes:
+        return message.model_dump_json().encode("utf-8") + b"\n"
+
+    def decode(self, body: bytes, flags: int = 0) -> Dict[str, Any]:
+        # json.JSONDecodeError is left to propagate so callers can report it as invalid JSON.
+        return json.loads(body)
+
+class _LengthPrefixedCodec:
+    """Frame header handling and optional compression shared by the length-prefixed codecs."""
+    length_prefixed = True
+
+    def __init__(self, compressor: Optional[FrameCompressor] = None, max_frame_size: int = 16 * 1024 * 1024):
+        self.compressor = compressor
+        self.max_frame_size = max_frame_size
+
+    def encode(self, message: BaseMessage) -> bytes:
+        body = self._serialize(message)
+        flags = 0
+        if self.compressor is not None:
+            body, flags = self.compressor.compress(body)
+        return FRAME_HEADER.pack(len(body), flags) + body
+
+    def decode(self, body: bytes, flags: int = 0) -> Dict[str, Any]:
+        if flags:
+            start = time.perf_counter()
+            body = decompress_body(body, flags, self.max_frame_size)
+            if self.compressor is not None:
+                self.compressor.stats.frames_decompressed += 1
+                self.compressor.stats.decompress_seconds += time.perf_counter() - start
+        message_dict = self._deserialize(body)
+        if not isinstance(message_dict, dict):
+            raise FramingError(f"Decoded {self.name} frame is not a message object (got {type(message_dict).__name__})")
+        return message_dict
+
+class JsonFramedCodec(_LengthPrefixedCodec):
+    """JSON bodies in length-prefixed frames. Used when compression is wanted without msgpack."""
+    name = FRAMING_JSON_FRAMED
+
+    def _serialize(self, message: BaseMessage) -> bytes:
+        return message.model_dump_json().encode("utf-8")
+
+    def _deserialize(self, body: bytes) -> Any:
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            raise FramingError(f"Failed to decode JSON frame: {e}") from e
+
+class MsgpackFrameCodec(_LengthPrefixedCodec):
+    """Length-prefixed msgpack frames. Avoids the JSON text round trip for large payloads."""
+    name = FRAMING_MSGPACK
+
+    def __init__(self, compressor: Optional[FrameCompressor] = None, max_frame_size: int = 16 * 1024 * 1024):
+        if msgpack is None:
+            raise FramingError("msgpack framing requested but the msgpack package is not installed")
+        super().__init__(compressor, max_frame_size)
+
+    def _serialize(self, message: BaseMessage) -> bytes:
+        try:
+            return msgpack.packb(message.model_dump(), use_bin_type=True)
+        except Exception as e:
+            raise FramingError(f"Failed to encode msgpack frame: {e}") from e
+
+    def _deserialize(self, body: bytes) -> Any:
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise FramingError(f"Failed to decode msgpack frame: {e}") from e
+
+_CODEC_FACTORIES = {
+    FRAMING_JSON: JsonLineCodec,
+    FRAMING_JSON_FRAMED: JsonFramedCodec,
+    FRAMING_MSGPACK: MsgpackFrameCodec,
+}
+
+def supported_framings() -> List[str]:
+    """Framings usable in this process, most preferred first. JSON is always last as the fallback."""
+    framings = []
+    if msgpack is not None:
+        framings.append(FRAMING_MSGPACK)
+    framings.append(FRAMING_JSON_FRAMED)
+    framings.append(FRAMING_JSON)
+    return framings
+
+def supported_compressions() -> List[str]:
+    """Compression algorithms usable in this process, most preferred first."""
+    compressions = []
+    if zstandard is not None:
+        compressions.append(COMPRESSION_ZSTD)
+    compressions.append(COMPRESSION_ZLIB)
+    return compressions
+
+def get_codec(framing: str, compression: Optional[str] = None):
+    """
+    Builds the codec for a negotiated framing. `compression` applies to length-prefixed framings only;
+    threshold, level and the decompression cap come from settings.remote_server.
+    """
+    factory = _CODEC_FACTORIES.get(framing)
+    if factory is None:
+        raise FramingError(f"Unknown framing: {framing}")
+    if not factory.length_prefixed:
+        return factory()
+    compressor = None
+    if compression and compression != COMPRESSION_NONE:
+        compressor = FrameCompressor(compression, settings.remote_server.compression_min_bytes, settings.remote_server.compression_level)
+    return factory(compressor=compressor, max_frame_size=settings.remote_server.max_frame_size_bytes)
+
+def negotiate_framing(offered: Optional[List[str]]) -> str:
+    """Picks the first framing from the peer's preference list that we support; JSON otherwise."""
+    local = supported_framings()
+    for framing in offered or []:
+        if framing in local:
+            return framing
+    return FRAMING_JSON
+
+def negotiate_compression(offered: Optional[List[str]], framing: str) -> Optional[str]:
+    """Picks the first offered compression we support, or None. Line-delimited JSON never compresses."""
+    factory = _CODEC_FACTORIES.get(framing)
+    if factory is None or not factory.length_prefixed:
+        return None
+    local = supported_compressions()
+    for compression in offered or []:
+        if compression in local:
+            return compression
+    return None
+
+def build_hello_message(preferred_framing: str, peer_id: str, compression: Optional[str] = None,
+                        session: Optional[Dict[str, Any]] = None) -> BaseMessage:
+    """`session`, when given, is {"session_id": ..., "last_acked_seq": ...} for resuming after a reconnect."""
+    offered = [preferred_framing] if preferred_framing != FRAMING_JSON else []
+    offered.append(FRAMING_JSON)
+    payload = {"peer_id": peer_id, "framings": offered}
+    if compression and compression != COMPRESSION_NONE:
+        payload["compression"] = [compression]
+    if session:
+        payload["session"] = session
+    return BaseMessage(message_type=HELLO_MESSAGE_TYPE, payload=payload)
+
+def build_hello_ack_message(hello_task_id: str, framing: str, compression: Optional[str] = None,
+                            session: Optional[Dict[str, Any]] = None) -> BaseMessage:
+    """`session`, from a session-aware peer, is {"resumed": bool, "last_received_seq": int}."""
+    payload = {"framing": framing, "compression": compression}
+    if session:
+        payload["session"] = session
+    return BaseMessage(task_id=hello_task_id, message_type=HELLO_ACK_MESSAGE_TYPE, payload=payload)
+
+class FrameTooLargeError(FramingError):
+    """Raised when a peer sends (or announces) a frame larger than the configured maximum."""
+    pass
+
+class FrameDecoder:
+    """
+    Incremental frame splitter shared by the client and server receive loops.
+
+    Bytes from the socket are appended to a single bytearray and complete frames are sliced out of it
+    by offset, so each byte is scanned and copied a constant number of times regardless of frame size.
+    Frames are returned as bytes and only decoded once complete, which keeps multi-byte UTF-8
+    characters that straddle two reads intact. The framing mode may be switched between frames
+    (after a hello exchange) without losing data that is already buffered.
+    """
+    def __init__(self, max_frame_size: int, length_prefixed: bool = False):
+        self.max_frame_size = max_frame_size
+        self.length_prefixed = length_prefixed
+        self._buffer = bytearray()
+        self._pos = 0 # Start of unconsumed data in _buffer
+        self._scan_from = 0 # Where the next newline search resumes; bytes before it hold no newline
+        self.last_flags = 0 # Flags byte of the frame most recently returned by next_frame()
+
+    @property
+    def buffered_bytes(self) -> int:
+        return len(self._buffer) - self._pos
+
+    def feed(self, data: bytes) -> None:
+        self._buffer += data
+
+    def next_frame(self) -> Optional[bytes]:
+        """Returns the next complete frame body, or None if more data is needed."""
+        frame = self._next_length_prefixed() if self.length_prefixed else self._next_line()
+        if frame is None:
+            self._compact()
+        return frame
+
+    def _next_line(self) -> Optional[bytes]:
+        newline_index = self._buffer.find(b"\n", max(self._scan_from, self._pos))
+        if newline_index == -1:
+            self._scan_from = len(self._buffer)
+            if self.buffered_bytes > self.max_frame_size:
+                raise FrameTooLargeError(f"Line frame exceeds {self.max_frame_size} bytes without a newline")
+            return None
+        if newline_index - self._pos > self.max_frame_size:
+            raise FrameTooLargeError(f"Line frame of {newline_index - self._pos} bytes exceeds {self.max_frame_size}")
+        with memoryview(self._buffer) as view:
+            frame = bytes(view[self._pos:newline_index])
+        self.last_flags = 0
+        self._pos = newline_index + 1
+        self._scan_from = self._pos
+        return frame
+
+    def _next_length_prefixed(self) -> Optional[bytes]:
+        if self.buffered_bytes < FRAME_HEADER.size:
+            return None
+        body_length, flags = FRAME_HEADER.unpack_from(self._buffer, self._pos)
+        if body_length > self.max_frame_size:
+            raise FrameTooLargeError(f"Announced frame of {body_length} bytes exceeds {self.max_frame_size}")
+        body_start = self._pos + FRAME_HEADER.size
+        body_end = body_start + body_length
+        if len(self._buffer) < body_end:
+            return None
+        with memoryview(self._buffer) as view:
+            frame = bytes(view[body_start:body_end])
+        self.last_flags = flags
+        self._pos = body_end
+        self._scan_from = self._pos
+        return frame
+
+    def _compact(self) -> None:
+        # Drop consumed bytes in one go once we are waiting for more data.
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._scan_from = max(0, self._scan_from - self._pos)
+            self._pos = 0
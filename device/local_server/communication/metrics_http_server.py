@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from typing import Optional
+
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_REQUEST_READ_TIMEOUT_SECONDS = 5.0
+_MAX_HEADER_LINES = 100
+
+def _http_response(status: str, body: bytes, content_type: str = "text/plain; charset=utf-8") -> bytes:
+    head = (f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n")
+    return head.encode("latin-1") + body
+
+async def _read_request_line(reader: asyncio.StreamReader) -> Optional[str]:
+    request_line = await reader.readline()
+    for _ in range(_MAX_HEADER_LINES): # Headers are not needed; read up to the blank line
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+    return request_line.decode("latin-1").strip() or None
+
+async def handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Answers one HTTP request: GET /metrics gets the Prometheus text format, anything else 404/405."""
+    try:
+        request_line = await asyncio.wait_for(_read_request_line(reader), _REQUEST_READ_TIMEOUT_SECONDS)
+        parts = request_line.split(" ") if request_line else []
+        if len(parts) < 2:
+            response = _http_response("400 Bad Request", b"Bad request\n")
+        elif parts[0] not in ("GET", "HEAD"):
+            response = _http_response("405 Method Not Allowed", b"Method not allowed\n")
+        elif parts[1].split("?", 1)[0] != "/metrics":
+            response = _http_response("404 Not Found", b"Not found; metrics are served at /metrics\n")
+        else:
+            body = metrics.render_prometheus().encode("utf-8")
+            response = _http_response("200 OK", body, PROMETHEUS_CONTENT_TYPE)
+            if parts[0] == "HEAD":
+                response = response[:len(response) - len(body)]
+        writer.write(response)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug(f"MetricsHTTPServer: Dropped request: {e!r}")
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+async def start_metrics_http_server(host: str, port: int):
+    """Serves GET /metrics for Prometheus until cancelled."""
+    server: Optional[asyncio.AbstractServer] = None
+    try:
+        server = await asyncio.start_server(handle_metrics_request, host, port)
+        addr = server.sockets[0].getsockname() if server.sockets else (host, port)
+        logger.info(f"MetricsHTTPServer: Serving Prometheus metrics on http://{addr[0]}:{addr[1]}/metrics")
+        async with server:
+            await server.serve_forever()
+    except OSError as e_os:
+        logger.error(f"MetricsHTTPServer: Failed to start on {host}:{port}. OS Error: {e_os}.", exc_info=True)
+        raise
+    except asyncio.CancelledError:
+        logger.info("MetricsHTTPServer: Serve forever task cancelled. Server shutting down.")
+    finally:
+        if server and server.is_serving():
+            server.close()
+            await server.wait_closed()
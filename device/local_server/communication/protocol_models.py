@@ -1,13 +1,38 @@
-from pydantic import BaseModel, Field, field_validator
-from typing import Any, Dict, Optional, Literal, List
+from pydantic import BaseModel, Field, field_validator, TypeAdapter
+from typing import Any, Dict, Optional, Literal, List, Type, Union
 import datetime
-import uuid
+import functools
+import os
+import time
+
+# --- Cheap ID / timestamp factories ---
+# Every outbound message gets a task_id and a timestamp. These produce the same formats as
+# str(uuid.uuid4()) and datetime.utcnow().isoformat() + "Z" at a fraction of the cost.
+
+def new_task_id() -> str:
+    """Random RFC 4122 version-4 UUID string."""
+    raw = bytearray(os.urandom(16))
+    raw[6] = (raw[6] & 0x0F) | 0x40 # version 4
+    raw[8] = (raw[8] & 0x3F) | 0x80 # RFC 4122 variant
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+_timestamp_cache = {"second": None, "prefix": ""}
+
+def utc_timestamp() -> str:
+    """ISO-8601 UTC timestamp with microseconds and a trailing Z. The date/time prefix is cached per second."""
+    now = time.time()
+    second = int(now)
+    if _timestamp_cache["second"] != second:
+        _timestamp_cache["prefix"] = datetime.datetime.utcfromtimestamp(second).strftime("%Y-%m-%dT%H:%M:%S")
+        _timestamp_cache["second"] = second
+    return f"{_timestamp_cache['prefix']}.{int((now - second) * 1_000_000):06d}Z"
 
 # --- Base Message Structure ---
 class BaseMessage(BaseModel):
-    task_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    task_id: str = Field(default_factory=new_task_id)
     message_type: str
-    timestamp: str = Field(default_factory=lambda: datetime.datetime.utcnow().isoformat() + "Z")
+    timestamp: str = Field(default_factory=utc_timestamp)
     payload: Dict[str, Any]
 
 # --- Payload Definitions for Specific Message Types ---
@@ -24,8 +49,12 @@ class QueryLocalModelDirectDetails(BaseModel):
 class GetLocalStatusDetails(BaseModel):
     pass # No specific details needed
 
+class CancelTaskDetails(BaseModel):
+    task_id: str # task_id of the execute_owl_task / query_local_model_direct command (or full-flow request_id) to cancel
+    reason: Optional[str] = None
+
 class RemoteCommandPayloadDetails(BaseModel):
-    command_action: Literal["execute_owl_task", "query_local_model_direct", "get_local_status"]
+    command_action: Literal["execute_owl_task", "query_local_model_direct", "get_local_status", "cancel_task"]
     command_details: Dict[str, Any] # This will be one of the above detail models when parsed
 
 class RemoteCommandToLocalPayload(BaseModel):
@@ -33,15 +62,16 @@ class RemoteCommandToLocalPayload(BaseModel):
     # The plan had command_action and command_details at the same level as payload.
     # Here, they are inside the payload for consistency with BaseMessage.
     # The actual `payload` in BaseMessage will be this model.
-    command_action: Literal["execute_owl_task", "query_local_model_direct", "get_local_status"]
+    command_action: Literal["execute_owl_task", "query_local_model_direct", "get_local_status", "cancel_task"]
     command_details: Optional[Dict[str, Any]] = None # Specific to command_action
 
 # 3.1.2. local_response_to_remote
 class LocalResponseToRemotePayload(BaseModel):
     original_command_action: str
-    status: Literal["success", "error", "processing_async"]
+    status: Literal["success", "error", "processing_async", "busy", "cancelled"]
     data: Optional[Dict[str, Any]] = None
     error_message: Optional[str] = None
+    retry_after_seconds: Optional[float] = None # Set with status "busy": when the cloud should try again
 
 # 3.1.3. local_request_cloud_refinement
 class ConfidenceAssessmentData(BaseModel):
@@ -56,6 +86,7 @@ class LocalRequestCloudRefinementPayload(BaseModel):
     local_model_draft_result: str
     confidence_assessment: ConfidenceAssessmentData 
     refinement_hints: Optional[Dict[str, Any]] = None
+    stream: bool = False # Ask the cloud for cloud_refinement_chunk messages before the final response
 
 # 3.1.4. cloud_refinement_response_to_local
 class CloudRefinementDiagnostics(BaseModel):
@@ -70,6 +101,35 @@ class CloudRefinementResponseToLocalPayload(BaseModel):
     error_message: Optional[str] = None
     diagnostics: Optional[CloudRefinementDiagnostics] = None
 
+# 3.1.4a. cloud_refinement_chunk
+# Sent zero or more times for a streamed refinement (same task_id as the request), in sequence order.
+# The stream ends with a regular cloud_refinement_response_to_local carrying the full result.
+class CloudRefinementChunkPayload(BaseModel):
+    sequence: int
+    delta: str
+
+# 3.1.4b. local_request_cloud_batch_refinement / cloud_batch_refinement_response
+# Several refinement requests in one message (the TCP counterpart of /api/v1/batch_refinement in
+# cloud/cloud_api_specification.md). The response carries one result per request_id; results may come
+# back in any order.
+MAX_BATCH_REFINEMENT_ITEMS = 20 # The cloud's limit on sub-requests per batch
+
+class BatchRefinementItem(LocalRequestCloudRefinementPayload):
+    request_id: str # Matches the item to its result within the batch
+
+class LocalRequestCloudBatchRefinementPayload(BaseModel):
+    batch_id: str
+    requests: List[BatchRefinementItem]
+
+class BatchRefinementResult(CloudRefinementResponseToLocalPayload):
+    request_id: str
+
+class CloudBatchRefinementResponseToLocalPayload(BaseModel):
+    batch_id: str
+    results: List[BatchRefinementResult]
+    total_processing_time_ms: Optional[int] = None
+    total_tokens_consumed: Optional[int] = None
+
 # 3.1.5. local_confident_result_notification
 class LocalConfidentResultNotificationPayload(BaseModel):
     original_user_prompt: str
@@ -86,6 +146,101 @@ class HeartbeatPayload(BaseModel):
     active_tasks_count: Optional[int] = None
     model_name: Optional[str] = None
     vllm_health_status: Optional[bool] = None
+    queued_commands_count: Optional[int] = None # Remote commands waiting for an admission slot
+    rejected_commands_count: Optional[int] = None # Remote commands answered "busy" since startup
+    # Delta-encoded host/pipeline metrics: {"seq": n, "full": bool, "values": {flat_key: value}}.
+    # Non-full beats only list values that changed since beat seq-1 (see utils.metrics.heartbeat_delta).
+    metrics: Optional[Dict[str, Any]] = None
+
+# --- Fast-path parsing ---
+# Inbound messages used to be validated as BaseMessage and then again as their payload model.
+# parse_incoming_message() checks only the envelope and defers payload validation until a handler
+# asks for it, using TypeAdapters that are built once per model and reused.
+
+MESSAGE_PAYLOAD_MODELS: Dict[str, Type[BaseModel]] = {
+    "remote_command_to_local": RemoteCommandToLocalPayload,
+    "local_response_to_remote": LocalResponseToRemotePayload,
+    "local_request_cloud_refinement": LocalRequestCloudRefinementPayload,
+    "cloud_refinement_response_to_local": CloudRefinementResponseToLocalPayload,
+    "cloud_refinement_response": CloudRefinementResponseToLocalPayload,
+    "cloud_refinement_chunk": CloudRefinementChunkPayload,
+    "local_request_cloud_batch_refinement": LocalRequestCloudBatchRefinementPayload,
+    "cloud_batch_refinement_response": CloudBatchRefinementResponseToLocalPayload,
+    "local_confident_result_notification": LocalConfidentResultNotificationPayload,
+    "heartbeat": HeartbeatPayload,
+}
+
+COMMAND_DETAIL_MODELS: Dict[str, Type[BaseModel]] = {
+    "execute_owl_task": ExecuteOwlTaskDetails,
+    "query_local_model_direct": QueryLocalModelDirectDetails,
+    "get_local_status": GetLocalStatusDetails,
+    "cancel_task": CancelTaskDetails,
+}
+
+class ProtocolValidationError(ValueError):
+    """Raised when an incoming message envelope is malformed."""
+    pass
+
+@functools.lru_cache(maxsize=None)
+def get_type_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(model)
+
+def validate_model(model: Type[BaseModel], data: Optional[Dict[str, Any]]) -> BaseModel:
+    """Validates a dict against a model through its cached TypeAdapter."""
+    return get_type_adapter(model).validate_python(data if data is not None else {})
+
+class IncomingMessage:
+    """Envelope of a received message whose payload is parsed only on first access."""
+    __slots__ = ("task_id", "message_type", "timestamp", "payload", "_parsed_payload")
+
+    def __init__(self, task_id: str, message_type: str, timestamp: Optional[str], payload: Dict[str, Any]):
+        self.task_id = task_id
+        self.message_type = message_type
+        self.timestamp = timestamp
+        self.payload = payload # Raw dict, always available without validation
+        self._parsed_payload: Optional[BaseModel] = None
+
+    def parsed_payload(self, model: Optional[Type[BaseModel]] = None) -> Union[BaseModel, Dict[str, Any]]:
+        """
+        Returns the payload validated against `model` (or the model registered for this message_type).
+        Message types without a registered model return the raw dict.
+        """
+        if self._parsed_payload is not None and (model is None or isinstance(self._parsed_payload, model)):
+            return self._parsed_payload
+        if model is None:
+            model = MESSAGE_PAYLOAD_MODELS.get(self.message_type)
+            if model is None:
+                return self.payload
+        self._parsed_payload = validate_model(model, self.payload)
+        return self._parsed_payload
+
+def parse_incoming_message(message_dict: Dict[str, Any], trusted: bool = False) -> IncomingMessage:
+    """
+    Cheap replacement for BaseMessage(**message_dict) on the receive path.
+    With trusted=True (a peer we control, e.g. our own cloud over a private link) the envelope
+    type checks are skipped as well. Payloads are validated either way: building a pydantic model
+    without validation (model_construct) is slower than validating it through a cached TypeAdapter.
+    """
+    if trusted:
+        return IncomingMessage(message_dict.get("task_id") or new_task_id(), message_dict.get("message_type"),
+                               message_dict.get("timestamp"), message_dict.get("payload") or {})
+    if not isinstance(message_dict, dict):
+        raise ProtocolValidationError(f"Message must be an object, got {type(message_dict).__name__}")
+    task_id = message_dict.get("task_id")
+    if task_id is None:
+        task_id = new_task_id()
+    elif not isinstance(task_id, str):
+        raise ProtocolValidationError("task_id must be a string")
+    message_type = message_dict.get("message_type")
+    if not isinstance(message_type, str):
+        raise ProtocolValidationError("message_type is required and must be a string")
+    payload = message_dict.get("payload")
+    if not isinstance(payload, dict):
+        raise ProtocolValidationError("payload is required and must be an object")
+    timestamp = message_dict.get("timestamp")
+    if timestamp is not None and not isinstance(timestamp, str):
+        raise ProtocolValidationError("timestamp must be a string")
+    return IncomingMessage(task_id, message_type, timestamp, payload)
 
 # --- Helper for creating typed messages ---
 # This is more of a conceptual helper, actual usage will involve constructing BaseMessage
@@ -95,12 +250,12 @@ class HeartbeatPayload(BaseModel):
 # cmd_payload = RemoteCommandToLocalPayload(command_action="get_local_status")
 # msg = BaseMessage(message_type="remote_command_to_local", payload=cmd_payload.model_dump())
 
-# When receiving, you'd parse to BaseMessage, then based on message_type, parse payload dict to specific model:
-# base_msg = BaseMessage(**incoming_dict)
-# if base_msg.message_type == "remote_command_to_local":
-#     cmd_payload = RemoteCommandToLocalPayload(**base_msg.payload)
+# When receiving, parse the envelope cheaply, then based on message_type, parse payload dict to specific model:
+# incoming = parse_incoming_message(incoming_dict)
+# if incoming.message_type == "remote_command_to_local":
+#     cmd_payload = incoming.parsed_payload()
 #     if cmd_payload.command_action == "get_local_status":
 #         details = GetLocalStatusDetails() # No details to parse for this one
 #     elif cmd_payload.command_action == "query_local_model_direct":
-#         details = QueryLocalModelDirectDetails(**cmd_payload.command_details)
+#         details = validate_model(QueryLocalModelDirectDetails, cmd_payload.command_details)
 
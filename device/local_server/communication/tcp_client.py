@@ -1,11 +1,18 @@
 import asyncio
 import json
-from typing import Dict, Any, Optional, Callable, Awaitable
+import time
+from typing import Dict, Any, Optional, Callable, Awaitable, List
 import logging
-import uuid # Ensure uuid is imported
 
 from ..core.config import settings
-from .protocol_models import BaseMessage, HeartbeatPayload, LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload, LocalConfidentResultNotificationPayload
+from ..utils.metrics import metrics
+from .protocol_models import BaseMessage, HeartbeatPayload, LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload, LocalConfidentResultNotificationPayload, CloudRefinementChunkPayload, LocalRequestCloudBatchRefinementPayload, CloudBatchRefinementResponseToLocalPayload, IncomingMessage, parse_incoming_message, validate_model, new_task_id
+from .write_queue import OutboundWriteQueue, WriteQueueClosedError
+from .framing import (
+    FRAMING_JSON, FRAMING_JSON_FRAMED, COMPRESSION_NONE, HELLO_ACK_MESSAGE_TYPE, JsonLineCodec, FramingError,
+    FrameDecoder, FrameTooLargeError, READ_CHUNK_SIZE,
+    build_hello_message, get_codec, supported_compressions, supported_framings
+)
 
 logger = logging.getLogger(__name__) 
 
@@ -21,217 +28,402 @@ class TCPClientTimeoutError(TCPClientError):
     """Raised on request timeout."""
     pass
 
-class TCPRemoteClient:
-    def __init__(self, 
-                 host: str, 
-                 port: int, 
-                 client_id: str,
-                 on_unsolicited_message_callback: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
-                 on_disconnect_callback: Optional[Callable[[], Awaitable[None]]] = None):
-        self.host = host
-        self.port = port
-        self.client_id = client_id
+class CloudRefinementStream:
+    """
+    Async iterator over one streamed cloud refinement. Yields CloudRefinementChunkPayload objects in
+    sequence order and stops once the cloud's final response arrives; that response is then available
+    as `final`. A cloud that does not stream simply sends the final response, so iteration yields nothing.
+    """
+    def __init__(self, conn: "_PooledConnection", task_id: str, timeout: float, chunk_timeout: float):
+        self._conn = conn
+        self.task_id = task_id
+        self.final: Optional[CloudRefinementResponseToLocalPayload] = None
+        self.time_to_first_chunk_ms: Optional[int] = None
+        self.chunks_received = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._started = time.monotonic()
+        self._deadline = self._started + timeout
+        self._chunk_timeout = chunk_timeout
+        self._last_sequence = -1
+        self._done = False
+
+    def _feed(self, incoming: IncomingMessage):
+        self._queue.put_nowait(incoming)
+
+    def _fail(self, error: Exception):
+        self._queue.put_nowait(error)
+
+    def _finish(self):
+        self._done = True
+        self._conn.active_streams.pop(self.task_id, None)
+        self._conn.unacked.pop(self.task_id, None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> CloudRefinementChunkPayload:
+        while not self._done:
+            wait = min(self._deadline - time.monotonic(), self._chunk_timeout)
+            try:
+                if wait <= 0:
+                    raise asyncio.TimeoutError()
+                item = await asyncio.wait_for(self._queue.get(), timeout=wait)
+            except asyncio.TimeoutError as e_timeout:
+                self._finish()
+                logger.warning(f"TCPClient ({self._conn.name}): Timeout waiting for refinement stream data for task {self.task_id} after {self.chunks_received} chunk(s).")
+                raise TCPClientTimeoutError(f"Timeout for streamed task {self.task_id}") from e_timeout
+            if isinstance(item, Exception):
+                self._finish()
+                raise item
+
+            if item.message_type == "cloud_refinement_chunk":
+                chunk = item.parsed_payload(CloudRefinementChunkPayload)
+                if chunk.sequence <= self._last_sequence:
+                    logger.debug(f"TCPClient ({self._conn.name}): Dropping duplicate chunk {chunk.sequence} for task {self.task_id}.")
+                    continue
+                if chunk.sequence != self._last_sequence + 1:
+                    logger.warning(f"TCPClient ({self._conn.name}): Refinement stream for task {self.task_id} skipped from chunk {self._last_sequence} to {chunk.sequence}.")
+                self._last_sequence = chunk.sequence
+                self.chunks_received += 1
+                if self.time_to_first_chunk_ms is None:
+                    self.time_to_first_chunk_ms = int((time.monotonic() - self._started) * 1000)
+                return chunk
+
+            # Any other message for this task ends the stream; normally the full refinement response.
+            self._finish()
+            try:
+                self.final = validate_model(CloudRefinementResponseToLocalPayload, item.payload)
+            except Exception as e_resp:
+                raise TCPClientError(f"Invalid final response for streamed task {self.task_id}: {e_resp}") from e_resp
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        """Stops listening for this task; late chunks are then treated as unsolicited messages."""
+        self._finish()
+
+class _UnackedRequest:
+    """A request whose response has not arrived yet, kept so it can be replayed on a new socket."""
+    __slots__ = ("message", "deadline", "seq")
+
+    def __init__(self, message: BaseMessage, deadline: float):
+        self.message = message
+        self.deadline = deadline # time.monotonic() after which the caller has given up
+        self.seq = 0 # Session sequence number of the most recent send
+
+class _PooledConnection:
+    """
+    One socket to the cloud server. Each connection owns its reader/writer, framing, receive loop and
+    the futures of requests that were routed to it, so it can fail and reconnect independently of the
+    other connections in the pool.
+
+    With remote_server.session_resume_enabled, a dropped socket does not fail those futures: requests
+    still within their deadline stay pending until the connection is back. Messages are numbered per
+    session and the hello announces the session, so a session-aware cloud can confirm in its hello ack
+    that it resumed the session and report what it already received; only requests past that point
+    are sent again (same task_id). A peer that does not confirm the session gets nothing replayed,
+    since it could not tell a replay from a new request; those requests fail as if resume were off.
+    """
+    def __init__(self, client: "TCPRemoteClient", index: int):
+        self.client = client
+        self.index = index
+        self.name = f"{client.client_id}#{index}"
         self.reader: Optional[asyncio.StreamReader] = None
         self.writer: Optional[asyncio.StreamWriter] = None
         self.is_connected = False
-        self.on_unsolicited_message_callback = on_unsolicited_message_callback
-        self.on_disconnect_callback = on_disconnect_callback
-        self._receive_loop_task: Optional[asyncio.Task] = None
-        self._pending_requests: Dict[str, asyncio.Future] = {}
-        self._heartbeat_task: Optional[asyncio.Task] = None
-        self._connection_lock = asyncio.Lock()
-        self._shutdown_event = asyncio.Event()
+        self.receive_loop_task: Optional[asyncio.Task] = None
+        self.pending_requests: Dict[str, asyncio.Future] = {}
+        self.active_streams: Dict[str, CloudRefinementStream] = {}
+        self.connection_lock = asyncio.Lock()
+        self.codec = JsonLineCodec()
+        self.write_queue: Optional[OutboundWriteQueue] = None
+        self.session_id = f"{client.session_id}-{index}"
+        self.sent_seq = 0 # Messages sent in this session (survives reconnects)
+        self.received_seq = 0 # Messages received in this session
+        self.unacked: Dict[str, _UnackedRequest] = {}
+        self.replayed_count = 0
+
+    @property
+    def outstanding_count(self) -> int:
+        return len(self.pending_requests) + len(self.active_streams)
 
     async def connect(self) -> bool:
-        async with self._connection_lock:
+        async with self.connection_lock:
             if self.is_connected:
                 return True
-            if self._shutdown_event.is_set():
-                logger.info(f"TCPClient ({self.client_id}): Shutdown in progress, not connecting.")
+            if self.client._shutdown_event.is_set():
+                logger.info(f"TCPClient ({self.name}): Shutdown in progress, not connecting.")
                 return False
+            host, port = self.client.host, self.client.port
+            peer_session = None
             try:
-                logger.info(f"TCPClient ({self.client_id}): Attempting to connect to {self.host}:{self.port}")
-                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                logger.info(f"TCPClient ({self.name}): Attempting to connect to {host}:{port}")
+                self.reader, self.writer = await asyncio.open_connection(host, port)
+                self.codec = JsonLineCodec()
+                peer_session = await self._negotiate_framing()
+                self.write_queue = self._new_write_queue()
                 self.is_connected = True
-                logger.info(f"TCPClient ({self.client_id}): Successfully connected to {self.host}:{self.port}")
+                logger.info(f"TCPClient ({self.name}): Successfully connected to {host}:{port} using {self.codec.name} framing")
                 
-                if self._receive_loop_task is None or self._receive_loop_task.done():
-                    self._receive_loop_task = asyncio.create_task(self._receive_messages_loop())
-                return True
+                if self.receive_loop_task is None or self.receive_loop_task.done():
+                    self.receive_loop_task = asyncio.create_task(self._receive_messages_loop())
             except ConnectionRefusedError as e:
-                logger.warning(f"TCPClient ({self.client_id}): Connection refused by {self.host}:{self.port}. {e}")
+                logger.warning(f"TCPClient ({self.name}): Connection refused by {host}:{port}. {e}")
             except asyncio.TimeoutError as e:
-                logger.warning(f"TCPClient ({self.client_id}): Connection attempt to {self.host}:{self.port} timed out. {e}")
+                logger.warning(f"TCPClient ({self.name}): Connection attempt to {host}:{port} timed out. {e}")
             except OSError as e: # Catch other OS-level errors like host not found
-                logger.error(f"TCPClient ({self.client_id}): OS error connecting to {self.host}:{self.port}: {e}")
+                logger.error(f"TCPClient ({self.name}): OS error connecting to {host}:{port}: {e}")
             except Exception as e:
-                logger.error(f"TCPClient ({self.client_id}): Failed to connect to {self.host}:{self.port}: {e}", exc_info=True)
-            
-            self.is_connected = False # Ensure is_connected is false if any exception occurs
-            return False
+                logger.error(f"TCPClient ({self.name}): Failed to connect to {host}:{port}: {e}", exc_info=True)
+            if not self.is_connected: # Any exception above leaves it false
+                return False
+
+        # Outside the lock: a failed replay send goes through handle_disconnection, which takes it.
+        await self._replay_unacked(peer_session)
+        return True
+
+    def _can_resume(self, task_id: str, now: float) -> bool:
+        entry = self.unacked.get(task_id)
+        return entry is not None and entry.deadline > now
+
+    def _fail_unacked(self, task_ids: List[str], reason: str):
+        for task_id in task_ids:
+            self.unacked.pop(task_id, None)
+            future = self.pending_requests.pop(task_id, None)
+            if future is not None and not future.done():
+                future.set_exception(TCPClientConnectionError(f"{reason} (task {task_id})"))
+            stream = self.active_streams.pop(task_id, None)
+            if stream is not None:
+                stream._fail(TCPClientConnectionError(f"{reason} (task {task_id})"))
+
+    async def _replay_unacked(self, peer_session: Optional[Dict[str, Any]]):
+        """Re-sends requests that were in flight when the previous socket dropped, if the peer resumed the session."""
+        if not self.unacked:
+            return
+        server_seq = peer_session.get("last_received_seq") if peer_session and peer_session.get("resumed") is True else None
+        if not isinstance(server_seq, int):
+            # Replaying to a peer that cannot dedupe by task_id could run (and bill) a refinement twice.
+            logger.warning(f"TCPClient ({self.name}): Server did not resume session {self.session_id}; failing {len(self.unacked)} in-flight request(s) instead of replaying.")
+            self._fail_unacked(list(self.unacked), "Connection lost and the server did not resume the session")
+            return
+        now = time.monotonic()
+        for task_id, entry in sorted(self.unacked.items(), key=lambda item: item[1].seq):
+            if entry.deadline <= now:
+                continue # The caller times out on its own
+            if entry.seq <= server_seq:
+                logger.info(f"TCPClient ({self.name}): Server already has task {task_id} (seq {entry.seq}); waiting for its response.")
+                continue
+            logger.info(f"TCPClient ({self.name}): Replaying {entry.message.message_type} for task {task_id} after reconnect.")
+            self.replayed_count += 1
+            if not await self.send(entry.message):
+                break
+
+    async def _negotiate_framing(self) -> Optional[Dict[str, Any]]:
+        """
+        Offers the configured framing to the server with a protocol_hello sent as plain JSON.
+        Anything other than a matching ack within the timeout (e.g. an older server that ignores
+        the hello) leaves the connection on newline-delimited JSON.
+        Compression rides on the frame flags byte, so asking for it with plain JSON offers
+        length-prefixed JSON instead.
+        With remote_server.session_resume_enabled the hello also carries this connection's
+        session id and last received sequence number; returns the peer's "session" ack, if any.
+        """
+        preferred = settings.remote_server.wire_framing
+        compression = settings.remote_server.wire_compression
+        if compression != COMPRESSION_NONE and compression not in supported_compressions():
+            logger.warning(f"TCPClient ({self.name}): Compression '{compression}' is not available locally, sending uncompressed.")
+            compression = COMPRESSION_NONE
+        if preferred == FRAMING_JSON and compression != COMPRESSION_NONE:
+            preferred = FRAMING_JSON_FRAMED
+        if preferred not in supported_framings():
+            logger.warning(f"TCPClient ({self.name}): Framing '{preferred}' is not available locally, using JSON.")
+            preferred = FRAMING_JSON
+        session = None
+        if settings.remote_server.session_resume_enabled:
+            session = {"session_id": self.session_id, "last_acked_seq": self.received_seq}
+        if preferred == FRAMING_JSON and session is None:
+            return None
+        hello = build_hello_message(preferred, self.client.client_id, compression, session)
+        try:
+            self.writer.write(self.codec.encode(hello))
+            await self.writer.drain()
+            ack_line = await asyncio.wait_for(self.reader.readline(), timeout=settings.remote_server.protocol_hello_timeout_seconds)
+            ack = json.loads(ack_line) if ack_line.strip() else {}
+            if ack.get("message_type") == HELLO_ACK_MESSAGE_TYPE and ack.get("task_id") == hello.task_id:
+                ack_payload = ack.get("payload", {})
+                self.codec = get_codec(ack_payload.get("framing", FRAMING_JSON), ack_payload.get("compression"))
+                peer_session = ack_payload.get("session")
+                if isinstance(peer_session, dict):
+                    logger.info(f"TCPClient ({self.name}): Session {self.session_id} {'resumed' if peer_session.get('resumed') else 'started'} "
+                                f"(server received up to seq {peer_session.get('last_received_seq')}).")
+                    return peer_session
+            else:
+                logger.warning(f"TCPClient ({self.name}): Unexpected reply to protocol_hello, using JSON: {ack_line[:200]!r}")
+        except asyncio.TimeoutError:
+            logger.info(f"TCPClient ({self.name}): No protocol_hello ack from server, using JSON framing.")
+        except (json.JSONDecodeError, FramingError) as e:
+            logger.warning(f"TCPClient ({self.name}): Invalid protocol_hello ack ({e}), using JSON framing.")
+            self.codec = JsonLineCodec()
+        return None
+
+    async def _process_incoming_message(self, message_dict: Dict[str, Any]):
+        # Envelope only; the payload is validated by whoever awaits the future.
+        incoming = parse_incoming_message(message_dict, trusted=settings.remote_server.trusted_peer)
+        self.received_seq += 1
+
+        if incoming.task_id in self.pending_requests:
+            future = self.pending_requests.pop(incoming.task_id)
+            self.unacked.pop(incoming.task_id, None)
+            if not future.done():
+                future.set_result(incoming.payload)
+            else:
+                logger.warning(f"TCPClient ({self.name}): Future for task {incoming.task_id} was already done.")
+        elif incoming.task_id in self.active_streams:
+            self.active_streams[incoming.task_id]._feed(incoming)
+        elif self.client.on_unsolicited_message_callback:
+            asyncio.create_task(self.client.on_unsolicited_message_callback(message_dict))
+        else:
+            logger.warning(f"TCPClient ({self.name}): Received message for task_id {incoming.task_id} but no pending request or unsolicited message callback.")
 
     async def _receive_messages_loop(self):
-        logger.info(f"TCPClient ({self.client_id}): Receive loop started.")
-        message_buffer = ""
-        while self.is_connected and self.reader and not self._shutdown_event.is_set():
+        logger.info(f"TCPClient ({self.name}): Receive loop started.")
+        decoder = FrameDecoder(max_frame_size=settings.remote_server.max_frame_size_bytes, length_prefixed=self.codec.length_prefixed)
+        while self.is_connected and self.reader and not self.client._shutdown_event.is_set():
             try:
-                data = await self.reader.read(4096) # Read a chunk of data
+                data = await self.reader.read(READ_CHUNK_SIZE) # Read a chunk of data
                 if not data:
-                    logger.warning(f"TCPClient ({self.client_id}): Connection closed by server (received empty data).")
-                    await self._handle_disconnection()
+                    logger.warning(f"TCPClient ({self.name}): Connection closed by server (received empty data).")
+                    await self.handle_disconnection()
                     break
-                
-                message_buffer += data.decode("utf-8")
-                
-                # Process all newline-terminated messages in the buffer
-                while "\n" in message_buffer:
-                    message_str, message_buffer = message_buffer.split("\n", 1)
-                    message_str = message_str.strip()
-                    if not message_str: # Skip empty lines after strip
-                        continue
-                    
-                    logger.debug(f"TCPClient ({self.client_id}): Received raw message: {message_str}")
+
+                decoder.feed(data)
+                # Process every complete frame in the buffer; a partial frame stays buffered for the next read.
+                while (frame := decoder.next_frame()) is not None:
+                    if not self.codec.length_prefixed:
+                        frame = frame.strip()
+                        if not frame: # Skip empty lines after strip
+                            continue
+
+                    logger.debug(f"TCPClient ({self.name}): Received {len(frame)}-byte {self.codec.name} frame.")
                     try:
-                        message_dict = json.loads(message_str)
-                        base_msg = BaseMessage(**message_dict) # Validate base structure
-
-                        if base_msg.task_id in self._pending_requests:
-                            future = self._pending_requests.pop(base_msg.task_id)
-                            if not future.done():
-                                future.set_result(base_msg.payload)
-                            else:
-                                logger.warning(f"TCPClient ({self.client_id}): Future for task {base_msg.task_id} was already done.")
-                        elif self.on_unsolicited_message_callback:
-                            asyncio.create_task(self.on_unsolicited_message_callback(message_dict))
-                        else:
-                            logger.warning(f"TCPClient ({self.client_id}): Received message for task_id {base_msg.task_id} but no pending request or unsolicited message callback.")
+                        await self._process_incoming_message(self.codec.decode(frame, decoder.last_flags))
                     except json.JSONDecodeError as e_json:
-                        logger.error(f"TCPClient ({self.client_id}): JSON decode error: {e_json} for data: {message_str}")
-                    except Exception as e_msg_proc: # Catch errors from Pydantic validation or callback
-                        logger.error(f"TCPClient ({self.client_id}): Error processing message: {e_msg_proc} for data: {message_str}", exc_info=True)
+                        logger.error(f"TCPClient ({self.name}): JSON decode error: {e_json} for data: {frame[:1024]!r}")
+                    except Exception as e_msg_proc: # Catch errors from decoding, Pydantic validation or callback
+                        logger.error(f"TCPClient ({self.name}): Error processing {self.codec.name} frame: {e_msg_proc}", exc_info=True)
 
+            except FrameTooLargeError as e_too_large:
+                logger.error(f"TCPClient ({self.name}): {e_too_large}. Dropping connection.")
+                await self.handle_disconnection()
+                break
             except ConnectionResetError:
-                logger.warning(f"TCPClient ({self.client_id}): Connection reset by peer.")
-                await self._handle_disconnection()
+                logger.warning(f"TCPClient ({self.name}): Connection reset by peer.")
+                await self.handle_disconnection()
                 break
             except asyncio.IncompleteReadError:
-                logger.warning(f"TCPClient ({self.client_id}): Incomplete read, connection likely closed.")
-                await self._handle_disconnection()
+                logger.warning(f"TCPClient ({self.name}): Incomplete read, connection likely closed.")
+                await self.handle_disconnection()
                 break
             except Exception as e_loop:
-                logger.error(f"TCPClient ({self.client_id}): Error in receive loop: {e_loop}", exc_info=True)
-                await self._handle_disconnection()
+                logger.error(f"TCPClient ({self.name}): Error in receive loop: {e_loop}", exc_info=True)
+                await self.handle_disconnection()
                 break
-        logger.info(f"TCPClient ({self.client_id}): Receive loop ended.")
+        logger.info(f"TCPClient ({self.name}): Receive loop ended.")
+
+    def _new_write_queue(self) -> OutboundWriteQueue:
+        async def _on_write_error(error: Exception):
+            await self.handle_disconnection()
+        return OutboundWriteQueue(self.writer, self.name, on_error=_on_write_error)
 
-    async def _send_message_internal(self, message: BaseMessage) -> bool:
+    async def send(self, message: BaseMessage, wait_flushed: bool = False) -> bool:
+        """
+        Queues a message on this connection's coalescing writer. By default returns once queued;
+        with wait_flushed=True, only after the batch containing it has been drained to the socket.
+        """
         if not self.is_connected or not self.writer or self.writer.is_closing():
-            logger.warning(f"TCPClient ({self.client_id}): Not connected or writer closed, cannot send message type {message.message_type}.")
+            logger.warning(f"TCPClient ({self.name}): Not connected or writer closed, cannot send message type {message.message_type}.")
             return False
+        if self.write_queue is None or self.write_queue.writer is not self.writer:
+            self.write_queue = self._new_write_queue()
         try:
-            json_message = message.model_dump_json()
-            logger.debug(f"TCPClient ({self.client_id}): Sending: {json_message}")
-            self.writer.write(json_message.encode("utf-8") + b"\n")
-            await self.writer.drain()
+            logger.debug(f"TCPClient ({self.name}): Sending {message.message_type} (task {message.task_id}) via {self.codec.name} framing.")
+            frame = self.codec.encode(message)
+            self.sent_seq += 1
+            unacked = self.unacked.get(message.task_id)
+            if unacked is not None:
+                unacked.seq = self.sent_seq
+            await self.write_queue.enqueue(frame, wait_flushed=wait_flushed)
             return True
-        except ConnectionResetError:
-            logger.warning(f"TCPClient ({self.client_id}): Connection reset while sending message type {message.message_type}.")
-            await self._handle_disconnection()
+        except (ConnectionResetError, WriteQueueClosedError):
+            logger.warning(f"TCPClient ({self.name}): Connection reset while sending message type {message.message_type}.")
+            await self.handle_disconnection()
         except Exception as e:
-            logger.error(f"TCPClient ({self.client_id}): Error sending message type {message.message_type}: {e}", exc_info=True)
-            await self._handle_disconnection()
+            logger.error(f"TCPClient ({self.name}): Error sending message type {message.message_type}: {e}", exc_info=True)
+            await self.handle_disconnection()
         return False
 
-    async def send_heartbeat(self, hb_payload_override: Optional[HeartbeatPayload] = None) -> bool:
-        payload = hb_payload_override if hb_payload_override else HeartbeatPayload(
-            local_server_id=self.client_id,
-            status="ok",
-            model_name=settings.vllm.model_name_or_path,
-            # TODO: Add actual vllm_health_status and active_tasks_count here
-        )
-        message = BaseMessage(message_type="heartbeat", payload=payload.model_dump())
-        return await self._send_message_internal(message)
-
-    async def request_cloud_refinement(self, request_data: LocalRequestCloudRefinementPayload, timeout: Optional[float] = None) -> Optional[CloudRefinementResponseToLocalPayload]:
-        if not self.is_connected:
-            logger.error(f"TCPClient ({self.client_id}): Cannot request cloud refinement, not connected.")
-            raise TCPClientConnectionError("Not connected to remote server for refinement")
-
-        task_id = str(uuid.uuid4())
-        message = BaseMessage(task_id=task_id, message_type="local_request_cloud_refinement", payload=request_data.model_dump())
-        
-        future = asyncio.get_event_loop().create_future()
-        self._pending_requests[task_id] = future
-        
-        if not await self._send_message_internal(message):
-            self._pending_requests.pop(task_id, None)
-            raise TCPClientConnectionError("Failed to send cloud refinement request")
-        
-        try:
-            effective_timeout = timeout if timeout is not None else settings.remote_server.cloud_request_timeout_seconds
-            logger.info(f"TCPClient ({self.client_id}): Waiting for cloud refinement response for task {task_id} with timeout {effective_timeout}s")
-            response_payload_dict = await asyncio.wait_for(future, timeout=effective_timeout)
-            return CloudRefinementResponseToLocalPayload(**response_payload_dict)
-        except asyncio.TimeoutError as e_timeout:
-            logger.warning(f"TCPClient ({self.client_id}): Timeout waiting for cloud refinement response for task {task_id}.")
-            raise TCPClientTimeoutError(f"Timeout for task {task_id}") from e_timeout
-        except Exception as e_resp:
-            logger.error(f"TCPClient ({self.client_id}): Error processing cloud refinement response for task {task_id}: {e_resp}", exc_info=True)
-            raise TCPClientError(f"Error processing response for task {task_id}: {e_resp}") from e_resp
-        finally:
-            self._pending_requests.pop(task_id, None)
-
-    async def send_confident_result_notification(self, notification_data: LocalConfidentResultNotificationPayload) -> bool:
-        message = BaseMessage(message_type="local_confident_result_notification", payload=notification_data.model_dump())
-        return await self._send_message_internal(message)
-
-    async def _handle_disconnection(self):
-        async with self._connection_lock:
+    async def handle_disconnection(self):
+        async with self.connection_lock:
             if not self.is_connected: # Already handled or in process
                 return
-            logger.warning(f"TCPClient ({self.client_id}): Handling disconnection from {self.host}:{self.port}.")
+            logger.warning(f"TCPClient ({self.name}): Handling disconnection from {self.client.host}:{self.client.port}.")
             self.is_connected = False
+            if self.write_queue:
+                self.write_queue.abort(TCPClientConnectionError("Connection lost"))
+                self.write_queue = None
             if self.writer:
                 try:
                     if not self.writer.is_closing():
                         self.writer.close()
                     await self.writer.wait_closed()
                 except Exception as e_writer_close:
-                    logger.debug(f"TCPClient ({self.client_id}): Error closing writer: {e_writer_close}")
+                    logger.debug(f"TCPClient ({self.name}): Error closing writer: {e_writer_close}")
             self.writer = None
             self.reader = None
             
-            for task_id, future in list(self._pending_requests.items()): # Iterate over a copy
+            # Only requests routed to this connection are affected; the rest of the pool keeps serving.
+            # With session resume, requests still within their deadline stay pending for replay after reconnect.
+            resume = settings.remote_server.session_resume_enabled and not self.client._shutdown_event.is_set()
+            now = time.monotonic()
+            for task_id, future in list(self.pending_requests.items()): # Iterate over a copy
+                if resume and self._can_resume(task_id, now):
+                    continue
                 if not future.done():
                     future.set_exception(TCPClientConnectionError(f"Connection lost while waiting for response to task {task_id}"))
-                self._pending_requests.pop(task_id, None)
+                self.pending_requests.pop(task_id, None)
+                self.unacked.pop(task_id, None)
+            for task_id, stream in list(self.active_streams.items()):
+                if resume and self._can_resume(task_id, now):
+                    continue
+                stream._fail(TCPClientConnectionError(f"Connection lost while streaming response to task {task_id}"))
+                self.active_streams.pop(task_id, None)
+                self.unacked.pop(task_id, None)
+            if self.outstanding_count:
+                logger.info(f"TCPClient ({self.name}): Keeping {self.outstanding_count} in-flight request(s) for replay after reconnect.")
 
-            if self._receive_loop_task and not self._receive_loop_task.done():
-                self._receive_loop_task.cancel()
-                try: await self._receive_loop_task
-                except asyncio.CancelledError: logger.debug(f"TCPClient ({self.client_id}): Receive loop task cancelled.")
-                except Exception as e_task_cancel: logger.debug(f"TCPClient ({self.client_id}): Error awaiting cancelled receive loop: {e_task_cancel}")
-            self._receive_loop_task = None
+            if self.receive_loop_task and not self.receive_loop_task.done() and self.receive_loop_task is not asyncio.current_task():
+                self.receive_loop_task.cancel()
+                try: await self.receive_loop_task
+                except asyncio.CancelledError: logger.debug(f"TCPClient ({self.name}): Receive loop task cancelled.")
+                except Exception as e_task_cancel: logger.debug(f"TCPClient ({self.name}): Error awaiting cancelled receive loop: {e_task_cancel}")
+            self.receive_loop_task = None
 
-            if self.on_disconnect_callback:
-                try: await self.on_disconnect_callback()
-                except Exception as e_cb: logger.error(f"TCPClient ({self.client_id}): Error in on_disconnect_callback: {e_cb}", exc_info=True)
+        await self.client._on_connection_lost(self)
 
     async def maintain_connection_loop(self):
-        logger.info(f"TCPClient ({self.client_id}): Maintain connection loop started.")
         reconnect_delay = settings.remote_server.tcp_client_reconnect_delay_seconds
         max_reconnect_delay = settings.remote_server.tcp_client_max_reconnect_delay_seconds
+        shutdown_event = self.client._shutdown_event
 
-        while not self._shutdown_event.is_set():
+        while not shutdown_event.is_set():
             if not self.is_connected:
-                logger.info(f"TCPClient ({self.client_id}): Attempting to connect/reconnect.")
+                logger.info(f"TCPClient ({self.name}): Attempting to connect/reconnect.")
                 if await self.connect():
                     reconnect_delay = settings.remote_server.tcp_client_reconnect_delay_seconds # Reset delay on success
                 else:
-                    logger.info(f"TCPClient ({self.client_id}): Connection failed. Retrying in {reconnect_delay}s.")
+                    logger.info(f"TCPClient ({self.name}): Connection failed. Retrying in {reconnect_delay}s.")
                     try:
-                        await asyncio.wait_for(self._shutdown_event.wait(), timeout=reconnect_delay)
-                        if self._shutdown_event.is_set(): break # Exit if shutdown during sleep
+                        await asyncio.wait_for(shutdown_event.wait(), timeout=reconnect_delay)
+                        if shutdown_event.is_set(): break # Exit if shutdown during sleep
                     except asyncio.TimeoutError:
                         pass # Expected timeout, continue to retry
                     reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
@@ -239,13 +431,231 @@ class TCPRemoteClient:
                 # If connected, just wait for a short period or until shutdown is signaled.
                 # The actual disconnection is handled by the receive loop or send errors.
                 try:
-                    await asyncio.wait_for(self._shutdown_event.wait(), timeout=1.0) 
-                    if self._shutdown_event.is_set(): break
+                    await asyncio.wait_for(shutdown_event.wait(), timeout=1.0) 
+                    if shutdown_event.is_set(): break
                 except asyncio.TimeoutError:
                     pass # Normal check interval
+
+class TCPRemoteClient:
+    """
+    Client for the cloud server's command port. Holds a pool of connections (see
+    remote_server.tcp_client_pool_size); each request is routed to the live connection with the
+    fewest outstanding responses so one large refinement does not block the others behind it.
+    """
+    def __init__(self, 
+                 host: str, 
+                 port: int, 
+                 client_id: str,
+                 on_unsolicited_message_callback: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                 on_disconnect_callback: Optional[Callable[[], Awaitable[None]]] = None,
+                 pool_size: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.on_unsolicited_message_callback = on_unsolicited_message_callback
+        self.on_disconnect_callback = on_disconnect_callback
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._shutdown_event = asyncio.Event()
+        self.session_id = new_task_id() # Each pooled connection resumes "<session_id>-<index>"
+        effective_pool_size = pool_size if pool_size is not None else settings.remote_server.tcp_client_pool_size
+        self._connections: List[_PooledConnection] = [_PooledConnection(self, i) for i in range(max(1, effective_pool_size))]
+        self._route_cursor = 0 # Rotates the tie-break so equally loaded connections share traffic
+
+    # The first connection doubles as the "primary" for callers that predate pooling.
+    @property
+    def reader(self) -> Optional[asyncio.StreamReader]:
+        return self._connections[0].reader
+
+    @reader.setter
+    def reader(self, value: Optional[asyncio.StreamReader]):
+        self._connections[0].reader = value
+
+    @property
+    def writer(self) -> Optional[asyncio.StreamWriter]:
+        return self._connections[0].writer
+
+    @writer.setter
+    def writer(self, value: Optional[asyncio.StreamWriter]):
+        self._connections[0].writer = value
+
+    @property
+    def _receive_loop_task(self) -> Optional[asyncio.Task]:
+        return self._connections[0].receive_loop_task
+
+    @_receive_loop_task.setter
+    def _receive_loop_task(self, value: Optional[asyncio.Task]):
+        self._connections[0].receive_loop_task = value
+
+    @property
+    def _codec(self):
+        return self._connections[0].codec
+
+    @property
+    def is_connected(self) -> bool:
+        return any(conn.is_connected for conn in self._connections)
+
+    @is_connected.setter
+    def is_connected(self, value: bool):
+        self._connections[0].is_connected = value
+
+    @property
+    def _pending_requests(self) -> Dict[str, asyncio.Future]:
+        """Snapshot of outstanding requests across all connections."""
+        merged: Dict[str, asyncio.Future] = {}
+        for conn in self._connections:
+            merged.update(conn.pending_requests)
+        return merged
+
+    def get_pool_stats(self) -> List[Dict[str, Any]]:
+        return [{"connection": conn.index, "connected": conn.is_connected, "outstanding": conn.outstanding_count, "framing": conn.codec.name,
+                 "compression": conn.codec.compressor.stats.snapshot() if conn.codec.compressor else None,
+                 "session": {"session_id": conn.session_id, "sent_seq": conn.sent_seq, "received_seq": conn.received_seq, "replayed": conn.replayed_count}}
+                for conn in self._connections]
+
+    async def connect(self) -> bool:
+        """Connects every pooled connection that is not yet connected. True if at least one is up."""
+        results = await asyncio.gather(*(conn.connect() for conn in self._connections))
+        return any(results)
+
+    def _pick_connection(self) -> Optional[_PooledConnection]:
+        """Least-outstanding routing over the live connections."""
+        live = [conn for conn in self._connections if conn.is_connected]
+        if not live:
+            return None
+        self._route_cursor = (self._route_cursor + 1) % len(live)
+        rotated = live[self._route_cursor:] + live[:self._route_cursor]
+        return min(rotated, key=lambda conn: conn.outstanding_count)
+
+    def _connection_for_task(self, task_id: str) -> Optional[_PooledConnection]:
+        for conn in self._connections:
+            if task_id in conn.pending_requests or task_id in conn.active_streams:
+                return conn
+        return None
+
+    async def _send_message_internal(self, message: BaseMessage, wait_flushed: bool = False) -> bool:
+        # Responses come back on the socket the request went out on, so a request whose future is
+        # already registered must use that connection; everything else goes to the least loaded one.
+        conn = self._connection_for_task(message.task_id) or self._pick_connection()
+        if conn is None:
+            logger.warning(f"TCPClient ({self.client_id}): Not connected or writer closed, cannot send message type {message.message_type}.")
+            return False
+        return await conn.send(message, wait_flushed=wait_flushed)
+
+    async def _on_connection_lost(self, conn: _PooledConnection):
+        if self.is_connected or not self.on_disconnect_callback:
+            return
+        try: await self.on_disconnect_callback()
+        except Exception as e_cb: logger.error(f"TCPClient ({self.client_id}): Error in on_disconnect_callback: {e_cb}", exc_info=True)
+
+    async def send_heartbeat(self, hb_payload_override: Optional[HeartbeatPayload] = None) -> bool:
+        if hb_payload_override:
+            payload = hb_payload_override
+        else:
+            metrics_delta = metrics.heartbeat_delta()
+            payload = HeartbeatPayload(
+                local_server_id=self.client_id,
+                status="ok",
+                model_name=settings.vllm.model_name_or_path,
+                gpu_usage_percent=metrics.last_value("gpu_usage_percent"),
+                metrics=metrics_delta
+            )
+        message = BaseMessage(message_type="heartbeat", payload=payload.model_dump())
+        return await self._send_message_internal(message)
+
+    async def _request_response(self, message_type: str, payload: Dict[str, Any], timeout: Optional[float], description: str) -> Dict[str, Any]:
+        """Sends one request message and waits for the message the cloud answers it with (same task_id); returns that payload."""
+        if not self.is_connected:
+            logger.error(f"TCPClient ({self.client_id}): Cannot request {description}, not connected.")
+            raise TCPClientConnectionError(f"Not connected to remote server for {description}")
+
+        conn = self._pick_connection()
+        if conn is None:
+            raise TCPClientConnectionError(f"Not connected to remote server for {description}")
+
+        task_id = new_task_id()
+        message = BaseMessage(task_id=task_id, message_type=message_type, payload=payload)
+        effective_timeout = timeout if timeout is not None else settings.remote_server.cloud_request_timeout_seconds
+        
+        future = asyncio.get_event_loop().create_future()
+        conn.pending_requests[task_id] = future
+        conn.unacked[task_id] = _UnackedRequest(message, time.monotonic() + effective_timeout)
+        
+        if not await self._send_message_internal(message):
+            conn.pending_requests.pop(task_id, None)
+            conn.unacked.pop(task_id, None)
+            raise TCPClientConnectionError(f"Failed to send {description} request")
+        
+        try:
+            logger.info(f"TCPClient ({self.client_id}): Waiting for {description} response for task {task_id} with timeout {effective_timeout}s")
+            return await asyncio.wait_for(future, timeout=effective_timeout)
+        except asyncio.TimeoutError as e_timeout:
+            logger.warning(f"TCPClient ({self.client_id}): Timeout waiting for {description} response for task {task_id}.")
+            raise TCPClientTimeoutError(f"Timeout for task {task_id}") from e_timeout
+        finally:
+            conn.pending_requests.pop(task_id, None)
+            conn.unacked.pop(task_id, None)
+
+    async def request_cloud_refinement(self, request_data: LocalRequestCloudRefinementPayload, timeout: Optional[float] = None) -> Optional[CloudRefinementResponseToLocalPayload]:
+        response_payload_dict = await self._request_response("local_request_cloud_refinement", request_data.model_dump(), timeout, "cloud refinement")
+        try:
+            return validate_model(CloudRefinementResponseToLocalPayload, response_payload_dict)
+        except Exception as e_resp:
+            logger.error(f"TCPClient ({self.client_id}): Error processing cloud refinement response: {e_resp}", exc_info=True)
+            raise TCPClientError(f"Error processing cloud refinement response: {e_resp}") from e_resp
+
+    async def request_cloud_batch_refinement(self, batch: LocalRequestCloudBatchRefinementPayload, timeout: Optional[float] = None) -> CloudBatchRefinementResponseToLocalPayload:
+        """Sends several refinement requests as one local_request_cloud_batch_refinement message; `timeout` covers the whole batch."""
+        response_payload_dict = await self._request_response("local_request_cloud_batch_refinement", batch.model_dump(), timeout, "cloud batch refinement")
+        try:
+            return validate_model(CloudBatchRefinementResponseToLocalPayload, response_payload_dict)
+        except Exception as e_resp:
+            logger.error(f"TCPClient ({self.client_id}): Error processing cloud batch refinement response for batch {batch.batch_id}: {e_resp}", exc_info=True)
+            raise TCPClientError(f"Error processing batch refinement response for batch {batch.batch_id}: {e_resp}") from e_resp
+
+    async def stream_cloud_refinement(self, request_data: LocalRequestCloudRefinementPayload, timeout: Optional[float] = None) -> CloudRefinementStream:
+        """
+        Streaming variant of request_cloud_refinement. Sends the request with stream=True and returns a
+        CloudRefinementStream to iterate over the cloud's cloud_refinement_chunk messages as they arrive.
+        `timeout` bounds the whole exchange; remote_server.cloud_stream_chunk_timeout_seconds bounds each gap.
+        """
+        if not self.is_connected:
+            logger.error(f"TCPClient ({self.client_id}): Cannot stream cloud refinement, not connected.")
+            raise TCPClientConnectionError("Not connected to remote server for refinement")
+
+        conn = self._pick_connection()
+        if conn is None:
+            raise TCPClientConnectionError("Not connected to remote server for refinement")
+
+        task_id = new_task_id()
+        stream_request = request_data.model_copy(update={"stream": True})
+        message = BaseMessage(task_id=task_id, message_type="local_request_cloud_refinement", payload=stream_request.model_dump())
+        effective_timeout = timeout if timeout is not None else settings.remote_server.cloud_request_timeout_seconds
+        stream = CloudRefinementStream(conn, task_id, effective_timeout, settings.remote_server.cloud_stream_chunk_timeout_seconds)
+        conn.active_streams[task_id] = stream # Registered before sending so no early chunk is missed
+        conn.unacked[task_id] = _UnackedRequest(message, time.monotonic() + effective_timeout)
+
+        if not await self._send_message_internal(message):
+            stream._finish()
+            raise TCPClientConnectionError("Failed to send cloud refinement request")
+        logger.info(f"TCPClient ({self.client_id}): Streaming cloud refinement for task {task_id} with timeout {effective_timeout}s")
+        return stream
+
+    async def send_confident_result_notification(self, notification_data: LocalConfidentResultNotificationPayload, wait_flushed: bool = False) -> bool:
+        message = BaseMessage(message_type="local_confident_result_notification", payload=notification_data.model_dump())
+        return await self._send_message_internal(message, wait_flushed=wait_flushed)
+
+    async def _handle_disconnection(self):
+        for conn in self._connections:
+            await conn.handle_disconnection()
+
+    async def maintain_connection_loop(self):
+        logger.info(f"TCPClient ({self.client_id}): Maintain connection loop started for {len(self._connections)} connection(s).")
+        # Each connection reconnects on its own schedule with its own backoff.
+        await asyncio.gather(*(conn.maintain_connection_loop() for conn in self._connections))
         logger.info(f"TCPClient ({self.client_id}): Maintain connection loop ended due to shutdown.")
 
-    async def start_heartbeat_loop(self, vllm_health_check_func: Optional[Callable[[], Awaitable[bool]]] = None, active_tasks_func: Optional[Callable[[], Awaitable[int]]] = None):
+    async def start_heartbeat_loop(self, vllm_health_check_func: Optional[Callable[[], Awaitable[bool]]] = None, active_tasks_func: Optional[Callable[[], Awaitable[int]]] = None,
+                                   admission_stats_func: Optional[Callable[[], Awaitable[Dict[str, int]]]] = None):
         if self._heartbeat_task and not self._heartbeat_task.done():
             logger.warning(f"TCPClient ({self.client_id}): Heartbeat loop already running.")
             return
@@ -263,12 +673,18 @@ class TCPRemoteClient:
                 if self.is_connected:
                     vllm_healthy = await vllm_health_check_func() if vllm_health_check_func else None
                     active_tasks = await active_tasks_func() if active_tasks_func else None
+                    admission_stats = await admission_stats_func() if admission_stats_func else {}
+                    metrics_delta = metrics.heartbeat_delta() # In-memory ring buffers only; no I/O
                     hb_payload = HeartbeatPayload(
                         local_server_id=self.client_id, 
                         status="ok", 
                         model_name=settings.vllm.model_name_or_path,
                         vllm_health_status=vllm_healthy,
-                        active_tasks_count=active_tasks
+                        active_tasks_count=active_tasks,
+                        queued_commands_count=admission_stats.get("queued_commands_count"),
+                        rejected_commands_count=admission_stats.get("rejected_commands_count"),
+                        gpu_usage_percent=metrics.last_value("gpu_usage_percent"),
+                        metrics=metrics_delta
                     )
                     logger.debug(f"TCPClient ({self.client_id}): Sending heartbeat.")
                     if not await self.send_heartbeat(hb_payload):
@@ -287,6 +703,11 @@ class TCPRemoteClient:
             try: await self._heartbeat_task
             except asyncio.CancelledError: logger.debug(f"TCPClient ({self.client_id}): Heartbeat task cancelled.")
         
+        # Give already queued frames (e.g. a final notification) a chance to reach the socket.
+        for conn in self._connections:
+            if conn.write_queue:
+                await conn.write_queue.close()
+
         # The maintain_connection_loop will see _shutdown_event and exit.
         # The _receive_messages_loop will also see _shutdown_event and exit.
         await self._handle_disconnection() # Ensure final cleanup
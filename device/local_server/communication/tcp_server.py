@@ -2,10 +2,16 @@ import asyncio
 import json
 import logging
 import uuid
-from typing import Dict, Any, Optional, Callable, Awaitable
+from typing import Dict, Any, Optional, Callable, Awaitable, Set
 
 from ..core.config import settings # Assuming settings are available
 from .protocol_models import BaseMessage # For parsing and constructing messages
+from .framing import (
+    JsonLineCodec, FramingError, HELLO_MESSAGE_TYPE,
+    FrameDecoder, FrameTooLargeError, READ_CHUNK_SIZE,
+    build_hello_ack_message, get_codec, negotiate_compression, negotiate_framing
+)
+from .write_queue import OutboundWriteQueue
 
 logger = logging.getLogger(__name__) 
 
@@ -14,101 +20,177 @@ logger = logging.getLogger(__name__)
 # It should return an Optional dictionary, which, if provided, is the PAYLOAD for a response message.
 MessageHandlerType = Callable[[Dict[str, Any], asyncio.StreamWriter], Awaitable[Optional[Dict[str, Any]]]]
 
+class _ConnectionContext:
+    """Per-connection state shared by the read loop and the concurrently dispatched handlers."""
+    def __init__(self, writer: asyncio.StreamWriter, server_id: str):
+        self.writer = writer
+        self.server_id = server_id
+        self.peername = writer.get_extra_info("peername")
+        self.session_id = str(uuid.uuid4()) # Unique ID for this specific client connection session
+        # Whole frames only, in order, so concurrently dispatched handlers never interleave partial frames
+        self.write_queue = OutboundWriteQueue(writer, f"{server_id}:{self.peername}")
+        self.codec = JsonLineCodec() # Switched only by a successful hello exchange
+
+async def _write_message(ctx: _ConnectionContext, message: BaseMessage, wait_flushed: bool = False) -> None:
+    """Queues a message for the coalesced writer; with wait_flushed, returns only once it reached the socket."""
+    logger.debug(f"TCPServer ({ctx.server_id}): Sending {message.message_type} (task {message.task_id}) to {ctx.peername} (Session: {ctx.session_id}) via {ctx.codec.name} framing.")
+    await ctx.write_queue.enqueue(ctx.codec.encode(message), wait_flushed=wait_flushed)
+
+async def _handle_hello(ctx: _ConnectionContext, hello_dict: Dict[str, Any]) -> None:
+    """Answers a protocol_hello in the current framing, then switches the connection to the agreed framing."""
+    hello_payload = hello_dict.get("payload") or {}
+    offered = hello_payload.get("framings")
+    offered_compression = hello_payload.get("compression")
+    framing = negotiate_framing(offered if isinstance(offered, list) else None)
+    compression = negotiate_compression(offered_compression if isinstance(offered_compression, list) else None, framing)
+    ack = build_hello_ack_message(hello_dict.get("task_id", str(uuid.uuid4())), framing, compression)
+    # The client switches framing as soon as it reads the ack, so everything after it must use the new codec.
+    await _write_message(ctx, ack, wait_flushed=True)
+    ctx.codec = get_codec(framing, compression)
+    logger.info(f"TCPServer ({ctx.server_id}): Negotiated {framing} framing (compression: {compression}) with {ctx.peername} (Session: {ctx.session_id}), peer offered {offered} / {offered_compression}.")
+
+async def _dispatch_message(ctx: _ConnectionContext, frame: bytes, message_handler: MessageHandlerType, flags: int = 0) -> None:
+    """Decodes a single frame, runs the handler and writes its response (or an error response) back to the client."""
+    incoming_dict: Optional[Dict[str, Any]] = None
+    try:
+        incoming_dict = ctx.codec.decode(frame, flags)
+        # Basic validation using BaseMessage can be done here or within the handler
+        # For now, assume handler will validate further or use Pydantic models.
+
+        # Pass the raw dict and writer to the message handler (e.g., TaskOrchestrator)
+        # The handler is responsible for business logic and determining the response payload.
+        response_payload_content = await message_handler(incoming_dict, ctx.writer)
+
+        if response_payload_content is not None:
+            # If handler returns a payload, construct and send a standard response message.
+            # The handler should ensure the original task_id is included if it's a direct response,
+            # since responses may go out in a different order than the requests arrived.
+            response_task_id = incoming_dict.get("task_id", str(uuid.uuid4()))
+
+            # Assume response_payload_content is the dict for the 'payload' field of BaseMessage
+            # and the message_type for response is standard (e.g. "local_response_to_remote")
+            # unless the handler specifies a different message_type within response_payload_content itself.
+
+            response_message_type = response_payload_content.pop("message_type_override", "local_response_to_remote")
+
+            response_msg_obj = BaseMessage(
+                task_id=response_task_id,
+                message_type=response_message_type,
+                payload=response_payload_content
+            )
+            await _write_message(ctx, response_msg_obj)
+        # If response_payload_content is None, handler might have sent a response directly or no response was needed.
+
+    except asyncio.CancelledError:
+        logger.info(f"TCPServer ({ctx.server_id}): In-flight message from {ctx.peername} (Session: {ctx.session_id}) cancelled.")
+        raise
+    except (json.JSONDecodeError, FramingError) as e_decode:
+        is_json = isinstance(e_decode, json.JSONDecodeError)
+        logger.error(f"TCPServer ({ctx.server_id}): Invalid {'JSON' if is_json else 'frame'} from {ctx.peername} (Session: {ctx.session_id}): " +
+                     f"Data: \nRPT.Slice.Start------------------------------------------------------\n{frame[:1024]!r}\nRPT.Slice.End--------------------------------------------------------\n Error: {e_decode}")
+        # Send an error response if possible
+        error_response = BaseMessage(
+            task_id=str(uuid.uuid4()),
+            message_type="error_response",
+            payload={"error": "Invalid JSON format received" if is_json else "Invalid frame received", "details": str(e_decode)}
+        )
+        try:
+            await _write_message(ctx, error_response)
+        except Exception as write_err:
+            logger.error(f"TCPServer ({ctx.server_id}): Failed to send decode error response to {ctx.peername}: {write_err}")
+    except Exception as e_handler: # Catch errors from message_handler or Pydantic validation
+        logger.error(f"TCPServer ({ctx.server_id}): Error processing message from {ctx.peername} (Session: {ctx.session_id}): {e_handler}", exc_info=True)
+        error_task_id = str(uuid.uuid4())
+        if incoming_dict and "task_id" in incoming_dict:
+            error_task_id = incoming_dict["task_id"]
+        error_response = BaseMessage(
+            task_id=error_task_id,
+            message_type="error_response",
+            payload={"error": "Internal server error during message processing", "details": str(e_handler)}
+        )
+        try:
+            await _write_message(ctx, error_response)
+        except Exception as write_err:
+            logger.error(f"TCPServer ({ctx.server_id}): Failed to send internal error response to {ctx.peername}: {write_err}")
+
+_HELLO_MARKER = HELLO_MESSAGE_TYPE.encode("utf-8")
+
+def _try_parse_hello(frame: bytes) -> Optional[Dict[str, Any]]:
+    # Cheap substring pre-check so ordinary messages are not JSON-decoded twice.
+    if _HELLO_MARKER not in frame:
+        return None
+    try:
+        candidate = json.loads(frame)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(candidate, dict) and candidate.get("message_type") == HELLO_MESSAGE_TYPE:
+        return candidate
+    return None
+
 async def handle_client_connection(
     reader: asyncio.StreamReader, 
     writer: asyncio.StreamWriter, 
     message_handler: MessageHandlerType,
-    server_id: str # To identify which server instance is logging
+    server_id: str, # To identify which server instance is logging
+    max_in_flight: Optional[int] = None
 ):
-    peername = writer.get_extra_info("peername")
-    connection_session_id = str(uuid.uuid4()) # Unique ID for this specific client connection session
+    ctx = _ConnectionContext(writer, server_id)
+    peername = ctx.peername
+    connection_session_id = ctx.session_id
     logger.info(f"TCPServer ({server_id}): Accepted connection from {peername} (Session: {connection_session_id})")
-    message_buffer = ""
+    decoder = FrameDecoder(max_frame_size=settings.remote_server.max_frame_size_bytes)
+
+    # Messages on one connection are dispatched as concurrent tasks so a slow command (e.g. an Owl task)
+    # does not hold up cheap ones queued behind it. The window bounds how many may run at once;
+    # once it is full we stop reading from the socket until a slot frees up.
+    in_flight_window = max_in_flight if max_in_flight is not None else settings.remote_server.tcp_server_max_in_flight_per_connection
+    in_flight_slots = asyncio.Semaphore(max(1, in_flight_window))
+    in_flight_tasks: Set[asyncio.Task] = set()
+
+    def _on_dispatch_done(task: asyncio.Task) -> None:
+        in_flight_tasks.discard(task)
+        in_flight_slots.release()
+
+    async def _schedule(frame: bytes, flags: int) -> None:
+        await in_flight_slots.acquire()
+        dispatch_task = asyncio.create_task(_dispatch_message(ctx, frame, message_handler, flags))
+        in_flight_tasks.add(dispatch_task)
+        dispatch_task.add_done_callback(_on_dispatch_done)
 
     try:
         while True:
             try:
-                data = await reader.read(4096) # Read a chunk of data
+                data = await reader.read(READ_CHUNK_SIZE) # Read a chunk of data
                 if not data:
                     logger.info(f"TCPServer ({server_id}): Client {peername} (Session: {connection_session_id}) disconnected (received empty data).")
                     break
-                
-                message_buffer += data.decode("utf-8")
-                
-                # Process all newline-terminated messages in the buffer
-                while "\n" in message_buffer:
-                    message_str, message_buffer = message_buffer.split("\n", 1)
-                    message_str = message_str.strip()
-                    if not message_str: # Skip empty lines after strip
-                        continue
-
-                    logger.debug(f"TCPServer ({server_id}): Received from {peername} (Session: {connection_session_id}): {message_str}")
-                    incoming_dict: Optional[Dict[str, Any]] = None
-                    try:
-                        incoming_dict = json.loads(message_str)
-                        # Basic validation using BaseMessage can be done here or within the handler
-                        # For now, assume handler will validate further or use Pydantic models.
-                        
-                        # Pass the raw dict and writer to the message handler (e.g., TaskOrchestrator)
-                        # The handler is responsible for business logic and determining the response payload.
-                        response_payload_content = await message_handler(incoming_dict, writer)
-
-                        if response_payload_content is not None:
-                            # If handler returns a payload, construct and send a standard response message.
-                            # The handler should ensure the original task_id is included if it's a direct response.
-                            response_task_id = incoming_dict.get("task_id", str(uuid.uuid4()))
-                            
-                            # Assume response_payload_content is the dict for the 'payload' field of BaseMessage
-                            # and the message_type for response is standard (e.g. "local_response_to_remote")
-                            # unless the handler specifies a different message_type within response_payload_content itself.
-                            
-                            response_message_type = response_payload_content.pop("message_type_override", "local_response_to_remote")
-
-                            response_msg_obj = BaseMessage(
-                                task_id=response_task_id, 
-                                message_type=response_message_type,
-                                payload=response_payload_content
-                            )
-                            response_json = response_msg_obj.model_dump_json()
-                            logger.debug(f"TCPServer ({server_id}): Sending to {peername} (Session: {connection_session_id}): {response_json}")
-                            writer.write(response_json.encode("utf-8") + b"\n")
-                            await writer.drain()
-                        # If response_payload_content is None, handler might have sent a response directly or no response was needed.
-
-                    except json.JSONDecodeError as e_json:
-                        logger.error(f"TCPServer ({server_id}): Invalid JSON from {peername} (Session: {connection_session_id}): " +
-                                     f"Data: \nRPT.Slice.Start------------------------------------------------------\n{message_str}\nRPT.Slice.End--------------------------------------------------------\n Error: {e_json}")
-                        # Send an error response if possible
-                        error_task_id = str(uuid.uuid4())
-                        if incoming_dict and "task_id" in incoming_dict:
-                            error_task_id = incoming_dict["task_id"]
-                        error_response = BaseMessage(
-                            task_id=error_task_id, 
-                            message_type="error_response", 
-                            payload={"error": "Invalid JSON format received", "details": str(e_json)}
-                        )
-                        try:
-                            writer.write(error_response.model_dump_json().encode("utf-8") + b"\n")
-                            await writer.drain()
-                        except Exception as write_err:
-                            logger.error(f"TCPServer ({server_id}): Failed to send JSON error response to {peername}: {write_err}")
-                    except Exception as e_handler: # Catch errors from message_handler or Pydantic validation
-                        logger.error(f"TCPServer ({server_id}): Error processing message from {peername} (Session: {connection_session_id}): {e_handler}", exc_info=True)
-                        error_task_id = str(uuid.uuid4())
-                        if incoming_dict and "task_id" in incoming_dict:
-                            error_task_id = incoming_dict["task_id"]
-                        error_response = BaseMessage(
-                            task_id=error_task_id,
-                            message_type="error_response",
-                            payload={"error": "Internal server error during message processing", "details": str(e_handler)}
-                        )
-                        try:
-                            writer.write(error_response.model_dump_json().encode("utf-8") + b"\n")
-                            await writer.drain()
-                        except Exception as write_err:
-                            logger.error(f"TCPServer ({server_id}): Failed to send internal error response to {peername}: {write_err}")
-                        # Depending on error, might continue or break. For now, continue.
+
+                decoder.feed(data)
+                # Process every complete frame in the buffer; a partial frame stays buffered for the next read.
+                while (frame := decoder.next_frame()) is not None:
+                    if not ctx.codec.length_prefixed:
+                        frame = frame.strip()
+                        if not frame: # Skip empty lines after strip
+                            continue
+                        hello_dict = _try_parse_hello(frame)
+                        if hello_dict is not None:
+                            await _handle_hello(ctx, hello_dict)
+                            decoder.length_prefixed = ctx.codec.length_prefixed
+                            continue
+
+                    logger.debug(f"TCPServer ({server_id}): Received {len(frame)}-byte frame from {peername} (Session: {connection_session_id})")
+                    await _schedule(frame, decoder.last_flags)
             
+            except FrameTooLargeError as e_too_large:
+                logger.error(f"TCPServer ({server_id}): Closing connection with {peername} (Session: {connection_session_id}): {e_too_large}")
+                try:
+                    await _write_message(ctx, BaseMessage(
+                        message_type="error_response",
+                        payload={"error": "Frame too large", "details": str(e_too_large)}
+                    ), wait_flushed=True)
+                except Exception as write_err:
+                    logger.error(f"TCPServer ({server_id}): Failed to send frame size error response to {peername}: {write_err}")
+                break
             except ConnectionResetError:
                 logger.info(f"TCPServer ({server_id}): Client {peername} (Session: {connection_session_id}) reset connection.")
                 break 
@@ -123,6 +205,15 @@ async def handle_client_connection(
         # This catches errors if the loop itself fails catastrophically (e.g., before even reading)
         logger.error(f"TCPServer ({server_id}): Unhandled exception in connection handler for {peername} (Session: {connection_session_id}): {e_outer}", exc_info=True)
     finally:
+        # Nobody is left to read the responses of still-running handlers, so stop them.
+        if in_flight_tasks:
+            logger.info(f"TCPServer ({server_id}): Cancelling {len(in_flight_tasks)} in-flight message(s) for {peername} (Session: {connection_session_id})")
+            for task in list(in_flight_tasks):
+                task.cancel()
+            await asyncio.gather(*list(in_flight_tasks), return_exceptions=True)
+        await ctx.write_queue.close() # Flush responses that were already queued
+        if ctx.codec.compressor:
+            logger.info(f"TCPServer ({server_id}): Compression stats for {peername} (Session: {connection_session_id}): {ctx.codec.compressor.stats.snapshot()}")
         logger.info(f"TCPServer ({server_id}): Closing connection with {peername} (Session: {connection_session_id})")
         if writer and not writer.is_closing():
             try:
@@ -135,12 +226,13 @@ async def start_tcp_server(
     host: str, 
     port: int, 
     message_handler: MessageHandlerType,
-    server_id: str = "default_server"
+    server_id: str = "default_server",
+    max_in_flight: Optional[int] = None
 ):
     server: Optional[asyncio.AbstractServer] = None
     try:
         server = await asyncio.start_server(
-            lambda r, w: handle_client_connection(r, w, message_handler, server_id),
+            lambda r, w: handle_client_connection(r, w, message_handler, server_id, max_in_flight),
             host,
             port
         )
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class WriteQueueClosedError(ConnectionError):
+    """Raised when writing to a queue that has been closed or whose socket failed."""
+    pass
+
+class OutboundWriteQueue:
+    """
+    Per-connection outbound buffer that coalesces encoded frames into a single socket write.
+
+    Frames queued while a previous write is draining (or within the optional flush window) go out
+    together in one write() + drain(), instead of one syscall and one drain wait per message.
+    The queue is bounded: once `max_queued_bytes` are waiting or in flight, enqueue() blocks until
+    the socket catches up, so a slow peer slows down its producers rather than growing memory.
+
+    Callers choose per message whether to return as soon as the frame is queued (fire-and-forget)
+    or to wait until the batch holding it has been drained to the socket (wait_flushed=True).
+    """
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        name: str,
+        flush_interval: Optional[float] = None,
+        max_batch_bytes: Optional[int] = None,
+        max_queued_bytes: Optional[int] = None,
+        on_error: Optional[Callable[[Exception], Awaitable[None]]] = None
+    ):
+        self.writer = writer
+        self.name = name
+        self.flush_interval = flush_interval if flush_interval is not None else settings.remote_server.write_coalesce_window_ms / 1000.0
+        self.max_batch_bytes = max_batch_bytes if max_batch_bytes is not None else settings.remote_server.write_coalesce_max_bytes
+        self.max_queued_bytes = max_queued_bytes if max_queued_bytes is not None else settings.remote_server.write_queue_max_bytes
+        self.on_error = on_error
+
+        self._chunks: List[bytes] = []
+        self._waiters: List[asyncio.Future] = []
+        self._pending_bytes = 0 # Queued, not yet handed to the writer
+        self._queued_bytes = 0 # Pending plus the batch currently being drained; this is what the bound applies to
+        self._data_ready = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._space_available.set()
+        self._closed = False
+        self._error: Optional[Exception] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self.writes = 0 # Socket writes issued
+        self.frames = 0 # Frames written
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._queued_bytes
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed
+
+    async def enqueue(self, data: bytes, wait_flushed: bool = False) -> None:
+        """Queues one encoded frame. Blocks while the queue is over its byte bound."""
+        self._raise_if_closed()
+        # A frame larger than the whole bound is still accepted once the queue has drained.
+        while self._queued_bytes and self._queued_bytes + len(data) > self.max_queued_bytes:
+            self._space_available.clear()
+            await self._space_available.wait()
+            self._raise_if_closed()
+
+        self._chunks.append(data)
+        self._pending_bytes += len(data)
+        self._queued_bytes += len(data)
+        self._data_ready.set()
+        if self._pending_bytes >= self.max_batch_bytes:
+            self._batch_full.set()
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+        if wait_flushed:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def _raise_if_closed(self) -> None:
+        if self._error is not None:
+            raise WriteQueueClosedError(f"Write queue for {self.name} failed: {self._error}")
+        if self._closed:
+            raise WriteQueueClosedError(f"Write queue for {self.name} is closed")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._data_ready.wait()
+            if self.flush_interval > 0 and not self._closed and not self._batch_full.is_set():
+                # Hold the batch open briefly so messages produced right after this one share the write.
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0) # Let tasks that are already runnable add their frames first
+
+            chunks, waiters, batch_bytes = self._chunks, self._waiters, self._pending_bytes
+            self._chunks, self._waiters, self._pending_bytes = [], [], 0
+            self._data_ready.clear()
+            self._batch_full.clear()
+            if not chunks:
+                if self._closed:
+                    return
+                continue
+
+            try:
+                self.writer.write(chunks[0] if len(chunks) == 1 else b"".join(chunks))
+                await self.writer.drain()
+            except Exception as e:
+                logger.warning(f"WriteQueue ({self.name}): Write failed, dropping {len(chunks)} frame(s): {e}")
+                self._fail(e, waiters)
+                if self.on_error:
+                    try: await self.on_error(e)
+                    except Exception as e_cb: logger.error(f"WriteQueue ({self.name}): Error in on_error callback: {e_cb}", exc_info=True)
+                return
+
+            self.writes += 1
+            self.frames += len(chunks)
+            self._queued_bytes -= batch_bytes
+            self._space_available.set()
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            if self._closed and not self._chunks:
+                return
+
+    def _fail(self, error: Exception, waiters: Optional[List[asyncio.Future]] = None) -> None:
+        self._error = error
+        self._closed = True
+        for waiter in (waiters or []) + self._waiters:
+            if not waiter.done():
+                waiter.set_exception(WriteQueueClosedError(f"Write queue for {self.name} failed: {error}"))
+        self._chunks, self._waiters, self._pending_bytes, self._queued_bytes = [], [], 0, 0
+        self._space_available.set() # Wake blocked producers so they see the error
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """Flushes what is queued (bounded by `timeout`) and stops accepting frames."""
+        if self._closed:
+            return
+        self._closed = True
+        self._data_ready.set()
+        self._batch_full.set()
+        if self._flush_task is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._flush_task), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"WriteQueue ({self.name}): Timed out flushing {self._queued_bytes} byte(s) on close.")
+            self.abort(WriteQueueClosedError("Timed out flushing on close"))
+        except Exception as e:
+            logger.debug(f"WriteQueue ({self.name}): Flush task ended with error on close: {e}")
+
+    def abort(self, error: Optional[Exception] = None) -> None:
+        """Drops anything queued and fails waiters, e.g. when the connection is already gone."""
+        if self._error is None:
+            self._fail(error or WriteQueueClosedError("Connection closed"))
+        if self._flush_task and not self._flush_task.done() and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
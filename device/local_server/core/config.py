@@ -17,20 +17,163 @@ class VLLMSettings(BaseSettings):
     default_max_tokens: int = 1024
     default_temperature: float = 0.7
     request_timeout: float = 60.0 # Timeout for requests to vLLM service
+    # check_health() serves the background prober's cached result instead of probing inline
+    health_probe_interval_seconds: float = 10.0
+    health_probe_timeout_seconds: float = 2.0
+    # Without a running prober, a cached result older than this is re-probed on demand
+    health_cache_ttl_seconds: float = 5.0
+    # A health endpoint that answered 404/405 is skipped for this long, then probed again (vLLM may have been upgraded)
+    dead_endpoint_retry_seconds: float = 300.0
 
 class ConfidenceSettings(BaseSettings):
     rouge_l_threshold: float = 0.3
     # Path relative to PROJECT_ROOT_DIR/config/
     keyword_triggers_file: str = "keyword_triggers.json" 
+    # When the prompt itself matches a keyword trigger (refinement is then certain), request cloud refinement
+    # concurrently with local generation instead of after it; the local draft only serves as the fallback
+    speculative_cloud_refinement: bool = False
+    # Streamed full flow: re-assess the accumulating local text every N characters...
+    stream_assess_interval_chars: int = 160
+    # ...and escalate mid-stream only when the prefix scores below rouge_l_threshold * this factor (prefix scores are noisy)
+    stream_partial_threshold_factor: float = 0.5
 
 class RemoteServerSettings(BaseSettings):
     host: str = "127.0.0.1" # Default to localhost for easier local testing
     command_port: int = 5000 
     heartbeat_port: int = 5001 
     cloud_request_timeout_seconds: int = 15
+    # Longest gap allowed between chunks of a streamed cloud refinement
+    cloud_stream_chunk_timeout_seconds: float = 10.0
     heartbeat_interval_seconds: int = 30
     tcp_client_reconnect_delay_seconds: int = 5
     tcp_client_max_reconnect_delay_seconds: int = 60
+    # Number of parallel connections TCPRemoteClient keeps to the cloud; requests use the least loaded one
+    tcp_client_pool_size: int = 1
+    # Max commands dispatched concurrently per inbound connection; reading pauses once the window is full.
+    # Raised at startup to fit every command admission can run or queue, plus the exempt actions
+    tcp_server_max_in_flight_per_connection: int = 32
+    # Preferred wire framing offered to the cloud ("json" or "msgpack"); JSON is always the fallback
+    wire_framing: str = "json"
+    # Per-frame compression offered to the cloud ("none", "zlib" or "zstd"); frames below compression_min_bytes go out raw
+    wire_compression: str = "none"
+    compression_min_bytes: int = 2048
+    compression_level: Optional[int] = None # Algorithm default when unset
+    protocol_hello_timeout_seconds: float = 2.0
+    # Keep in-flight cloud refinements alive across a dropped connection and replay them (same task_id) on reconnect.
+    # Needs a session-aware cloud: the session is announced in protocol_hello (even on JSON framing), and requests are
+    # replayed only after the ack confirms the session with its last received seq; the cloud must dedupe by task_id.
+    # Against any other peer the kept requests fail on reconnect, later than they would with this off
+    session_resume_enabled: bool = False
+    # Upper bound for a single frame on either side of the connection (guards against runaway buffers)
+    max_frame_size_bytes: int = 16 * 1024 * 1024
+    # Skip envelope type checks for a peer we operate ourselves (payloads are still validated)
+    trusted_peer: bool = False
+    # Outbound write coalescing: frames queued within the window (0 = same loop tick / while a drain is pending)
+    # are sent in one write, up to max_bytes per write; producers block once write_queue_max_bytes are outstanding
+    write_coalesce_window_ms: float = 0.0
+    write_coalesce_max_bytes: int = 256 * 1024
+    write_queue_max_bytes: int = 8 * 1024 * 1024
+
+class AdmissionSettings(BaseSettings):
+    # Max remote commands executing at once per command_action; unlisted actions use default_concurrency
+    action_concurrency: Dict[str, int] = {"execute_owl_task": 1, "query_local_model_direct": 2}
+    default_concurrency: int = 4
+    # Commands that may wait for a slot per action; beyond this the server answers "busy" immediately
+    max_queued_per_action: int = 8
+    # Never queued or rejected, so the cloud can always poll load (or cancel work) before backing off
+    exempt_actions: List[str] = ["get_local_status", "cancel_task"]
+    # Retry-after hint before any service time has been measured, and the cap on the estimate
+    retry_after_seconds: float = 2.0
+    max_retry_after_seconds: float = 60.0
+
+class SchedulerSettings(BaseSettings):
+    # vLLM requests in flight at once across all work classes (interactive, command, batch)
+    backend_concurrency: int = 8
+    # Per-class cap on concurrent vLLM requests; keeping batch below backend_concurrency leaves room for users
+    class_concurrency: Dict[str, int] = {"interactive": 8, "command": 4, "batch": 4}
+    # Share of freed slots each class gets while several are queued
+    class_weights: Dict[str, float] = {"interactive": 8.0, "command": 4.0, "batch": 1.0}
+
+class BatchSettings(BaseSettings):
+    # Workers per batch, i.e. batch prompts in flight at once (each also needs a "batch" scheduler slot)
+    max_concurrency: int = 8
+    # Prompts per vLLM /completions call; 1 sends each prompt to /chat/completions. Packed prompts skip the chat template
+    pack_size: int = 1
+    # Finished results buffered for a slow consumer before the workers pause
+    result_buffer: int = 64
+
+class RefinementBatchSettings(BaseSettings):
+    # Coalesce concurrent cloud refinement requests into local_request_cloud_batch_refinement messages (the cloud must support them)
+    enabled: bool = False
+    # How long the first request of a batch waits for others to join
+    window_ms: float = 20.0
+    # A batch is sent as soon as it has this many requests; capped at the cloud's limit of 20
+    max_batch_size: int = 20
+
+class CloudTimeoutSettings(BaseSettings):
+    # Derive the cloud refinement timeout from observed latency: p<percentile> * margin_factor + margin_seconds
+    adaptive: bool = True
+    percentile: int = 95
+    margin_factor: float = 1.5
+    margin_seconds: float = 0.5
+    floor_seconds: float = 2.0
+    # None uses remote_server.cloud_request_timeout_seconds, which also applies until min_samples latencies are known
+    ceiling_seconds: Optional[float] = None
+    min_samples: int = 20
+    # Seconds from the start of a request after which a low-confidence request returns the local draft
+    # and the cloud answer, if it comes, is delivered later as an upgrade. None always waits for the cloud
+    soft_deadline_seconds: Optional[float] = None
+
+class CommandDedupeSettings(BaseSettings):
+    # Remote commands are deduplicated by task_id so cloud retries don't re-run vLLM / Owl work
+    max_entries: int = 1024
+    # How long a finished command's response is kept for replay
+    ttl_seconds: float = 300.0
+    # Cheap, state-reading commands (and cancellations) that should always run fresh
+    exempt_actions: List[str] = ["get_local_status", "cancel_task"]
+
+class ResponseCacheSettings(BaseSettings):
+    # Caches full-flow results (local high-confidence and cloud-refined answers) per prompt + generation params
+    enabled: bool = True
+    max_entries: int = 1024
+    ttl_seconds: float = 3600.0
+    # SQLite file for the restart-surviving tier, relative to the project root; None keeps the cache in memory only
+    disk_path: Optional[str] = None
+    # Requests sampling above this temperature skip the cache (None caches regardless of temperature). The default
+    # caches greedy decoding only; vllm.default_temperature (0.7) samples, so such requests are not cached unless this is raised
+    bypass_above_temperature: Optional[float] = 0.0
+
+class NearDuplicateCacheSettings(BaseSettings):
+    # Serves a previously cloud-refined answer for a prompt that is nearly identical (MinHash/LSH over character shingles)
+    enabled: bool = False
+    jaccard_threshold: float = 0.85
+    # Characters per shingle; character (not word) shingles so Chinese prompts work
+    shingle_size: int = 3
+    # Signature length; must be a multiple of bands. More bands catch lower similarities at the cost of more candidates
+    num_perm: int = 64
+    bands: int = 16
+    max_entries: int = 100_000
+    # Entries expire this long after they were added; None uses response_cache.ttl_seconds
+    ttl_seconds: Optional[float] = None
+    # Shorter prompts only use the exact response cache; a few characters of difference would change their meaning
+    min_prompt_chars: int = 20
+
+class MetricsSettings(BaseSettings):
+    # Samples kept per latency ring buffer (per pipeline stage and for event-loop lag)
+    latency_window_size: int = 512
+    # Heartbeats carry only changed metrics; every Nth carries the full set so the cloud can resync
+    full_snapshot_every: int = 10
+    loop_lag_sample_interval_seconds: float = 0.5
+    # The loop watchdog captures the blocking stack once the loop has not run for this long
+    loop_stall_threshold_seconds: float = 0.25
+    loop_stall_reports_kept: int = 10
+    # Per-stage, per-source histograms are log-linear; each bucket spans at most 1/2**(bits-1) of its value (8 -> under 1%)
+    histogram_sub_bucket_bits: int = 8
+    # Upper bounds (ms) of the buckets exported to Prometheus from those histograms
+    prometheus_buckets_ms: List[float] = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+    # Serves the Prometheus text format at http://<host>:<port>/metrics; None disables the endpoint
+    prometheus_port: Optional[int] = None
+    prometheus_host: str = "0.0.0.0"
 
 class OwlAgentSettings(BaseSettings):
     use_local_vllm: bool = True
@@ -49,8 +192,19 @@ class AppSettings(BaseSettings):
     confidence: ConfidenceSettings = ConfidenceSettings()
     remote_server: RemoteServerSettings = RemoteServerSettings()
     owl_agent: OwlAgentSettings = OwlAgentSettings()
+    admission: AdmissionSettings = AdmissionSettings()
+    scheduler: SchedulerSettings = SchedulerSettings()
+    batch: BatchSettings = BatchSettings()
+    refinement_batch: RefinementBatchSettings = RefinementBatchSettings()
+    cloud_timeout: CloudTimeoutSettings = CloudTimeoutSettings()
+    command_dedupe: CommandDedupeSettings = CommandDedupeSettings()
+    response_cache: ResponseCacheSettings = ResponseCacheSettings()
+    near_duplicate_cache: NearDuplicateCacheSettings = NearDuplicateCacheSettings()
+    metrics: MetricsSettings = MetricsSettings()
     local_server_id: str = "local_server_dev_01"
     log_level: str = "INFO"
+    # "asyncio" or "uvloop"; falls back to asyncio when uvloop is not installed. `--loop` on the CLI overrides it.
+    event_loop: str = "asyncio"
 
     class Config:
         env_file = os.path.join(PROJECT_ROOT_DIR, ".env") # .env file at project root
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import logging
 import signal
@@ -11,6 +12,9 @@ from local_server.services.owl_agent_service import OwlAgentService
 from local_server.services.task_orchestrator import TaskOrchestrator
 from local_server.communication.tcp_client import TCPRemoteClient
 from local_server.communication.tcp_server import start_tcp_server
+from local_server.communication.metrics_http_server import start_metrics_http_server
+from local_server.utils.loop_watchdog import loop_watchdog
+from local_server.utils.event_loop import available_event_loops, install_event_loop_policy
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +24,7 @@ background_tasks = set()
 async def main():
     """Main function to initialize and run the local server components."""
     setup_logging()
-    logger.info(f"Starting Local Server (ID: {settings.local_server_id}) with log level {settings.log_level}.")
+    logger.info(f"Starting Local Server (ID: {settings.local_server_id}) with log level {settings.log_level} on the {type(asyncio.get_running_loop()).__module__} event loop.")
 
     # Initialize HTTP client for services
     # Configure timeouts and limits for the HTTP client
@@ -54,6 +58,13 @@ async def main():
         tcp_remote_client=tcp_remote_client
     )
 
+    # Probe vLLM in the background so heartbeats and get_local_status read a cached health state
+    vllm_prober_task = asyncio.create_task(vllm_service.run_health_prober())
+    background_tasks.add(vllm_prober_task)
+
+    # Drop response-cache rows that expired while the server was down (no-op without the disk tier)
+    await task_orchestrator.response_cache.purge_expired()
+
     # Start TCP client background tasks (maintain connection, heartbeat)
     maintain_conn_task = asyncio.create_task(tcp_remote_client.maintain_connection_loop())
     background_tasks.add(maintain_conn_task)
@@ -61,20 +72,34 @@ async def main():
     # Pass health check and active tasks functions to heartbeat loop
     heartbeat_task = asyncio.create_task(tcp_remote_client.start_heartbeat_loop(
         vllm_health_check_func=vllm_service.check_health, 
-        active_tasks_func=task_orchestrator.get_active_tasks_count
+        active_tasks_func=task_orchestrator.get_active_tasks_count,
+        admission_stats_func=task_orchestrator.get_admission_stats
     ))
     background_tasks.add(heartbeat_task)
 
+    # Samples event-loop lag (heartbeat metrics + histogram) and captures the stack of anything blocking the loop
+    loop_watchdog_task = asyncio.create_task(loop_watchdog.run())
+    background_tasks.add(loop_watchdog_task)
+
     # Start TCP Server (for receiving commands from the cloud server)
     # The message_handler for the TCP server will be a method from the TaskOrchestrator
     tcp_server_task = asyncio.create_task(start_tcp_server(
         host="0.0.0.0", # Listen on all interfaces within Docker
         port=settings.remote_server.command_port, # Port for incoming commands
         message_handler=task_orchestrator.process_incoming_tcp_message,
-        server_id=settings.local_server_id
+        server_id=settings.local_server_id,
+        max_in_flight=task_orchestrator.tcp_server_in_flight_window()
     ))
     background_tasks.add(tcp_server_task)
 
+    # Per-stage latency histograms for Prometheus (off unless metrics.prometheus_port is set)
+    if settings.metrics.prometheus_port is not None:
+        metrics_http_task = asyncio.create_task(start_metrics_http_server(
+            host=settings.metrics.prometheus_host,
+            port=settings.metrics.prometheus_port
+        ))
+        background_tasks.add(metrics_http_task)
+
     logger.info("Local Server components initialized and started.")
     
     # Keep the main function alive until shutdown is triggered
@@ -128,6 +153,11 @@ async def shutdown(sig: signal.Signals, loop: asyncio.AbstractEventLoop, shutdow
     # loop.stop() # This is often not needed if main exits cleanly.
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Server")
+    parser.add_argument("--loop", choices=["asyncio", "uvloop"], default=None,
+                        help=f"Event loop implementation (default: settings.event_loop; available here: {', '.join(available_event_loops())})")
+    cli_args = parser.parse_args()
+    install_event_loop_policy(cli_args.loop or settings.event_loop)
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
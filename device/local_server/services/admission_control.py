@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, Optional
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejectedError(Exception):
+    """Raised when a command cannot be admitted because its wait queue is full."""
+    def __init__(self, action: str, retry_after_seconds: float, queue_depth: int):
+        super().__init__(f"Too many queued '{action}' commands ({queue_depth}); retry after {retry_after_seconds:.1f}s")
+        self.action = action
+        self.retry_after_seconds = retry_after_seconds
+        self.queue_depth = queue_depth
+
+class _ActionGate:
+    """Concurrency slot pool plus FIFO wait queue for one command_action."""
+    def __init__(self, action: str, limit: int, max_queued: int):
+        self.action = action
+        self.limit = max(1, limit)
+        self.max_queued = max(0, max_queued)
+        self.running = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_service_seconds: Optional[float] = None # EWMA of how long admitted commands run
+
+    def record_service_time(self, seconds: float):
+        if self.avg_service_seconds is None:
+            self.avg_service_seconds = seconds
+        else:
+            self.avg_service_seconds = 0.8 * self.avg_service_seconds + 0.2 * seconds
+
+class AdmissionController:
+    """
+    Bounds how many remote commands of each action run at once. Commands over the limit wait in a
+    bounded FIFO queue; once that is full, admit() fails immediately with AdmissionRejectedError
+    carrying a retry-after hint derived from the measured service time and the queue ahead.
+    """
+    def __init__(self,
+                 action_concurrency: Optional[Dict[str, int]] = None,
+                 default_concurrency: Optional[int] = None,
+                 max_queued_per_action: Optional[int] = None,
+                 exempt_actions: Optional[list] = None):
+        admission_settings = settings.admission
+        self.action_concurrency = action_concurrency if action_concurrency is not None else dict(admission_settings.action_concurrency)
+        self.default_concurrency = default_concurrency if default_concurrency is not None else admission_settings.default_concurrency
+        self.max_queued_per_action = max_queued_per_action if max_queued_per_action is not None else admission_settings.max_queued_per_action
+        self.exempt_actions = set(exempt_actions if exempt_actions is not None else admission_settings.exempt_actions)
+        self._gates: Dict[str, _ActionGate] = {}
+
+    def _gate(self, action: str) -> _ActionGate:
+        gate = self._gates.get(action)
+        if gate is None:
+            gate = _ActionGate(action, self.action_concurrency.get(action, self.default_concurrency), self.max_queued_per_action)
+            self._gates[action] = gate
+        return gate
+
+    def retry_after_seconds(self, action: str) -> float:
+        """Rough time until a new command of this action would get a slot."""
+        gate = self._gate(action)
+        base = settings.admission.retry_after_seconds
+        if gate.avg_service_seconds is None:
+            return base
+        estimate = gate.avg_service_seconds * (len(gate.waiters) + 1) / gate.limit
+        return round(min(max(estimate, base / 4), settings.admission.max_retry_after_seconds), 2)
+
+    async def _acquire(self, gate: _ActionGate):
+        if gate.running < gate.limit and not gate.waiters:
+            gate.running += 1
+            return
+        if len(gate.waiters) >= gate.max_queued:
+            gate.rejected += 1
+            logger.warning(f"AdmissionController: Rejecting '{gate.action}' command, {gate.running} running and {len(gate.waiters)} queued.")
+            raise AdmissionRejectedError(gate.action, self.retry_after_seconds(gate.action), len(gate.waiters))
+        waiter = asyncio.get_running_loop().create_future()
+        gate.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(gate) # The slot was handed over just as we were cancelled; pass it on
+            elif waiter in gate.waiters:
+                gate.waiters.remove(waiter)
+            raise
+
+    def _release(self, gate: _ActionGate):
+        # Hand the slot straight to the oldest waiter so running never dips below the limit while work is queued.
+        while gate.waiters:
+            waiter = gate.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        gate.running -= 1
+
+    @contextlib.asynccontextmanager
+    async def admit(self, action: str) -> AsyncIterator[None]:
+        """Holds a slot for `action` for the duration of the block. Exempt actions pass straight through."""
+        if action in self.exempt_actions:
+            yield
+            return
+        gate = self._gate(action)
+        await self._acquire(gate)
+        gate.admitted += 1
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            gate.record_service_time(time.monotonic() - start_time)
+            self._release(gate)
+
+    def required_connection_window(self, actions: Iterable[str]) -> int:
+        """
+        Smallest per-connection in-flight window that can hold every admitted (running or queued) command of
+        `actions` and still read one more of each exempt action. With a smaller window a connection full of
+        queued work stops reading before its "busy" replies, status polls and cancellations are seen.
+        """
+        capacity = 0
+        for action in set(actions) - self.exempt_actions:
+            gate = self._gate(action)
+            capacity += gate.limit + gate.max_queued
+        return capacity + max(1, len(self.exempt_actions))
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(gate.waiters) for gate in self._gates.values())
+
+    @property
+    def rejected_count(self) -> int:
+        return sum(gate.rejected for gate in self._gates.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "rejected_total": self.rejected_count,
+            "actions": {
+                action: {
+                    "running": gate.running,
+                    "queued": len(gate.waiters),
+                    "limit": gate.limit,
+                    "max_queued": gate.max_queued,
+                    "admitted": gate.admitted,
+                    "rejected": gate.rejected,
+                    "avg_service_ms": int(gate.avg_service_seconds * 1000) if gate.avg_service_seconds is not None else None,
+                }
+                for action, gate in self._gates.items()
+            },
+        }
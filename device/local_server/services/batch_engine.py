@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from ..core.config import settings
+from .task_scheduler import TaskScheduler, CLASS_BATCH
+from .vllm_service import VLLMService, VLLMServiceError
+
+logger = logging.getLogger(__name__)
+
+_WORKER_DONE = object()
+
+class BatchEngine:
+    """
+    Runs a batch of prompts through vLLM with a fixed pool of workers instead of one coroutine per
+    prompt. Identical prompts are generated once and the result is fanned out to every index that
+    asked for it. With pack_size > 1, each worker sends up to that many prompts in one /completions
+    call. Results are yielded as they complete through a bounded buffer, so a slow consumer pauses
+    the workers rather than letting finished results pile up.
+    """
+    def __init__(self,
+                 vllm_service: VLLMService,
+                 scheduler: TaskScheduler,
+                 max_concurrency: Optional[int] = None,
+                 pack_size: Optional[int] = None,
+                 result_buffer: Optional[int] = None):
+        batch_settings = settings.batch
+        self.vllm_service = vllm_service
+        self.scheduler = scheduler
+        self.max_concurrency = max(1, max_concurrency if max_concurrency is not None else batch_settings.max_concurrency)
+        self.pack_size = max(1, pack_size if pack_size is not None else batch_settings.pack_size)
+        self.result_buffer = max(1, result_buffer if result_buffer is not None else batch_settings.result_buffer)
+
+    def _jobs(self, unique_prompts: List[str]) -> Iterator[List[str]]:
+        for start in range(0, len(unique_prompts), self.pack_size):
+            yield unique_prompts[start:start + self.pack_size]
+
+    async def _generate(self, job: List[str], params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Per-prompt outcome fields ("status" plus text or error) for one job."""
+        try:
+            async with self.scheduler.slot(CLASS_BATCH):
+                if len(job) == 1 and self.pack_size == 1:
+                    vllm_response = await self.vllm_service.generate_response(prompt=job[0], params=params)
+                    generated_text = vllm_response.get("choices", [{}])[0].get("message", {}).get("content")
+                    if not generated_text:
+                        raise VLLMServiceError("Local LLM returned empty content for batch item.")
+                    return [{"status": "success", "generated_text": generated_text, "vllm_full_response": vllm_response}]
+                texts = await self.vllm_service.generate_completions(job, params)
+            return [
+                {"status": "success", "generated_text": text, "packed_with": len(job)} if text else
+                {"status": "error", "error_message": "Local LLM returned empty content for batch item."}
+                for text in texts
+            ]
+        except VLLMServiceError as e:
+            logger.error(f"BatchEngine: vLLM error for {len(job)} prompt(s): {e}")
+            return [{"status": "error", "error_message": str(e)}] * len(job)
+        except Exception as e_unexp:
+            logger.error(f"BatchEngine: Unexpected error for {len(job)} prompt(s): {e_unexp}", exc_info=True)
+            return [{"status": "error", "error_message": f"Unexpected error: {str(e_unexp)}"}] * len(job)
+
+    async def _worker(self, jobs: Iterator[List[str]], indexes: Dict[str, List[int]],
+                      params: Optional[Dict[str, Any]], results: asyncio.Queue):
+        for job in jobs: # Shared iterator: each job is taken by exactly one worker
+            outcomes = await self._generate(job, params)
+            for prompt, outcome in zip(job, outcomes):
+                first_index = indexes[prompt][0]
+                for index in indexes[prompt]:
+                    result = {"request_id": str(uuid.uuid4()), "index": index, "prompt": prompt, **outcome}
+                    if index != first_index:
+                        result["duplicate_of"] = first_index
+                    await results.put(result)
+        await results.put(_WORKER_DONE)
+
+    async def run(self, prompts: Sequence[str], params: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yields one result per prompt, in completion order; each carries the prompt's "index". Closing the
+        iterator early cancels the outstanding work.
+        """
+        indexes: Dict[str, List[int]] = {}
+        for index, prompt in enumerate(prompts):
+            indexes.setdefault(prompt, []).append(index)
+        if not indexes:
+            return
+        unique_prompts = list(indexes)
+        if len(unique_prompts) < len(prompts):
+            logger.info(f"BatchEngine: {len(prompts) - len(unique_prompts)} duplicate prompt(s) in a batch of {len(prompts)} will share results.")
+
+        worker_count = min(self.max_concurrency, -(-len(unique_prompts) // self.pack_size))
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.result_buffer)
+        jobs = self._jobs(unique_prompts)
+        workers = [asyncio.create_task(self._worker(jobs, indexes, params, results)) for _ in range(worker_count)]
+        try:
+            remaining = worker_count
+            while remaining:
+                result = await results.get()
+                if result is _WORKER_DONE:
+                    remaining -= 1
+                    continue
+                yield result
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
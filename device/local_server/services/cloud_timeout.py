@@ -0,0 +1,65 @@
+import logging
+from typing import Any, Dict, Optional
+
+from ..core.config import settings
+from ..utils.metrics import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveTimeout:
+    """
+    Timeout for cloud refinement derived from recently observed latencies instead of one fixed number:
+    the `percentile`-th latency times `margin_factor` plus `margin_seconds`, clamped to
+    [floor_seconds, ceiling_seconds]. Until `min_samples` latencies have been seen it returns the
+    ceiling. A request that times out is recorded at the timeout it was given. Its real latency is at
+    least that, so when the cloud slows down for good, every timeout raises the next one by the margin
+    until the timeout has caught up with the cloud (or hit the ceiling).
+    """
+    def __init__(self,
+                 percentile: Optional[int] = None,
+                 margin_factor: Optional[float] = None,
+                 margin_seconds: Optional[float] = None,
+                 floor_seconds: Optional[float] = None,
+                 ceiling_seconds: Optional[float] = None,
+                 min_samples: Optional[int] = None,
+                 window_size: Optional[int] = None):
+        timeout_settings = settings.cloud_timeout
+        self.percentile = percentile if percentile is not None else timeout_settings.percentile
+        self.margin_factor = margin_factor if margin_factor is not None else timeout_settings.margin_factor
+        self.margin_seconds = margin_seconds if margin_seconds is not None else timeout_settings.margin_seconds
+        self.floor_seconds = floor_seconds if floor_seconds is not None else timeout_settings.floor_seconds
+        self._ceiling_seconds = ceiling_seconds if ceiling_seconds is not None else timeout_settings.ceiling_seconds
+        self.min_samples = min_samples if min_samples is not None else timeout_settings.min_samples
+        self._window = LatencyWindow(window_size if window_size is not None else settings.metrics.latency_window_size)
+        self.timeouts = 0
+
+    @property
+    def ceiling_seconds(self) -> float:
+        # None follows remote_server.cloud_request_timeout_seconds, the fixed timeout used before
+        return self._ceiling_seconds if self._ceiling_seconds is not None else float(settings.remote_server.cloud_request_timeout_seconds)
+
+    def observe(self, seconds: float) -> None:
+        """Records how long a successful cloud refinement took."""
+        self._window.observe(seconds)
+
+    def observe_timeout(self, timeout_seconds: float) -> None:
+        self.timeouts += 1
+        self._window.observe(timeout_seconds)
+
+    def current(self) -> float:
+        """Timeout (seconds) for the next cloud refinement request."""
+        ceiling = self.ceiling_seconds
+        if not settings.cloud_timeout.adaptive or self._window.total_count < self.min_samples:
+            return ceiling
+        latency = self._window.percentiles((self.percentile,))[f"p{self.percentile}"] / 1000
+        return round(min(ceiling, max(self.floor_seconds, latency * self.margin_factor + self.margin_seconds)), 3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "timeout_seconds": self.current(),
+            "samples": self._window.total_count,
+            "timeouts": self.timeouts,
+            "latency_ms": self._window.percentiles((self.percentile,)),
+            "floor_seconds": self.floor_seconds,
+            "ceiling_seconds": self.ceiling_seconds,
+        }
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from ..core.config import settings
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_IN_FLIGHT = "in_flight"
+DEDUPE_REPLAYED = "replayed"
+
+class _DedupeEntry:
+    __slots__ = ("task", "completed_at")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.completed_at: Optional[float] = None
+
+class CommandDedupeCache:
+    """
+    Bounded, TTL'd map of task_id -> command execution, so a command the cloud retries (e.g. after a
+    reconnect) runs once. A duplicate that arrives while the original is running awaits the same
+    execution; one that arrives after it finished gets the cached result replayed. Executions run
+    in their own task, so the original connection dropping does not cancel work a retry is waiting on.
+    """
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        dedupe_settings = settings.command_dedupe
+        self.max_entries = max_entries if max_entries is not None else dedupe_settings.max_entries
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else dedupe_settings.ttl_seconds
+        self._entries: "OrderedDict[str, _DedupeEntry]" = OrderedDict()
+        self.in_flight_hits = 0
+        self.replay_hits = 0
+        self.misses = 0
+
+    def _purge(self, now: float):
+        expired = [key for key, entry in self._entries.items()
+                   if entry.completed_at is not None and now - entry.completed_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) > self.max_entries:
+            for key in [key for key, entry in self._entries.items() if entry.completed_at is not None]:
+                if len(self._entries) <= self.max_entries:
+                    break
+                del self._entries[key] # Never evict in-flight executions
+
+    async def run(self,
+                  task_id: str,
+                  execute: Callable[[], Awaitable[Any]],
+                  cacheable: Callable[[Any], bool] = lambda result: True) -> Tuple[Any, Optional[str]]:
+        """
+        Runs `execute()` once per task_id. Returns (result, dedupe) where dedupe is None for a fresh
+        execution, DEDUPE_IN_FLIGHT or DEDUPE_REPLAYED. Results for which `cacheable` is false (and
+        exceptions) are handed to in-flight duplicates but not kept for replay.
+        """
+        now = time.monotonic()
+        self._purge(now)
+        entry = self._entries.get(task_id)
+        if entry is not None:
+            kind = DEDUPE_REPLAYED if entry.completed_at is not None else DEDUPE_IN_FLIGHT
+            if kind == DEDUPE_REPLAYED:
+                self.replay_hits += 1
+            else:
+                self.in_flight_hits += 1
+            metrics.record_cache("command_dedupe", True)
+            logger.info(f"CommandDedupeCache: Duplicate task {task_id} ({kind}); not executing again.")
+            return await asyncio.shield(entry.task), kind
+
+        self.misses += 1
+        metrics.record_cache("command_dedupe", False)
+        entry = _DedupeEntry(asyncio.ensure_future(execute()))
+        self._entries[task_id] = entry
+
+        def _on_done(task: asyncio.Task):
+            if task.cancelled() or task.exception() is not None or not cacheable(task.result()):
+                if self._entries.get(task_id) is entry:
+                    del self._entries[task_id]
+            else:
+                entry.completed_at = time.monotonic()
+        entry.task.add_done_callback(_on_done)
+        return await asyncio.shield(entry.task), None
+
+    def snapshot(self) -> Dict[str, Any]:
+        in_flight = sum(1 for entry in self._entries.values() if entry.completed_at is None)
+        return {
+            "entries": len(self._entries),
+            "in_flight": in_flight,
+            "in_flight_hits": self.in_flight_hits,
+            "replay_hits": self.replay_hits,
+            "misses": self.misses,
+        }
@@ -129,14 +129,20 @@ class ConfidenceService:
             logger.debug(f"Keywords found in text: {found_keywords}")
         return found_keywords
 
-    async def assess(self, generated_text: str, original_prompt: str) -> ConfidenceResult:
+    async def check_prompt_triggers(self, original_prompt: str) -> List[str]:
+        """
+        Keyword triggers found in the prompt. Any match makes assess() require refinement regardless of
+        the generated text, so callers can use this to decide on cloud refinement before generating.
+        """
         if not self.keyword_triggers:
             # This check ensures that if load_keywords hasn't been called or failed,
             # we attempt it again. Ideally, load_keywords is called at startup.
             logger.info("Keywords not loaded in ConfidenceService instance, attempting to load now.")
             await self.load_keywords()
+        return self._check_keywords(original_prompt)
 
-        keywords_found_in_prompt = self._check_keywords(original_prompt)
+    async def assess(self, generated_text: str, original_prompt: str) -> ConfidenceResult:
+        keywords_found_in_prompt = await self.check_prompt_triggers(original_prompt)
         rouge_l_f1, all_rouge_scores = self._calculate_rouge_l(generated_text=generated_text, reference_text=original_prompt)
 
         needs_refinement = False
@@ -0,0 +1,182 @@
+import random
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..core.config import settings
+from ..utils.metrics import metrics
+from .response_cache import normalize_prompt
+
+try:
+    import numpy as np # Optional (already pulled in by rouge-score); vectorises the permutations
+except ImportError:
+    np = None
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+def char_shingles(text: str, size: int) -> set:
+    """
+    Overlapping character n-grams of the normalized, lower-cased text. Characters rather than words
+    so Chinese (no spaces) and mixed-language prompts work; whitespace is already collapsed.
+    """
+    text = normalize_prompt(text).lower()
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+class MinHasher:
+    """MinHash signatures over hashed shingles using `num_perm` universal hash functions (a*x + b) mod p."""
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        # a < 2^31 and b < 2^32 keep a*x + b below 2^64 for 32-bit x, so the numpy path never wraps
+        # and produces exactly the same signatures as the pure-Python one.
+        self._a = [rng.randrange(1, 1 << 31) for _ in range(num_perm)]
+        self._b = [rng.randrange(0, 1 << 32) for _ in range(num_perm)]
+        if np is not None:
+            self._a_np = np.array(self._a, dtype=np.uint64)[:, None]
+            self._b_np = np.array(self._b, dtype=np.uint64)[:, None]
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in char_shingles(text, self.shingle_size)]
+        if not hashes:
+            return (_MAX_HASH,) * self.num_perm
+        if np is not None:
+            values = np.array(hashes, dtype=np.uint64)[None, :]
+            permuted = np.bitwise_and((self._a_np * values + self._b_np) % np.uint64(_MERSENNE_PRIME), np.uint64(_MAX_HASH))
+            return tuple(permuted.min(axis=1).tolist())
+        return tuple(min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in zip(self._a, self._b))
+
+def estimate_jaccard(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+class _Entry:
+    __slots__ = ("signature", "scope", "value", "expires_at")
+
+    def __init__(self, signature: Tuple[int, ...], scope: str, value: Dict[str, Any], expires_at: float):
+        self.signature = signature
+        self.scope = scope # Only entries with the same scope (model + generation params) can match
+        self.value = value
+        self.expires_at = expires_at # time.monotonic()
+
+class NearDuplicateCache:
+    """
+    MinHash/LSH index from prompts to cached answers. The signature is split into `bands` bands; two
+    prompts become candidates when any band matches exactly, and a candidate is accepted when its
+    estimated Jaccard similarity reaches `threshold`. Bounded; the oldest entries are evicted first,
+    and entries expire `ttl_seconds` after they were added, as in the exact-match response cache.
+    """
+    def __init__(self,
+                 threshold: Optional[float] = None,
+                 num_perm: Optional[int] = None,
+                 bands: Optional[int] = None,
+                 shingle_size: Optional[int] = None,
+                 max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None):
+        cache_settings = settings.near_duplicate_cache
+        self.threshold = threshold if threshold is not None else cache_settings.jaccard_threshold
+        num_perm = num_perm if num_perm is not None else cache_settings.num_perm
+        self.bands = bands if bands is not None else cache_settings.bands
+        if num_perm % self.bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({self.bands})")
+        self.rows = num_perm // self.bands
+        self.max_entries = max_entries if max_entries is not None else cache_settings.max_entries
+        if ttl_seconds is None:
+            ttl_seconds = cache_settings.ttl_seconds if cache_settings.ttl_seconds is not None else settings.response_cache.ttl_seconds
+        self.ttl_seconds = ttl_seconds
+        self.hasher = MinHasher(num_perm, shingle_size if shingle_size is not None else cache_settings.shingle_size)
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # One dict per band: band hash -> entry id, or a list of ids when several entries share the band.
+        self._buckets: List[Dict[int, Any]] = [{} for _ in range(self.bands)]
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[int]:
+        return [hash(signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def _candidates(self, band_keys: List[int]) -> set:
+        found = set()
+        for bucket, key in zip(self._buckets, band_keys):
+            ids = bucket.get(key)
+            if ids is None:
+                continue
+            if isinstance(ids, list):
+                found.update(ids)
+            else:
+                found.add(ids)
+        return found
+
+    def _lookup_signature(self, signature: Tuple[int, ...], scope: str) -> Tuple[Optional[Dict[str, Any]], float]:
+        best_value, best_similarity = None, 0.0
+        for entry_id in self._candidates(self._band_keys(signature)):
+            entry = self._entries[entry_id]
+            if entry.scope != scope:
+                continue
+            similarity = estimate_jaccard(signature, entry.signature)
+            if similarity >= self.threshold and similarity > best_similarity:
+                best_value, best_similarity = entry.value, similarity
+        return best_value, best_similarity
+
+    def lookup(self, prompt: str, scope: str = "") -> Tuple[Optional[Dict[str, Any]], float]:
+        """Returns (value, estimated similarity) of the closest cached prompt at or above the threshold, else (None, 0.0)."""
+        self._evict_expired(time.monotonic())
+        value, similarity = self._lookup_signature(self.hasher.signature(prompt), scope)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        metrics.record_cache("near_duplicate", value is not None)
+        return value, similarity
+
+    def add_signature(self, signature: Tuple[int, ...], value: Dict[str, Any], scope: str = "") -> None:
+        now = time.monotonic()
+        self._evict_expired(now)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = _Entry(signature, scope, value, now + self.ttl_seconds)
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            existing = bucket.get(key)
+            if existing is None:
+                bucket[key] = entry_id
+            elif isinstance(existing, list):
+                existing.append(entry_id)
+            else:
+                bucket[key] = [existing, entry_id]
+        while len(self._entries) > self.max_entries:
+            self._evict_oldest()
+
+    def add(self, prompt: str, value: Dict[str, Any], scope: str = "") -> None:
+        self.add_signature(self.hasher.signature(prompt), value, scope)
+
+    def _evict_expired(self, now: float):
+        # Every entry gets the same TTL, so entries expire in insertion order: only the oldest need checking.
+        while self._entries and next(iter(self._entries.values())).expires_at <= now:
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        entry_id, entry = self._entries.popitem(last=False)
+        for bucket, key in zip(self._buckets, self._band_keys(entry.signature)):
+            existing = bucket.get(key)
+            if existing == entry_id:
+                del bucket[key]
+            elif isinstance(existing, list):
+                existing.remove(entry_id)
+                if len(existing) == 1:
+                    bucket[key] = existing[0]
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -15,12 +15,15 @@ import sys
 import json
 from typing import Dict, List, Optional, Tuple, Any, Union
 
-# 导入本地服务器的配置和工具
-from local_server.core.config import Settings
-from local_server.utils.logging_config import setup_logger
+# 导入本地服务器的配置
+from local_server.core.config import AppSettings
 
 logger = logging.getLogger(__name__)
 
+class OwlAgentServiceError(Exception):
+    """Owl Agent 任务执行失败时抛出"""
+    pass
+
 class DockerDesktopManager:
     """
     Docker Desktop管理器，负责检测、安装和配置Docker Desktop
@@ -28,7 +31,7 @@ class DockerDesktopManager:
     
     def __init__(self):
         """初始化Docker Desktop管理器"""
-        self.logger = setup_logger("docker_desktop_manager")
+        self.logger = logging.getLogger(f"{__name__}.docker_desktop_manager")
         self.system = platform.system()  # 'Windows', 'Darwin' (macOS), 'Linux'
         
     async def is_installed(self) -> bool:
@@ -315,7 +318,7 @@ class OwlAgentService:
     5. 检测和管理Docker Desktop
     """
     
-    def __init__(self, config: Settings):
+    def __init__(self, config: AppSettings):
         """
         初始化Owl Agent服务适配器
         
@@ -323,7 +326,7 @@ class OwlAgentService:
             config: 应用程序配置，包含Owl和vLLM相关设置
         """
         self.config = config
-        self.logger = setup_logger("owl_agent_service")
+        self.logger = logger
         self._owl_agent_instance = None
         self.vllm_endpoint = config.vllm_service_url
         self.model_name = config.local_model_name
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from ..core.config import settings
+from ..communication.tcp_client import TCPRemoteClient, TCPClientTimeoutError
+from ..communication.protocol_models import (
+    LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload,
+    BatchRefinementItem, LocalRequestCloudBatchRefinementPayload, MAX_BATCH_REFINEMENT_ITEMS,
+    new_task_id
+)
+
+logger = logging.getLogger(__name__)
+
+class _PendingRefinement:
+    __slots__ = ("request_id", "payload", "timeout", "future")
+
+    def __init__(self, payload: LocalRequestCloudRefinementPayload, timeout: Optional[float], future: asyncio.Future):
+        self.request_id = new_task_id()
+        self.payload = payload
+        self.timeout = timeout
+        self.future = future
+
+class RefinementBatcher:
+    """
+    Coalesces cloud refinement requests made within `window_ms` of each other into one
+    local_request_cloud_batch_refinement message, sent when the window closes or as soon as
+    `max_batch_size` requests have joined. Each caller awaits its own result, fanned back out by
+    request_id. A window that collects only one request sends it as a plain refinement request.
+    A failure of the whole batch (timeout, lost connection) is raised to every caller in it, with
+    the same exception TCPRemoteClient.request_cloud_refinement would have raised.
+    """
+    def __init__(self,
+                 tcp_client: TCPRemoteClient,
+                 window_ms: Optional[float] = None,
+                 max_batch_size: Optional[int] = None):
+        batch_settings = settings.refinement_batch
+        self.tcp_client = tcp_client
+        self.window_seconds = (window_ms if window_ms is not None else batch_settings.window_ms) / 1000
+        max_batch_size = max_batch_size if max_batch_size is not None else batch_settings.max_batch_size
+        self.max_batch_size = min(max(1, max_batch_size), MAX_BATCH_REFINEMENT_ITEMS)
+        self._pending: List[_PendingRefinement] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self.batches_sent = 0
+        self.batched_requests = 0
+        self.single_requests_sent = 0
+
+    async def refine(self, request_data: LocalRequestCloudRefinementPayload, timeout: Optional[float] = None) -> Optional[CloudRefinementResponseToLocalPayload]:
+        """
+        Same contract as TCPRemoteClient.request_cloud_refinement, but may share a cloud message with concurrent
+        callers. `timeout` bounds this caller's wait from now, including the batching window; the batch message
+        itself waits for the longest timeout among its requests, for the callers still waiting.
+        """
+        loop = asyncio.get_running_loop()
+        item = _PendingRefinement(request_data, timeout, loop.create_future())
+        self._pending.append(item)
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_seconds, self._flush)
+        try:
+            if timeout is None:
+                return await item.future
+            return await asyncio.wait_for(item.future, timeout) # Cancels item.future on timeout
+        except asyncio.TimeoutError as e_timeout:
+            self._forget(item)
+            raise TCPClientTimeoutError(f"Timeout for batched refinement request {item.request_id}") from e_timeout
+        except asyncio.CancelledError:
+            self._forget(item)
+            raise
+
+    def _forget(self, item: _PendingRefinement):
+        if item in self._pending:
+            self._pending.remove(item) # Not sent yet; leave it out of the batch
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[_PendingRefinement]):
+        try:
+            if len(batch) == 1:
+                self.single_requests_sent += 1
+                results: Dict[str, Any] = {batch[0].request_id: await self.tcp_client.request_cloud_refinement(batch[0].payload, timeout=batch[0].timeout)}
+            else:
+                batch_request = LocalRequestCloudBatchRefinementPayload(
+                    batch_id=new_task_id(),
+                    requests=[BatchRefinementItem(request_id=item.request_id, **item.payload.model_dump()) for item in batch]
+                )
+                self.batches_sent += 1
+                self.batched_requests += len(batch)
+                logger.info(f"RefinementBatcher: Sending batch {batch_request.batch_id} with {len(batch)} refinement requests.")
+                timeouts = [item.timeout for item in batch if item.timeout is not None]
+                batch_response = await self.tcp_client.request_cloud_batch_refinement(batch_request, timeout=max(timeouts) if timeouts else None)
+                results = {result.request_id: result for result in batch_response.results}
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        for item in batch:
+            if item.future.done(): # The caller stopped waiting
+                continue
+            result = results.get(item.request_id)
+            if result is None:
+                result = CloudRefinementResponseToLocalPayload(status="error", error_message=f"Batch response had no result for request {item.request_id}")
+            item.future.set_result(result)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "in_flight": len(self._in_flight),
+            "batches_sent": self.batches_sent,
+            "batched_requests": self.batched_requests,
+            "single_requests_sent": self.single_requests_sent,
+            "avg_batch_size": round(self.batched_requests / self.batches_sent, 2) if self.batches_sent else None,
+            "cloud_requests_saved": self.batched_requests - self.batches_sent,
+        }
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..core.config import settings, PROJECT_ROOT_DIR
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_TIER_MEMORY = "memory"
+CACHE_TIER_DISK = "disk"
+
+def normalize_prompt(prompt: str) -> str:
+    """Unicode NFKC plus collapsed whitespace, so trivially different spellings of a prompt share an entry."""
+    return " ".join(unicodedata.normalize("NFKC", prompt).split())
+
+def make_cache_key(prompt: str, generation_params: Optional[Dict[str, Any]] = None) -> str:
+    """sha256 over the normalized prompt, the model and the effective generation params."""
+    params = {
+        "model": settings.vllm.model_name_or_path,
+        "max_tokens": settings.vllm.default_max_tokens,
+        "temperature": settings.vllm.default_temperature,
+    }
+    params.update({key: value for key, value in (generation_params or {}).items() if value is not None})
+    material = json.dumps([normalize_prompt(prompt), params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class _DiskTier:
+    """SQLite key/value table. Every call runs in a worker thread so the event loop never waits on disk."""
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = asyncio.Lock() # sqlite3 connections must not be used by two threads at once
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+        return self._conn
+
+    def _get_sync(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        row = self._connect().execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] <= time.time():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _put_sync(self, key: str, value: Dict[str, Any], expires_at: float):
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, json.dumps(value, ensure_ascii=False), expires_at))
+        conn.commit()
+
+    def _purge_expired_sync(self) -> int:
+        deleted = self._connect().execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),)).rowcount
+        self._conn.commit()
+        return deleted
+
+    async def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get_sync, key)
+
+    async def put(self, key: str, value: Dict[str, Any], expires_at: float):
+        async with self._lock:
+            await asyncio.to_thread(self._put_sync, key, value, expires_at)
+
+    async def purge_expired(self) -> int:
+        async with self._lock:
+            return await asyncio.to_thread(self._purge_expired_sync)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class ResponseCache:
+    """
+    Two-tier cache of full-flow results: an in-memory LRU with TTL in front of an optional SQLite
+    file that survives restarts. Disk hits are promoted into memory. Disk errors are logged and
+    treated as misses; the cache never fails a request.
+    """
+    def __init__(self,
+                 max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None,
+                 disk_path: Optional[str] = None):
+        cache_settings = settings.response_cache
+        self.max_entries = max_entries if max_entries is not None else cache_settings.max_entries
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else cache_settings.ttl_seconds
+        if disk_path is None and cache_settings.disk_path:
+            disk_path = cache_settings.disk_path
+            if not os.path.isabs(disk_path):
+                disk_path = os.path.join(PROJECT_ROOT_DIR, disk_path)
+        self._memory: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._disk = _DiskTier(disk_path) if disk_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Returns (value, tier) on a hit, (None, None) on a miss."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[1] > time.time():
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                metrics.record_cache("response", True)
+                return entry[0], CACHE_TIER_MEMORY
+            del self._memory[key]
+
+        if self._disk is not None:
+            try:
+                disk_entry = await self._disk.get(key)
+            except (sqlite3.Error, OSError, ValueError) as e:
+                logger.warning(f"ResponseCache: Disk lookup failed: {e}")
+                disk_entry = None
+            if disk_entry is not None:
+                self._remember(key, disk_entry[0], disk_entry[1])
+                self.disk_hits += 1
+                metrics.record_cache("response", True)
+                return disk_entry[0], CACHE_TIER_DISK
+
+        self.misses += 1
+        metrics.record_cache("response", False)
+        return None, None
+
+    async def put(self, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        if self._disk is not None:
+            try:
+                await self._disk.put(key, value, expires_at)
+            except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+                logger.warning(f"ResponseCache: Disk write failed: {e}")
+
+    async def purge_expired(self) -> int:
+        """Drops expired entries from both tiers; returns how many disk rows were removed."""
+        now = time.time()
+        for key in [key for key, (_, expires_at) in self._memory.items() if expires_at <= now]:
+            del self._memory[key]
+        if self._disk is None:
+            return 0
+        try:
+            return await self._disk.purge_expired()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"ResponseCache: Disk purge failed: {e}")
+            return 0
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._disk is not None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+        }
@@ -2,23 +2,38 @@ import asyncio
 import uuid
 import logging
 import time
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator, Awaitable, Callable
 
 from ..core.config import settings
+from ..utils.loop_watchdog import loop_watchdog
+from ..utils.metrics import metrics, STAGE_LOCAL_GENERATION, STAGE_CONFIDENCE, STAGE_CLOUD_REFINEMENT, STAGE_TTFT_LOCAL, STAGE_TTFT_CLOUD, STAGE_TOTAL
 from .vllm_service import VLLMService, VLLMServiceError
 from .confidence_service import ConfidenceService, ConfidenceResult
 from .owl_agent_service import OwlAgentService, OwlAgentServiceError
+from .admission_control import AdmissionController, AdmissionRejectedError
+from .command_dedupe import CommandDedupeCache
+from .response_cache import ResponseCache, make_cache_key, normalize_prompt
+from .near_duplicate_cache import NearDuplicateCache
+from .task_scheduler import TaskScheduler, CLASS_INTERACTIVE, CLASS_COMMAND, CLASS_BATCH
+from .batch_engine import BatchEngine
+from .task_registry import TaskRegistry, TaskCancelledError
+from .refinement_batcher import RefinementBatcher
+from .cloud_timeout import AdaptiveTimeout
 from ..communication.tcp_client import TCPRemoteClient, TCPClientError, TCPClientTimeoutError, TCPClientConnectionError
 from ..communication.protocol_models import (
     BaseMessage,
-    RemoteCommandToLocalPayload, ExecuteOwlTaskDetails, QueryLocalModelDirectDetails, GetLocalStatusDetails,
+    RemoteCommandToLocalPayload, ExecuteOwlTaskDetails, QueryLocalModelDirectDetails, GetLocalStatusDetails, CancelTaskDetails,
     LocalResponseToRemotePayload,
     LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload, ConfidenceAssessmentData,
-    LocalConfidentResultNotificationPayload
+    LocalConfidentResultNotificationPayload, COMMAND_DETAIL_MODELS,
+    parse_incoming_message, validate_model
 )
 
 logger = logging.getLogger(__name__)
 
+# Remote commands that do real work and are registered so that cancel_task can stop them.
+CANCELLABLE_COMMAND_ACTIONS = ("execute_owl_task", "query_local_model_direct")
+
 class TaskOrchestratorError(Exception):
     """Custom exception for Task Orchestrator errors."""
     pass
@@ -28,30 +43,329 @@ class TaskOrchestrator:
                  vllm_service: VLLMService,
                  confidence_service: ConfidenceService,
                  owl_agent_service: OwlAgentService,
-                 tcp_remote_client: TCPRemoteClient):
+                 tcp_remote_client: TCPRemoteClient,
+                 admission_controller: Optional[AdmissionController] = None,
+                 command_dedupe: Optional[CommandDedupeCache] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 near_duplicate_cache: Optional[NearDuplicateCache] = None,
+                 scheduler: Optional[TaskScheduler] = None,
+                 task_registry: Optional[TaskRegistry] = None,
+                 refinement_batcher: Optional[RefinementBatcher] = None,
+                 cloud_timeout: Optional[AdaptiveTimeout] = None):
         self.vllm_service = vllm_service
         self.confidence_service = confidence_service
         self.owl_agent_service = owl_agent_service
         self.tcp_client = tcp_remote_client
-        self._active_tasks_count = 0 # Simple counter for active tasks
+        self.admission = admission_controller or AdmissionController() # Per-action limits for remote commands
+        self.command_dedupe = command_dedupe or CommandDedupeCache() # Replays results for retried task_ids
+        self.response_cache = response_cache or ResponseCache() # Full-flow results per prompt + params
+        self.near_duplicate_cache = near_duplicate_cache or NearDuplicateCache() # Cloud-refined answers for similar prompts
+        self.scheduler = scheduler or TaskScheduler() # Per-class limits and fair sharing of the vLLM backend
+        self.task_registry = task_registry or TaskRegistry() # Running commands and full flows, cancellable by task_id
+        self.refinement_batcher = refinement_batcher or RefinementBatcher(tcp_remote_client) # Used when settings.refinement_batch.enabled
+        self.cloud_timeout = cloud_timeout or AdaptiveTimeout() # Cloud refinement timeout from observed latency
+        self._cloud_upgrades: set = set() # Background cloud refinements for answers already returned at the soft deadline
+        metrics.register_gauge("queue_depth", lambda: self.admission.queue_depth)
+        metrics.register_gauge("active_tasks", lambda: self.scheduler.active_count)
+        metrics.register_gauge("backend_queue_depth", lambda: self.scheduler.queue_depth)
         logger.info("TaskOrchestrator initialized.")
 
     async def get_active_tasks_count(self) -> int:
-        return self._active_tasks_count
+        return self.scheduler.active_count
+
+    async def get_admission_stats(self) -> Dict[str, int]:
+        return {"queued_commands_count": self.admission.queue_depth, "rejected_commands_count": self.admission.rejected_count}
+
+    def tcp_server_in_flight_window(self) -> int:
+        """
+        Per-connection in-flight window for the command server: the configured one, raised if needed so that
+        commands queued for admission can never fill it (see AdmissionController.required_connection_window).
+        """
+        configured = settings.remote_server.tcp_server_max_in_flight_per_connection
+        required = self.admission.required_connection_window(COMMAND_DETAIL_MODELS)
+        if configured < required:
+            logger.warning(f"TaskOrchestrator: tcp_server_max_in_flight_per_connection={configured} is below the {required} commands admission can hold; using {required}.")
+            return required
+        return configured
+
+    def _to_assessment_data(self, confidence_result: ConfidenceResult) -> ConfidenceAssessmentData:
+        """Maps a ConfidenceResult onto the wire model (their field names differ)."""
+        return ConfidenceAssessmentData(
+            rouge_l_score=confidence_result.score,
+            keyword_triggers_found=confidence_result.keywords_found,
+            requires_cloud_refinement=confidence_result.needs_refinement,
+            details=confidence_result.details
+        )
+
+    def _response_cache_key(self, user_prompt: str, generation_params: Optional[Dict[str, Any]], bypass_cache: bool) -> Optional[str]:
+        """Cache key for this request, or None when the response cache must not be used for it."""
+        cache_settings = settings.response_cache
+        if bypass_cache or not cache_settings.enabled or self._sampling_bypasses_cache(generation_params):
+            return None
+        return make_cache_key(user_prompt, generation_params)
+
+    def _sampling_bypasses_cache(self, generation_params: Optional[Dict[str, Any]]) -> bool:
+        threshold = settings.response_cache.bypass_above_temperature
+        if threshold is None:
+            return False
+        temperature = (generation_params or {}).get("temperature", settings.vllm.default_temperature)
+        # Non-deterministic sampling; a cached answer would hide the variation the caller asked for
+        return temperature is not None and temperature > threshold
+
+    def _near_duplicate_scope(self, user_prompt: str, generation_params: Optional[Dict[str, Any]], bypass_cache: bool) -> Optional[str]:
+        """Scope (model + generation params) a near-duplicate match must share, or None when the index must not be used."""
+        near_settings = settings.near_duplicate_cache
+        if bypass_cache or not near_settings.enabled or self._sampling_bypasses_cache(generation_params):
+            return None
+        if len(normalize_prompt(user_prompt)) < near_settings.min_prompt_chars:
+            return None
+        return make_cache_key("", generation_params)
+
+    def _record_stage_histograms(self, details: Dict[str, Any], source: str):
+        """Adds a finished request's stage durations (and its total) to the per-stage, per-source histograms."""
+        for stage in details["stages"]:
+            if "duration_ms" in stage:
+                metrics.observe_stage(stage["name"], source, stage["duration_ms"] / 1000)
+        metrics.observe_stage(STAGE_TOTAL, source, details["total_duration_ms"] / 1000)
+
+    async def _generate_local_draft(self, user_prompt: str, request_id: str, details: Dict[str, Any], generation_params: Optional[Dict[str, Any]] = None) -> str:
+        # 1. Local LLM Generation
+        logger.debug(f"TaskOrchestrator (Request ID: {request_id}): Requesting local LLM generation.")
+        local_llm_start_time = time.monotonic()
+        try:
+            async with self.scheduler.slot(CLASS_INTERACTIVE) as queue_wait_seconds:
+                if generation_params:
+                    vllm_response = await self.vllm_service.generate_response(prompt=user_prompt, params=generation_params)
+                else:
+                    vllm_response = await self.vllm_service.generate_response(prompt=user_prompt)
+            local_generated_text = vllm_response.get("choices", [{}])[0].get("message", {}).get("content")
+            if not local_generated_text:
+                raise TaskOrchestratorError("Local LLM returned empty content.")
+            metrics.observe(STAGE_LOCAL_GENERATION, time.monotonic() - local_llm_start_time)
+            details["stages"].append({
+                "name": "local_llm_generation", 
+                "status": "success", 
+                "duration_ms": int((time.monotonic() - local_llm_start_time) * 1000),
+                "queue_wait_ms": int(queue_wait_seconds * 1000),
+                "output_preview": local_generated_text[:100] + "..."
+            })
+            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Local LLM generation successful.")
+        except VLLMServiceError as e:
+            logger.error(f"TaskOrchestrator (Request ID: {request_id}): Local LLM generation failed: {e}")
+            details["stages"].append({"name": "local_llm_generation", "status": "error", "error": str(e), "duration_ms": int((time.monotonic() - local_llm_start_time) * 1000)})
+            raise TaskOrchestratorError(f"Local LLM generation failed: {e}") from e
+        return local_generated_text
 
-    async def _increment_active_tasks(self):
-        self._active_tasks_count += 1
+    async def _assess_local_draft(self, local_generated_text: str, user_prompt: str, request_id: str, details: Dict[str, Any]) -> ConfidenceResult:
+        # 2. Confidence Assessment
+        logger.debug(f"TaskOrchestrator (Request ID: {request_id}): Assessing confidence of local result.")
+        confidence_start_time = time.monotonic()
+        confidence_assessment_result: ConfidenceResult = await self.confidence_service.assess(
+            generated_text=local_generated_text,
+            original_prompt=user_prompt
+        )
+        metrics.observe(STAGE_CONFIDENCE, time.monotonic() - confidence_start_time)
+        details["stages"].append({
+            "name": "confidence_assessment", 
+            "status": "success", 
+            "duration_ms": int((time.monotonic() - confidence_start_time) * 1000),
+            "assessment": confidence_assessment_result.to_dict()
+        })
+        logger.info(f"TaskOrchestrator (Request ID: {request_id}): Confidence assessment complete. Needs refinement: {confidence_assessment_result.needs_refinement}")
+        return confidence_assessment_result
 
-    async def _decrement_active_tasks(self):
-        self._active_tasks_count = max(0, self._active_tasks_count - 1)
+    async def _refine_in_cloud(self, refinement_request_payload: LocalRequestCloudRefinementPayload, request_id: str, details: Dict[str, Any]) -> Tuple[Optional[str], str]:
+        """
+        Requests cloud refinement and records the stage. Returns (refined_result, source); refined_result is
+        None when the cloud failed, and source then names the local fallback reason. The wait is bounded by
+        the adaptive cloud timeout.
+        """
+        cloud_refinement_start_time = time.monotonic()
+        timeout_seconds = self.cloud_timeout.current()
+        try:
+            cloud_response: Optional[CloudRefinementResponseToLocalPayload]
+            if settings.refinement_batch.enabled:
+                cloud_response = await self.refinement_batcher.refine(refinement_request_payload, timeout=timeout_seconds)
+            else:
+                cloud_response = await self.tcp_client.request_cloud_refinement(refinement_request_payload, timeout=timeout_seconds)
+            cloud_elapsed = time.monotonic() - cloud_refinement_start_time
+            metrics.observe(STAGE_CLOUD_REFINEMENT, cloud_elapsed)
+            cloud_stage_details = {
+                "name": "cloud_refinement",
+                "duration_ms": int((time.monotonic() - cloud_refinement_start_time) * 1000),
+                "timeout_ms": int(timeout_seconds * 1000)
+            }
+            if cloud_response and cloud_response.status == "success" and cloud_response.refined_result:
+                # Only real refinements shape the timeout; fast errors and empty answers would pull it down
+                self.cloud_timeout.observe(cloud_elapsed)
+                cloud_stage_details["status"] = "success"
+                cloud_stage_details["cloud_tokens_consumed"] = cloud_response.cloud_tokens_consumed
+                details["stages"].append(cloud_stage_details)
+                logger.info(f"TaskOrchestrator (Request ID: {request_id}): Cloud refinement successful.")
+                return cloud_response.refined_result, "cloud_refined_success"
+            # Cloud refinement failed, timed out, or returned error/no result
+            cloud_stage_details["status"] = "failure_or_fallback"
+            cloud_stage_details["cloud_response"] = cloud_response.model_dump() if cloud_response else None
+            details["stages"].append(cloud_stage_details)
+            logger.warning(f"TaskOrchestrator (Request ID: {request_id}): Cloud refinement failed or no result. Falling back to local. Response: {cloud_response}")
+            return None, "local_fallback_cloud_failure"
+        except TCPClientTimeoutError as e_timeout:
+            self.cloud_timeout.observe_timeout(timeout_seconds)
+            details["stages"].append({"name": "cloud_refinement", "status": "timeout", "error": str(e_timeout), "timeout_ms": int(timeout_seconds * 1000), "duration_ms": int((time.monotonic() - cloud_refinement_start_time) * 1000)})
+            logger.warning(f"TaskOrchestrator (Request ID: {request_id}): Cloud refinement timed out after {timeout_seconds:.1f}s. Falling back to local. Error: {e_timeout}")
+            return None, "local_fallback_cloud_timeout"
+        except TCPClientError as e_tcp:
+            details["stages"].append({"name": "cloud_refinement", "status": "tcp_error", "error": str(e_tcp), "duration_ms": int((time.monotonic() - cloud_refinement_start_time) * 1000)})
+            logger.error(f"TaskOrchestrator (Request ID: {request_id}): TCP error during cloud refinement. Falling back to local. Error: {e_tcp}")
+            return None, "local_fallback_cloud_tcp_error"
 
-    async def process_user_request_full_flow(self, user_prompt: str, request_id: Optional[str] = None) -> Dict[str, Any]:
+    async def _speculative_refinement(self, user_prompt: str, keyword_triggers: List[str], request_id: str,
+                                      details: Dict[str, Any], generation_params: Optional[Dict[str, Any]]) -> Tuple[str, str]:
+        """
+        For prompts whose keyword triggers already guarantee refinement: asks the cloud (without a draft) while
+        the local draft is generated, so the request takes about max(local, cloud) instead of their sum. A
+        successful cloud answer cancels local generation; otherwise the local draft is the fallback.
+        """
+        refinement_request_payload = LocalRequestCloudRefinementPayload(
+            original_user_prompt=user_prompt,
+            local_model_draft_result="", # Not generated yet; the hints tell the cloud to answer from the prompt
+            confidence_assessment=ConfidenceAssessmentData(
+                keyword_triggers_found=keyword_triggers,
+                requires_cloud_refinement=True,
+                details={"reason_for_refinement": f"Keyword trigger(s) in prompt: {keyword_triggers}."}
+            ),
+            refinement_hints={"speculative": True, "local_draft_pending": True}
+        )
+        local_task = asyncio.ensure_future(self._generate_local_draft(user_prompt, request_id, details, generation_params))
+        cloud_task = asyncio.ensure_future(self._refine_in_cloud(refinement_request_payload, request_id, details))
+        details["speculative_refinement"] = {"keyword_triggers": keyword_triggers, "local_cancelled": False}
+        try:
+            refined_result, source = await cloud_task
+            if refined_result is not None:
+                if not local_task.done():
+                    local_task.cancel()
+                    details["speculative_refinement"]["local_cancelled"] = True
+                    details["stages"].append({"name": "local_llm_generation", "status": "cancelled"})
+                    logger.info(f"TaskOrchestrator (Request ID: {request_id}): Cloud answered first; cancelled local generation.")
+                elif not local_task.cancelled():
+                    local_task.exception() # A failed draft no longer matters; mark the exception retrieved
+                return refined_result, source
+            return await local_task, source
+        finally:
+            for task in (local_task, cloud_task):
+                if not task.done():
+                    task.cancel()
+
+    async def _refine_with_soft_deadline(self, refinement_request_payload: LocalRequestCloudRefinementPayload, request_id: str,
+                                         details: Dict[str, Any], deadline: float) -> Tuple[Optional[str], str, Optional[asyncio.Task]]:
+        """
+        _refine_in_cloud, waited for only until `deadline` (monotonic). If the cloud has not answered by then,
+        returns (None, "local_soft_deadline", cloud_task) and the cloud request keeps running; otherwise
+        returns _refine_in_cloud's result and None.
+        """
+        cloud_details: Dict[str, Any] = {"stages": []}
+        cloud_task = asyncio.ensure_future(self._refine_in_cloud(refinement_request_payload, request_id, cloud_details))
+        try:
+            done, _ = await asyncio.wait({cloud_task}, timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.CancelledError:
+            cloud_task.cancel()
+            raise
+        if done:
+            details["stages"].extend(cloud_details["stages"])
+            refined_result, source = cloud_task.result()
+            return refined_result, source, None
+        details["stages"].append({"name": "cloud_refinement", "status": "soft_deadline", "continues_in_background": True})
+        details["cloud_upgrade"] = {"pending": True}
+        logger.info(f"TaskOrchestrator (Request ID: {request_id}): Cloud refinement missed the soft deadline. Returning the local draft; the cloud answer follows as an upgrade.")
+        return None, "local_soft_deadline", cloud_task
+
+    async def _deliver_cloud_upgrade(self, cloud_task: asyncio.Task, user_prompt: str, request_id: str,
+                                     cache_key: Optional[str], near_scope: Optional[str],
+                                     on_upgrade: Optional[Callable[[Dict[str, Any]], Awaitable[None]]]):
+        """Waits for a cloud refinement that missed the soft deadline, caches a successful answer and hands it to on_upgrade."""
+        try:
+            refined_result, source = await cloud_task
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.error(f"TaskOrchestrator (Request ID: {request_id}): Background cloud refinement failed: {e}", exc_info=True)
+            return
+        if refined_result is None:
+            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Background cloud refinement gave no answer ({source}); the local draft stands.")
+            return
+        if cache_key is not None:
+            await self.response_cache.put(cache_key, {"result_text": refined_result, "source": source})
+        if near_scope is not None:
+            self.near_duplicate_cache.add(user_prompt, {"result_text": refined_result, "source": source}, near_scope)
+        logger.info(f"TaskOrchestrator (Request ID: {request_id}): Cloud upgrade ready for the soft-deadline answer.")
+        if on_upgrade is not None:
+            try:
+                await on_upgrade({"request_id": request_id, "result_text": refined_result, "source": source, "upgrade_of": "local_soft_deadline"})
+            except Exception as e:
+                logger.error(f"TaskOrchestrator (Request ID: {request_id}): on_upgrade callback failed: {e}", exc_info=True)
+
+    async def _run_full_flow_stages(self, user_prompt: str, request_id: str, details: Dict[str, Any],
+                                    generation_params: Optional[Dict[str, Any]], task_start_time: float) -> Tuple[str, str, Optional[asyncio.Task]]:
+        """
+        Local generation, confidence assessment and (if needed) cloud refinement; returns (final_result, source, cloud_upgrade).
+        cloud_upgrade is the still-running cloud refinement when the soft deadline returned the local draft, else None.
+        """
+        cloud_upgrade: Optional[asyncio.Task] = None
+        keyword_triggers: List[str] = []
+        if settings.confidence.speculative_cloud_refinement:
+            keyword_triggers = await self.confidence_service.check_prompt_triggers(user_prompt)
+        if keyword_triggers:
+            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Prompt keyword triggers {keyword_triggers}. Refining speculatively alongside local generation.")
+            final_result, source = await self._speculative_refinement(user_prompt, keyword_triggers, request_id, details, generation_params)
+        else:
+            local_generated_text = await self._generate_local_draft(user_prompt, request_id, details, generation_params)
+            confidence_assessment_result = await self._assess_local_draft(local_generated_text, user_prompt, request_id, details)
+
+            # 3. Decision: Use local result or request cloud refinement
+            if not confidence_assessment_result.needs_refinement:
+                final_result = local_generated_text
+                source = "local_high_confidence"
+                logger.info(f"TaskOrchestrator (Request ID: {request_id}): High confidence. Using local result.")
+                # Notify remote server about confident local result (fire and forget)
+                notification_payload = LocalConfidentResultNotificationPayload(
+                    original_user_prompt=user_prompt,
+                    local_model_final_result=final_result,
+                    confidence_assessment=self._to_assessment_data(confidence_assessment_result),
+                    local_processing_time_ms=int((time.monotonic() - task_start_time) * 1000)
+                )
+                asyncio.create_task(self.tcp_client.send_confident_result_notification(notification_payload))
+            else:
+                logger.info(f"TaskOrchestrator (Request ID: {request_id}): Low confidence. Requesting cloud refinement.")
+                refinement_request_payload = LocalRequestCloudRefinementPayload(
+                    original_user_prompt=user_prompt,
+                    local_model_draft_result=local_generated_text,
+                    confidence_assessment=self._to_assessment_data(confidence_assessment_result),
+                    # refinement_hints: Optional - can be added if we have specific hints
+                )
+                soft_deadline_seconds = settings.cloud_timeout.soft_deadline_seconds
+                if soft_deadline_seconds is not None:
+                    refined_result, source, cloud_upgrade = await self._refine_with_soft_deadline(
+                        refinement_request_payload, request_id, details, task_start_time + soft_deadline_seconds)
+                else:
+                    refined_result, source = await self._refine_in_cloud(refinement_request_payload, request_id, details)
+                final_result = refined_result or local_generated_text # Fallback to local result
+        return final_result, source, cloud_upgrade
+
+    async def process_user_request_full_flow(self, user_prompt: str, request_id: Optional[str] = None,
+                                             generation_params: Optional[Dict[str, Any]] = None, bypass_cache: bool = False,
+                                             on_upgrade: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None) -> Dict[str, Any]:
         """
         Handles a user prompt through the full local processing and potential cloud refinement flow.
         This is the primary entry point for user-initiated tasks that require LLM generation.
         Returns a dictionary suitable for an API response to the end-user (e.g., desktop app).
+        Answers for a prompt seen before (same normalized text and generation params) come from the
+        response cache unless `bypass_cache` is set; details["cache"] then names the tier that hit.
+        A cancel_task command naming the request_id stops the flow; the result then has source "cancelled".
+        With settings.cloud_timeout.soft_deadline_seconds set, a cloud refinement still running at the deadline
+        is not waited for: the local draft is returned (source "local_soft_deadline") and the cloud answer, if
+        it arrives, is cached and passed to `on_upgrade` as {request_id, result_text, source, upgrade_of}.
         """
-        await self._increment_active_tasks()
+        self.scheduler.task_started(CLASS_INTERACTIVE)
         task_start_time = time.monotonic()
         request_id = request_id or str(uuid.uuid4())
         logger.info(f"TaskOrchestrator (Request ID: {request_id}): Starting full flow for prompt: \nRPT.Slice.Start------------------------------------------------------\n{user_prompt[:100]}...\nRPT.Slice.End--------------------------------------------------------\n")
@@ -60,97 +374,295 @@ class TaskOrchestrator:
         source: str = "unknown"
         error_message: Optional[str] = None
         details: Dict[str, Any] = {"request_id": request_id, "stages": []}
+        cloud_upgrade: Optional[asyncio.Task] = None
+
+        cache_key = self._response_cache_key(user_prompt, generation_params, bypass_cache)
+        if cache_key is not None:
+            cached, cache_tier = await self.response_cache.get(cache_key)
+            if cached is not None:
+                self.scheduler.task_finished(CLASS_INTERACTIVE)
+                details["cache"] = {"hit": True, "tier": cache_tier}
+                details["total_duration_ms"] = int((time.monotonic() - task_start_time) * 1000)
+                self._record_stage_histograms(details, f"cache_{cache_tier}") # Kept apart from the series of freshly computed answers
+                logger.info(f"TaskOrchestrator (Request ID: {request_id}): Served from {cache_tier} response cache (source: {cached['source']}).")
+                return {"request_id": request_id, "result_text": cached["result_text"], "source": cached["source"], "error": None, "details": details}
+
+        near_scope = self._near_duplicate_scope(user_prompt, generation_params, bypass_cache)
+        if near_scope is not None:
+            similar, similarity = self.near_duplicate_cache.lookup(user_prompt, near_scope)
+            if similar is not None:
+                self.scheduler.task_finished(CLASS_INTERACTIVE)
+                details["cache"] = {"hit": True, "tier": "near_duplicate", "similarity": round(similarity, 4)}
+                details["total_duration_ms"] = int((time.monotonic() - task_start_time) * 1000)
+                self._record_stage_histograms(details, "cache_near_duplicate")
+                logger.info(f"TaskOrchestrator (Request ID: {request_id}): Served near-duplicate cloud answer (estimated similarity {similarity:.2f}).")
+                return {"request_id": request_id, "result_text": similar["result_text"], "source": similar["source"], "error": None, "details": details}
 
         try:
-            # 1. Local LLM Generation
-            logger.debug(f"TaskOrchestrator (Request ID: {request_id}): Requesting local LLM generation.")
-            local_llm_start_time = time.monotonic()
-            try:
-                # TODO: Add vLLM params if needed from user request context
-                vllm_response = await self.vllm_service.generate_response(prompt=user_prompt)
-                local_generated_text = vllm_response.get("choices", [{}])[0].get("message", {}).get("content")
-                if not local_generated_text:
-                    raise TaskOrchestratorError("Local LLM returned empty content.")
-                details["stages"].append({
-                    "name": "local_llm_generation", 
-                    "status": "success", 
-                    "duration_ms": int((time.monotonic() - local_llm_start_time) * 1000),
-                    "output_preview": local_generated_text[:100] + "..."
-                })
-                logger.info(f"TaskOrchestrator (Request ID: {request_id}): Local LLM generation successful.")
-            except VLLMServiceError as e:
-                logger.error(f"TaskOrchestrator (Request ID: {request_id}): Local LLM generation failed: {e}")
-                details["stages"].append({"name": "local_llm_generation", "status": "error", "error": str(e), "duration_ms": int((time.monotonic() - local_llm_start_time) * 1000)})
-                raise TaskOrchestratorError(f"Local LLM generation failed: {e}") from e
-
-            # 2. Confidence Assessment
-            logger.debug(f"TaskOrchestrator (Request ID: {request_id}): Assessing confidence of local result.")
-            confidence_start_time = time.monotonic()
-            confidence_assessment_result: ConfidenceResult = await self.confidence_service.assess(
-                generated_text=local_generated_text,
-                original_prompt=user_prompt
+            final_result, source, cloud_upgrade = await self.task_registry.run(
+                request_id, "full_flow",
+                lambda: self._run_full_flow_stages(user_prompt, request_id, details, generation_params, task_start_time)
             )
-            details["stages"].append({
-                "name": "confidence_assessment", 
-                "status": "success", 
-                "duration_ms": int((time.monotonic() - confidence_start_time) * 1000),
-                "assessment": confidence_assessment_result.to_dict()
-            })
-            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Confidence assessment complete. Needs refinement: {confidence_assessment_result.needs_refinement}")
+        except TaskCancelledError as e_cancelled:
+            error_message = str(e_cancelled)
+            source = "cancelled"
+            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Full flow cancelled.")
+        except TaskOrchestratorError as e_task:
+            error_message = str(e_task)
+            source = "error_orchestration"
+            logger.error(f"TaskOrchestrator (Request ID: {request_id}): Orchestration error: {e_task}")
+        except Exception as e_unexpected:
+            error_message = f"Unexpected error: {str(e_unexpected)}"
+            source = "error_unexpected"
+            logger.error(f"TaskOrchestrator (Request ID: {request_id}): Unexpected error in full flow: {e_unexpected}", exc_info=True)
+        finally:
+            self.scheduler.task_finished(CLASS_INTERACTIVE)
+            total_duration_ms = int((time.monotonic() - task_start_time) * 1000)
+            details["total_duration_ms"] = total_duration_ms
+            self._record_stage_histograms(details, source)
+            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Full flow finished. Duration: {total_duration_ms}ms, Source: {source}")
 
-            # 3. Decision: Use local result or request cloud refinement
-            if not confidence_assessment_result.needs_refinement:
-                final_result = local_generated_text
+        # Fallbacks are not cached, so the next identical prompt gets another chance at the cloud.
+        if cache_key is not None and final_result and source in ("local_high_confidence", "cloud_refined_success"):
+            await self.response_cache.put(cache_key, {"result_text": final_result, "source": source})
+        # Only cloud answers are shared with similar prompts; a local draft was judged good for this exact prompt only.
+        if near_scope is not None and final_result and source == "cloud_refined_success":
+            self.near_duplicate_cache.add(user_prompt, {"result_text": final_result, "source": source}, near_scope)
+        if cloud_upgrade is not None:
+            upgrade_task = asyncio.create_task(self._deliver_cloud_upgrade(cloud_upgrade, user_prompt, request_id, cache_key, near_scope, on_upgrade))
+            self._cloud_upgrades.add(upgrade_task)
+            upgrade_task.add_done_callback(self._cloud_upgrades.discard)
+
+        return {
+            "request_id": request_id,
+            "result_text": final_result,
+            "source": source,
+            "error": error_message,
+            "details": details
+        }
+
+    async def _finish_local_draft(self, local_stream: AsyncIterator[str], prefix: str) -> str:
+        """Drains the rest of an escalated local stream so the complete draft is available as a fallback."""
+        text = prefix
+        async for delta in local_stream:
+            text += delta
+        return text
+
+    async def _scheduled_local_stream(self, user_prompt: str, generation_params: Optional[Dict[str, Any]], details: Dict[str, Any]) -> AsyncIterator[str]:
+        """VLLMService.stream_response holding an interactive backend slot until the stream ends or is closed."""
+        async with self.scheduler.slot(CLASS_INTERACTIVE) as queue_wait_seconds:
+            details["queue_wait_ms"] = int(queue_wait_seconds * 1000)
+            async for delta in self.vllm_service.stream_response(user_prompt, generation_params):
+                yield delta
+
+    async def _stream_full_flow_stages(self, user_prompt: str, request_id: str, details: Dict[str, Any],
+                                       generation_params: Optional[Dict[str, Any]], task_start_time: float,
+                                       emit: Callable[[Dict[str, Any]], Awaitable[None]]) -> Tuple[Optional[str], str]:
+        """The stages of stream_user_request_full_flow; passes each event to `emit` and returns (final_result, source)."""
+        final_result: Optional[str] = None
+        source: str = "unknown"
+        time_to_first_token: Dict[str, int] = details["time_to_first_token_ms"]
+        local_stream: Optional[AsyncIterator[str]] = None
+        local_rest_task: Optional[asyncio.Task] = None
+        cloud_stream = None
+
+        def token_event(text: str, token_source: str) -> Dict[str, Any]:
+            if token_source not in time_to_first_token:
+                elapsed = time.monotonic() - task_start_time
+                time_to_first_token[token_source] = int(elapsed * 1000)
+                metrics.observe(STAGE_TTFT_LOCAL if token_source == "local" else STAGE_TTFT_CLOUD, elapsed)
+            return {"type": "token", "text": text, "source": token_source}
+
+        try:
+            keyword_triggers = await self.confidence_service.check_prompt_triggers(user_prompt)
+            local_text = "" # Everything the local model produced so far
+            shown_local_chars = 0 # How much of it the caller has seen
+            assessment: Optional[ConfidenceAssessmentData] = None
+            escalation_reason: Optional[str] = None
+            local_stage: Dict[str, Any] = {"name": "local_llm_generation", "streamed": True}
+            local_start_time = time.monotonic()
+            local_stream = self._scheduled_local_stream(user_prompt, generation_params, details)
+
+            if keyword_triggers:
+                escalation_reason = f"Keyword trigger(s) in prompt: {keyword_triggers}."
+                assessment = ConfidenceAssessmentData(keyword_triggers_found=keyword_triggers, requires_cloud_refinement=True,
+                                                      details={"reason_for_refinement": escalation_reason})
+            else:
+                confidence_settings = settings.confidence
+                partial_threshold = confidence_settings.rouge_l_threshold * confidence_settings.stream_partial_threshold_factor
+                next_check = confidence_settings.stream_assess_interval_chars
+                try:
+                    async for delta in local_stream:
+                        local_text += delta
+                        shown_local_chars = len(local_text)
+                        await emit(token_event(delta, "local"))
+                        if len(local_text) >= next_check:
+                            next_check = len(local_text) + confidence_settings.stream_assess_interval_chars
+                            partial_result = await self.confidence_service.assess(generated_text=local_text, original_prompt=user_prompt)
+                            if partial_result.score < partial_threshold:
+                                escalation_reason = f"ROUGE-L F1 of the first {len(local_text)} characters ({partial_result.score:.4f}) below {partial_threshold:.4f}."
+                                assessment = self._to_assessment_data(partial_result)
+                                break
+                except VLLMServiceError as e:
+                    local_stage.update({"status": "error", "error": str(e), "duration_ms": int((time.monotonic() - local_start_time) * 1000)})
+                    details["stages"].append(local_stage)
+                    raise TaskOrchestratorError(f"Local LLM generation failed: {e}") from e
+
+                if escalation_reason is None:
+                    if not local_text:
+                        raise TaskOrchestratorError("Local LLM returned empty content.")
+                    metrics.observe(STAGE_LOCAL_GENERATION, time.monotonic() - local_start_time)
+                    local_stage.update({"status": "success", "duration_ms": int((time.monotonic() - local_start_time) * 1000)})
+                    details["stages"].append(local_stage)
+                    confidence_assessment_result = await self._assess_local_draft(local_text, user_prompt, request_id, details)
+                    if confidence_assessment_result.needs_refinement:
+                        escalation_reason = confidence_assessment_result.details.get("reason_for_refinement", "Low confidence.")
+                        assessment = self._to_assessment_data(confidence_assessment_result)
+
+            if escalation_reason is None:
+                final_result = local_text
                 source = "local_high_confidence"
-                logger.info(f"TaskOrchestrator (Request ID: {request_id}): High confidence. Using local result.")
-                # Notify remote server about confident local result (fire and forget)
                 notification_payload = LocalConfidentResultNotificationPayload(
                     original_user_prompt=user_prompt,
                     local_model_final_result=final_result,
-                    confidence_assessment=ConfidenceAssessmentData(**confidence_assessment_result.to_dict()), # Map fields
+                    confidence_assessment=self._to_assessment_data(confidence_assessment_result),
                     local_processing_time_ms=int((time.monotonic() - task_start_time) * 1000)
                 )
                 asyncio.create_task(self.tcp_client.send_confident_result_notification(notification_payload))
             else:
-                logger.info(f"TaskOrchestrator (Request ID: {request_id}): Low confidence. Requesting cloud refinement.")
+                partial_draft = not local_stage.get("status")
+                if partial_draft:
+                    # Escalated before the draft finished: keep generating it as the fallback
+                    local_stage.update({"status": "escalated", "escalated_after_chars": len(local_text)})
+                    details["stages"].append(local_stage)
+                    local_rest_task = asyncio.ensure_future(self._finish_local_draft(local_stream, local_text))
+                details["escalation"] = {"reason": escalation_reason, "partial_draft": partial_draft,
+                                         "after_ms": int((time.monotonic() - task_start_time) * 1000)}
+                logger.info(f"TaskOrchestrator (Request ID: {request_id}): Escalating streamed flow to cloud after {len(local_text)} local chars. Reason: {escalation_reason}")
+
                 cloud_refinement_start_time = time.monotonic()
+                timeout_seconds = self.cloud_timeout.current()
                 refinement_request_payload = LocalRequestCloudRefinementPayload(
                     original_user_prompt=user_prompt,
-                    local_model_draft_result=local_generated_text,
-                    confidence_assessment=ConfidenceAssessmentData(**confidence_assessment_result.to_dict()),
-                    # refinement_hints: Optional - can be added if we have specific hints
+                    local_model_draft_result=local_text,
+                    confidence_assessment=assessment,
+                    refinement_hints={"partial_draft": True} if partial_draft else None,
                 )
+                cloud_stage_details: Dict[str, Any] = {"name": "cloud_refinement", "streamed": True, "timeout_ms": int(timeout_seconds * 1000)}
+                tokens_yielded = 0
                 try:
-                    cloud_response: Optional[CloudRefinementResponseToLocalPayload] = await self.tcp_client.request_cloud_refinement(refinement_request_payload)
-                    cloud_stage_details = {
-                        "name": "cloud_refinement",
-                        "duration_ms": int((time.monotonic() - cloud_refinement_start_time) * 1000)
-                    }
+                    cloud_stream = await self.tcp_client.stream_cloud_refinement(refinement_request_payload, timeout=timeout_seconds)
+                    async for chunk in cloud_stream:
+                        if tokens_yielded == 0:
+                            cloud_stage_details["time_to_first_token_ms"] = int((time.monotonic() - cloud_refinement_start_time) * 1000)
+                            if shown_local_chars:
+                                await emit({"type": "switch", "from": "local", "to": "cloud", "reason": escalation_reason})
+                        tokens_yielded += 1
+                        await emit(token_event(chunk.delta, "cloud"))
+                    cloud_response = cloud_stream.final
+                    cloud_elapsed = time.monotonic() - cloud_refinement_start_time
+                    metrics.observe(STAGE_CLOUD_REFINEMENT, cloud_elapsed)
+                    cloud_stage_details["chunks"] = tokens_yielded
+                    cloud_stage_details["duration_ms"] = int(cloud_elapsed * 1000)
                     if cloud_response and cloud_response.status == "success" and cloud_response.refined_result:
+                        self.cloud_timeout.observe(cloud_elapsed) # Complete stream durations only, as in _refine_in_cloud
                         final_result = cloud_response.refined_result
                         source = "cloud_refined_success"
                         cloud_stage_details["status"] = "success"
                         cloud_stage_details["cloud_tokens_consumed"] = cloud_response.cloud_tokens_consumed
-                        logger.info(f"TaskOrchestrator (Request ID: {request_id}): Cloud refinement successful.")
+                        if tokens_yielded == 0: # Cloud answered without streaming
+                            cloud_stage_details["time_to_first_token_ms"] = cloud_stage_details["duration_ms"]
+                            if shown_local_chars:
+                                await emit({"type": "switch", "from": "local", "to": "cloud", "reason": escalation_reason})
+                            await emit(token_event(final_result, "cloud"))
                     else:
-                        # Cloud refinement failed, timed out, or returned error/no result
-                        final_result = local_generated_text # Fallback to local result
                         source = "local_fallback_cloud_failure"
                         cloud_stage_details["status"] = "failure_or_fallback"
                         cloud_stage_details["cloud_response"] = cloud_response.model_dump() if cloud_response else None
-                        logger.warning(f"TaskOrchestrator (Request ID: {request_id}): Cloud refinement failed or no result. Falling back to local. Response: {cloud_response}")
-                    details["stages"].append(cloud_stage_details)
+                        logger.warning(f"TaskOrchestrator (Request ID: {request_id}): Streamed cloud refinement failed or no result. Falling back to local.")
                 except TCPClientTimeoutError as e_timeout:
-                    final_result = local_generated_text
+                    self.cloud_timeout.observe_timeout(timeout_seconds)
                     source = "local_fallback_cloud_timeout"
-                    details["stages"].append({"name": "cloud_refinement", "status": "timeout", "error": str(e_timeout), "duration_ms": int((time.monotonic() - cloud_refinement_start_time) * 1000)})
-                    logger.warning(f"TaskOrchestrator (Request ID: {request_id}): Cloud refinement timed out. Falling back to local. Error: {e_timeout}")
+                    cloud_stage_details.update({"status": "timeout", "error": str(e_timeout), "duration_ms": int((time.monotonic() - cloud_refinement_start_time) * 1000)})
+                    logger.warning(f"TaskOrchestrator (Request ID: {request_id}): Streamed cloud refinement timed out after {tokens_yielded} token(s). Falling back to local.")
                 except TCPClientError as e_tcp:
-                    final_result = local_generated_text
                     source = "local_fallback_cloud_tcp_error"
-                    details["stages"].append({"name": "cloud_refinement", "status": "tcp_error", "error": str(e_tcp), "duration_ms": int((time.monotonic() - cloud_refinement_start_time) * 1000)})
-                    logger.error(f"TaskOrchestrator (Request ID: {request_id}): TCP error during cloud refinement. Falling back to local. Error: {e_tcp}")
-        
+                    cloud_stage_details.update({"status": "tcp_error", "error": str(e_tcp), "duration_ms": int((time.monotonic() - cloud_refinement_start_time) * 1000)})
+                    logger.error(f"TaskOrchestrator (Request ID: {request_id}): TCP error during streamed cloud refinement. Falling back to local. Error: {e_tcp}")
+                details["stages"].append(cloud_stage_details)
+
+                if source.startswith("local_fallback"):
+                    if local_rest_task is not None:
+                        try:
+                            local_text = await local_rest_task
+                        except VLLMServiceError as e:
+                            raise TaskOrchestratorError(f"Cloud refinement failed and local generation failed: {e}") from e
+                        local_stage["completed_duration_ms"] = int((time.monotonic() - local_start_time) * 1000)
+                    if not local_text:
+                        raise TaskOrchestratorError("Cloud refinement failed and local LLM returned empty content.")
+                    final_result = local_text
+                    if tokens_yielded:
+                        await emit({"type": "switch", "from": "cloud", "to": "local", "reason": source})
+                        await emit(token_event(local_text, "local"))
+                    elif len(local_text) > shown_local_chars:
+                        await emit(token_event(local_text[shown_local_chars:], "local")) # Continue where the caller left off
+        finally:
+            if cloud_stream is not None:
+                await cloud_stream.aclose() # No-op once the stream has finished; stops listening if the flow was cancelled
+            if local_rest_task is not None and not local_rest_task.done():
+                local_rest_task.cancel() # Cloud answered (or the flow was cancelled); stop local generation
+                await asyncio.gather(local_rest_task, return_exceptions=True)
+            elif local_rest_task is not None and not local_rest_task.cancelled():
+                local_rest_task.exception() # Mark a failed fallback draft as retrieved
+            if local_stream is not None:
+                await local_stream.aclose() # Closes the vLLM response if the stream was abandoned part-way
+        return final_result, source
+
+    async def stream_user_request_full_flow(self, user_prompt: str, request_id: Optional[str] = None,
+                                            generation_params: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming mode of process_user_request_full_flow. Local vLLM tokens are yielded as
+        {"type": "token", "text", "source": "local"} while the accumulating text is re-assessed every
+        confidence.stream_assess_interval_chars; a prompt keyword trigger or a clearly failing prefix
+        escalates to the cloud without waiting for the local draft to finish (it keeps generating in the
+        background as the fallback). Once tokens from the other source start, a
+        {"type": "switch", "from", "to", "reason"} event tells the caller to discard the text shown so far.
+        Ends with a single {"type": "final", ...} event with the same fields the non-streaming flow returns;
+        details["time_to_first_token_ms"] holds the per-source time to first token.
+        A cancel_task command naming the request_id stops the flow; the final event then has source "cancelled".
+        """
+        self.scheduler.task_started(CLASS_INTERACTIVE)
+        task_start_time = time.monotonic()
+        request_id = request_id or str(uuid.uuid4())
+        logger.info(f"TaskOrchestrator (Request ID: {request_id}): Starting streamed full flow for prompt: {user_prompt[:100]}...")
+
+        final_result: Optional[str] = None
+        source: str = "unknown"
+        error_message: Optional[str] = None
+        details: Dict[str, Any] = {"request_id": request_id, "stages": [], "time_to_first_token_ms": {}}
+
+        # The stages run as a registry task so cancel_task can reach them; their events come back through the queue,
+        # which holds one event so generation still waits for a slow consumer.
+        events: asyncio.Queue = asyncio.Queue(maxsize=1)
+        flow = asyncio.ensure_future(self.task_registry.run(
+            request_id, "full_flow",
+            lambda: self._stream_full_flow_stages(user_prompt, request_id, details, generation_params, task_start_time, events.put)
+        ))
+        next_event: Optional[asyncio.Task] = None
+        try:
+            while True:
+                next_event = asyncio.ensure_future(events.get())
+                await asyncio.wait((next_event, flow), return_when=asyncio.FIRST_COMPLETED)
+                if not next_event.done():
+                    break
+                yield next_event.result()
+            while not events.empty():
+                yield events.get_nowait()
+            final_result, source = flow.result()
+        except TaskCancelledError as e_cancelled:
+            error_message = str(e_cancelled)
+            source = "cancelled"
+            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Streamed flow cancelled.")
         except TaskOrchestratorError as e_task:
             error_message = str(e_task)
             source = "error_orchestration"
@@ -158,14 +670,20 @@ class TaskOrchestrator:
         except Exception as e_unexpected:
             error_message = f"Unexpected error: {str(e_unexpected)}"
             source = "error_unexpected"
-            logger.error(f"TaskOrchestrator (Request ID: {request_id}): Unexpected error in full flow: {e_unexpected}", exc_info=True)
+            logger.error(f"TaskOrchestrator (Request ID: {request_id}): Unexpected error in streamed flow: {e_unexpected}", exc_info=True)
         finally:
-            await self._decrement_active_tasks()
-            total_duration_ms = int((time.monotonic() - task_start_time) * 1000)
-            details["total_duration_ms"] = total_duration_ms
-            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Full flow finished. Duration: {total_duration_ms}ms, Source: {source}")
+            if next_event is not None:
+                next_event.cancel()
+            if not flow.done():
+                flow.cancel() # The consumer left early; the stages close the local and cloud streams on the way out
+                await asyncio.gather(flow, return_exceptions=True)
+            self.scheduler.task_finished(CLASS_INTERACTIVE)
+            details["total_duration_ms"] = int((time.monotonic() - task_start_time) * 1000)
+            self._record_stage_histograms(details, source)
+            logger.info(f"TaskOrchestrator (Request ID: {request_id}): Streamed flow finished. Duration: {details['total_duration_ms']}ms, Source: {source}")
 
-        return {
+        yield {
+            "type": "final",
             "request_id": request_id,
             "result_text": final_result,
             "source": source,
@@ -173,93 +691,162 @@ class TaskOrchestrator:
             "details": details
         }
 
+    async def _execute_remote_command(self, cmd_payload: RemoteCommandToLocalPayload, original_task_id: str) -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+        """Runs one remote command and returns (status, data, error_message) for the response payload."""
+        cmd_details_dict = cmd_payload.command_details if cmd_payload.command_details else {}
+        status = "error"
+        data: Optional[Dict[str, Any]] = None
+        error_msg: Optional[str] = None
+
+        if cmd_payload.command_action == "execute_owl_task":
+            details = validate_model(ExecuteOwlTaskDetails, cmd_details_dict)
+            logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Executing Owl Agent task: {details.agent_task_description[:50]}...")
+            try:
+                # The agent drives the local model for its whole run, so it holds a command-class backend slot
+                async with self.scheduler.slot(CLASS_COMMAND):
+                    owl_result = await self.owl_agent_service.execute_task(
+                        task_description=details.agent_task_description,
+                        agent_config_override=details.owl_agent_config
+                    )
+                if owl_result.get("status") == "success":
+                    status = "success"
+                    data = owl_result
+                else:
+                    error_msg = owl_result.get("error_message", "Owl Agent execution failed.")
+                    data = owl_result # Include partial data or error details from agent
+            except OwlAgentServiceError as e_owl:
+                error_msg = f"Owl Agent service error: {e_owl}"
+            except Exception as e_owl_generic:
+                error_msg = f"Unexpected error during Owl Agent task: {e_owl_generic}"
+                logger.error(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Unexpected Owl Agent error", exc_info=True)
+        
+        elif cmd_payload.command_action == "query_local_model_direct":
+            details = validate_model(QueryLocalModelDirectDetails, cmd_details_dict)
+            logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Executing direct local model query: {details.prompt[:50]}...")
+            try:
+                async with self.scheduler.slot(CLASS_COMMAND):
+                    vllm_response = await self.vllm_service.generate_response(prompt=details.prompt, params=details.vllm_params)
+                generated_text = vllm_response.get("choices", [{}])[0].get("message", {}).get("content")
+                if generated_text:
+                    status = "success"
+                    data = {"generated_text": generated_text, "vllm_full_response": vllm_response}
+                else:
+                    error_msg = "Local model returned empty content."
+                    data = {"vllm_full_response": vllm_response}
+            except VLLMServiceError as e_vllm:
+                error_msg = f"Local model query failed: {e_vllm}"
+            except Exception as e_vllm_generic:
+                error_msg = f"Unexpected error during local model query: {e_vllm_generic}"
+                logger.error(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Unexpected direct query error", exc_info=True)
+
+        elif cmd_payload.command_action == "cancel_task":
+            details = validate_model(CancelTaskDetails, cmd_details_dict)
+            logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Cancelling task {details.task_id}.")
+            cancellation = self.task_registry.cancel(details.task_id, reason=details.reason or f"cancel_task {original_task_id}")
+            if cancellation is not None:
+                status = "success"
+                data = cancellation
+            else:
+                error_msg = f"No running task with task_id '{details.task_id}'."
+                data = {"task_id": details.task_id}
+
+        elif cmd_payload.command_action == "get_local_status":
+            logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Getting local status.")
+            vllm_healthy = await self.vllm_service.check_health() # Cached by the background prober
+            vllm_health_state = self.vllm_service.get_health_state()
+            owl_status = await self.owl_agent_service.check_agent_health()
+            status = "success"
+            data = {
+                "local_server_id": settings.local_server_id,
+                "vllm_service_status": "healthy" if vllm_healthy else "unhealthy",
+                "vllm_health": vllm_health_state.to_dict() if vllm_health_state else None,
+                "owl_agent_status": owl_status,
+                "active_orchestrator_tasks": self.scheduler.active_count,
+                "queued_commands": self.admission.queue_depth,
+                "rejected_commands": self.admission.rejected_count,
+                "admission": self.admission.snapshot(),
+                "scheduler": self.scheduler.snapshot(),
+                "task_registry": self.task_registry.snapshot(),
+                "stage_latency_histograms_ms": metrics.stage_histograms(),
+                "refinement_batcher": self.refinement_batcher.snapshot(),
+                "cloud_timeout": self.cloud_timeout.snapshot(),
+                "pending_cloud_upgrades": len(self._cloud_upgrades),
+                "event_loop": loop_watchdog.snapshot(),
+                "command_dedupe": self.command_dedupe.snapshot(),
+                "response_cache": self.response_cache.snapshot(),
+                "near_duplicate_cache": self.near_duplicate_cache.snapshot(),
+                "tcp_client_connected": self.tcp_client.is_connected,
+                "config_summary": {
+                    "vllm_model": settings.vllm.model_name_or_path,
+                    "confidence_threshold": settings.confidence.rouge_l_threshold,
+                    "remote_server_host": settings.remote_server.host,
+                    "remote_server_port": settings.remote_server.command_port
+                }
+            }
+        else:
+            error_msg = f"Unknown command_action: {cmd_payload.command_action}"
+        return status, data, error_msg
+
+    async def _admit_and_execute(self, cmd_payload: RemoteCommandToLocalPayload, original_task_id: str) -> Tuple[str, Optional[Dict[str, Any]], Optional[str], Optional[float]]:
+        """
+        Runs a remote command under admission control. Returns (status, data, error_msg, retry_after_seconds).
+        Cancellable actions are registered under the command's task_id for their whole lifetime, including
+        the wait for an admission slot.
+        """
+        async def admitted() -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+            async with self.admission.admit(cmd_payload.command_action):
+                return await self._execute_remote_command(cmd_payload, original_task_id)
+
+        try:
+            if cmd_payload.command_action in CANCELLABLE_COMMAND_ACTIONS:
+                status, data, error_msg = await self.task_registry.run(original_task_id, cmd_payload.command_action, admitted)
+            else:
+                status, data, error_msg = await admitted()
+            return status, data, error_msg, None
+        except AdmissionRejectedError as e_busy:
+            # Shed load right away instead of queueing unboundedly behind a busy vLLM / Owl agent.
+            data = {"queue_depth": e_busy.queue_depth, "admission": self.admission.snapshot()}
+            return "busy", data, str(e_busy), e_busy.retry_after_seconds
+        except TaskCancelledError as e_cancelled:
+            logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): '{cmd_payload.command_action}' command cancelled.")
+            return "cancelled", {"task_id": original_task_id}, str(e_cancelled), None
+
     async def process_incoming_tcp_message(self, message_dict: Dict[str, Any], writer: asyncio.StreamWriter) -> Optional[Dict[str, Any]]:
         """
         Handles messages received from the TCP server (i.e., commands from the remote cloud server).
         Returns a payload for a response message, or None if no direct response is needed or sent by handler.
         """
-        await self._increment_active_tasks()
+        self.scheduler.task_started(CLASS_COMMAND)
         response_payload_content: Optional[Dict[str, Any]] = None
         original_task_id = "unknown_tcp_task"
         original_command_action = "unknown_action"
         try:
-            base_msg = BaseMessage(**message_dict)
+            base_msg = parse_incoming_message(message_dict, trusted=settings.remote_server.trusted_peer)
             original_task_id = base_msg.task_id
             logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Received TCP message type \n" +
                         f"RPT.Slice.Start------------------------------------------------------\n{base_msg.message_type}\nRPT.Slice.End--------------------------------------------------------\n")
 
             if base_msg.message_type == "remote_command_to_local":
-                cmd_payload = RemoteCommandToLocalPayload(**base_msg.payload)
+                cmd_payload = base_msg.parsed_payload(RemoteCommandToLocalPayload)
                 original_command_action = cmd_payload.command_action
-                cmd_details_dict = cmd_payload.command_details if cmd_payload.command_details else {}
-                status = "error"
-                data: Optional[Dict[str, Any]] = None
-                error_msg: Optional[str] = None
-
-                if cmd_payload.command_action == "execute_owl_task":
-                    details = ExecuteOwlTaskDetails(**cmd_details_dict)
-                    logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Executing Owl Agent task: {details.agent_task_description[:50]}...")
-                    try:
-                        owl_result = await self.owl_agent_service.execute_task(
-                            task_description=details.agent_task_description,
-                            agent_config_override=details.owl_agent_config
-                        )
-                        if owl_result.get("status") == "success":
-                            status = "success"
-                            data = owl_result
-                        else:
-                            error_msg = owl_result.get("error_message", "Owl Agent execution failed.")
-                            data = owl_result # Include partial data or error details from agent
-                    except OwlAgentServiceError as e_owl:
-                        error_msg = f"Owl Agent service error: {e_owl}"
-                    except Exception as e_owl_generic:
-                        error_msg = f"Unexpected error during Owl Agent task: {e_owl_generic}"
-                        logger.error(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Unexpected Owl Agent error", exc_info=True)
-                
-                elif cmd_payload.command_action == "query_local_model_direct":
-                    details = QueryLocalModelDirectDetails(**cmd_details_dict)
-                    logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Executing direct local model query: {details.prompt[:50]}...")
-                    try:
-                        vllm_response = await self.vllm_service.generate_response(prompt=details.prompt, params=details.vllm_params)
-                        generated_text = vllm_response.get("choices", [{}])[0].get("message", {}).get("content")
-                        if generated_text:
-                            status = "success"
-                            data = {"generated_text": generated_text, "vllm_full_response": vllm_response}
-                        else:
-                            error_msg = "Local model returned empty content."
-                            data = {"vllm_full_response": vllm_response}
-                    except VLLMServiceError as e_vllm:
-                        error_msg = f"Local model query failed: {e_vllm}"
-                    except Exception as e_vllm_generic:
-                        error_msg = f"Unexpected error during local model query: {e_vllm_generic}"
-                        logger.error(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Unexpected direct query error", exc_info=True)
-
-                elif cmd_payload.command_action == "get_local_status":
-                    logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Getting local status.")
-                    vllm_healthy = await self.vllm_service.check_health()
-                    owl_status = await self.owl_agent_service.check_agent_health()
-                    status = "success"
-                    data = {
-                        "local_server_id": settings.local_server_id,
-                        "vllm_service_status": "healthy" if vllm_healthy else "unhealthy",
-                        "owl_agent_status": owl_status,
-                        "active_orchestrator_tasks": self._active_tasks_count,
-                        "tcp_client_connected": self.tcp_client.is_connected,
-                        "config_summary": {
-                            "vllm_model": settings.vllm.model_name_or_path,
-                            "confidence_threshold": settings.confidence.rouge_l_threshold,
-                            "remote_server_host": settings.remote_server.host,
-                            "remote_server_port": settings.remote_server.command_port
-                        }
-                    }
+                if original_command_action in settings.command_dedupe.exempt_actions:
+                    status, data, error_msg, retry_after = await self._admit_and_execute(cmd_payload, original_task_id)
                 else:
-                    error_msg = f"Unknown command_action: {cmd_payload.command_action}"
+                    # Only successes are kept for replay; a retried busy/error command runs again.
+                    (status, data, error_msg, retry_after), dedupe = await self.command_dedupe.run(
+                        original_task_id,
+                        lambda: self._admit_and_execute(cmd_payload, original_task_id),
+                        cacheable=lambda result: result[0] == "success"
+                    )
+                    if dedupe:
+                        logger.info(f"TaskOrchestrator (TCP Task ID: {original_task_id}): Duplicate '{original_command_action}' command answered from the {dedupe} execution.")
                 
                 response_payload_content = LocalResponseToRemotePayload(
                     original_command_action=original_command_action,
                     status=status,
                     data=data,
-                    error_message=error_msg
+                    error_message=error_msg,
+                    retry_after_seconds=retry_after
                 ).model_dump()
             
             # Handle other message types from remote server if any (e.g., acknowledgements, config updates)
@@ -277,66 +864,34 @@ class TaskOrchestrator:
                 error_message=f"Internal error processing TCP message: {str(e)}"
             ).model_dump()
         finally:
-            await self._decrement_active_tasks()
+            self.scheduler.task_finished(CLASS_COMMAND)
         
         return response_payload_content
 
-    async def process_batch_prompts_concurrently(self, prompts: List[str], common_params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    async def stream_batch_prompts(self, prompts: List[str], common_params: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
         """
-        Processes a batch of prompts concurrently using the local vLLM service.
-        This method bypasses the confidence check and cloud refinement for simplicity, focusing on batch vLLM calls.
-        Returns a list of results, each corresponding to a prompt.
+        Runs a batch of prompts directly through the local vLLM service (no confidence check or cloud
+        refinement) and yields each result as soon as it is ready, in completion order; every result
+        carries the prompt's "index". Concurrency, deduplication and packing follow settings.batch.
         """
         if not prompts:
-            return []
-        
+            return
         logger.info(f"TaskOrchestrator: Starting batch processing for {len(prompts)} prompts.")
-        await self._increment_active_tasks() # Count batch as one orchestrator task for simplicity
-        
-        tasks = []
-        for i, prompt_text in enumerate(prompts):
-            # Create a unique request_id for each sub-task in the batch
-            batch_item_request_id = str(uuid.uuid4())
-            tasks.append(self._process_single_prompt_for_batch(prompt_text, common_params, batch_item_request_id, i))
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        await self._decrement_active_tasks()
-        logger.info(f"TaskOrchestrator: Batch processing for {len(prompts)} prompts completed.")
-        return results
-
-    async def _process_single_prompt_for_batch(self, prompt: str, params: Optional[Dict[str, Any]], request_id: str, index: int) -> Dict[str, Any]:
-        """Helper to process a single prompt as part of a batch, directly via vLLM."""
-        logger.debug(f"TaskOrchestrator (Batch Item Request ID: {request_id}, Index: {index}): Processing prompt: {prompt[:50]}...")
+        self.scheduler.task_started(CLASS_BATCH) # Count batch as one orchestrator task; its items queue for backend slots individually
         try:
-            vllm_response = await self.vllm_service.generate_response(prompt=prompt, params=params)
-            generated_text = vllm_response.get("choices", [{}])[0].get("message", {}).get("content")
-            if not generated_text:
-                raise VLLMServiceError("Local LLM returned empty content for batch item.")
-            return {
-                "request_id": request_id,
-                "index": index,
-                "prompt": prompt,
-                "status": "success",
-                "generated_text": generated_text,
-                "vllm_full_response": vllm_response
-            }
-        except VLLMServiceError as e:
-            logger.error(f"TaskOrchestrator (Batch Item Request ID: {request_id}, Index: {index}): VLLM error: {e}")
-            return {
-                "request_id": request_id,
-                "index": index,
-                "prompt": prompt,
-                "status": "error",
-                "error_message": str(e)
-            }
-        except Exception as e_unexp:
-            logger.error(f"TaskOrchestrator (Batch Item Request ID: {request_id}, Index: {index}): Unexpected error: {e_unexp}", exc_info=True)
-            return {
-                "request_id": request_id,
-                "index": index,
-                "prompt": prompt,
-                "status": "error",
-                "error_message": f"Unexpected error: {str(e_unexp)}"
-            }
+            async for result in BatchEngine(self.vllm_service, self.scheduler).run(prompts, common_params):
+                yield result
+        finally:
+            self.scheduler.task_finished(CLASS_BATCH)
+        logger.info(f"TaskOrchestrator: Batch processing for {len(prompts)} prompts completed.")
 
+    async def process_batch_prompts_concurrently(self, prompts: List[str], common_params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Processes a batch of prompts concurrently using the local vLLM service.
+        This method bypasses the confidence check and cloud refinement for simplicity, focusing on batch vLLM calls.
+        Returns a list of results, each corresponding to a prompt. Use stream_batch_prompts for large batches.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        async for result in self.stream_batch_prompts(prompts, common_params):
+            results[result["index"]] = result
+        return results
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class TaskCancelledError(Exception):
+    """Raised by TaskRegistry.run when the task was cancelled through TaskRegistry.cancel."""
+    def __init__(self, task_id: str, reason: str):
+        super().__init__(f"Task {task_id} was cancelled ({reason})")
+        self.task_id = task_id
+        self.reason = reason
+
+class _RunningTask:
+    __slots__ = ("task_id", "kind", "task", "started_at", "cancel_reason")
+
+    def __init__(self, task_id: str, kind: str, task: asyncio.Task):
+        self.task_id = task_id
+        self.kind = kind
+        self.task = task
+        self.started_at = time.monotonic()
+        self.cancel_reason: Optional[str] = None
+
+class _KindStats:
+    """Completion and cancellation counters for one kind of task (a command_action or "full_flow")."""
+    def __init__(self):
+        self.completed = 0
+        self.cancelled = 0
+        self.avg_duration_seconds: Optional[float] = None # EWMA over tasks that ran to completion
+        self.seconds_before_cancel = 0.0 # Compute spent on tasks that were then cancelled
+        self.estimated_seconds_saved = 0.0
+
+    def record_completion(self, seconds: float):
+        self.completed += 1
+        if self.avg_duration_seconds is None:
+            self.avg_duration_seconds = seconds
+        else:
+            self.avg_duration_seconds = 0.8 * self.avg_duration_seconds + 0.2 * seconds
+
+class TaskRegistry:
+    """
+    Running commands and full flows keyed by task_id, so the cloud can cancel work nobody is waiting
+    for any more. Each registered task runs in its own asyncio task; cancel() cancels it, which raises
+    CancelledError at whatever it is awaiting: an admission or scheduler queue gives up its place, an
+    in-flight httpx request to vLLM is aborted and its connection closed, and Owl execution stops at its
+    next await. Slots are released by the `finally` blocks on the way out. The compute saved by a
+    cancellation is estimated as the average duration of completed tasks of the same kind minus how
+    long the cancelled one had already run.
+    """
+    def __init__(self):
+        self._running: Dict[str, _RunningTask] = {}
+        self._stats: Dict[str, _KindStats] = {}
+
+    def __len__(self) -> int:
+        return len(self._running)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._running
+
+    def _kind_stats(self, kind: str) -> _KindStats:
+        stats = self._stats.get(kind)
+        if stats is None:
+            stats = self._stats[kind] = _KindStats()
+        return stats
+
+    async def run(self, task_id: str, kind: str, execute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs `execute()` as a cancellable task registered under task_id and returns its result. Raises
+        TaskCancelledError if it was cancelled through cancel(); if the caller itself is cancelled, the
+        task is cancelled with it and CancelledError propagates as usual.
+        """
+        entry = _RunningTask(task_id, kind, asyncio.ensure_future(execute()))
+        if task_id in self._running:
+            logger.warning(f"TaskRegistry: Task ID {task_id} is already running; cancel_task will reach the newer one.")
+        self._running[task_id] = entry
+        try:
+            result = await entry.task
+        except asyncio.CancelledError:
+            if entry.cancel_reason is None:
+                raise # Our caller was cancelled, not the task
+            raise TaskCancelledError(task_id, entry.cancel_reason) from None
+        except Exception:
+            self._kind_stats(kind).record_completion(time.monotonic() - entry.started_at)
+            raise
+        finally:
+            if self._running.get(task_id) is entry:
+                del self._running[task_id]
+        self._kind_stats(kind).record_completion(time.monotonic() - entry.started_at)
+        return result
+
+    def cancel(self, task_id: str, reason: str = "cancel_task") -> Optional[Dict[str, Any]]:
+        """Cancels a running task. Returns what was cancelled and the estimated compute saved, or None if task_id is not running."""
+        entry = self._running.get(task_id)
+        if entry is None or entry.task.done():
+            return None
+        if entry.cancel_reason is not None:
+            return {"task_id": task_id, "kind": entry.kind, "already_cancelling": True}
+        entry.cancel_reason = reason
+        entry.task.cancel()
+        elapsed = time.monotonic() - entry.started_at
+        stats = self._kind_stats(entry.kind)
+        stats.cancelled += 1
+        stats.seconds_before_cancel += elapsed
+        saved = max(0.0, stats.avg_duration_seconds - elapsed) if stats.avg_duration_seconds is not None else None
+        if saved is not None:
+            stats.estimated_seconds_saved += saved
+        logger.info(f"TaskRegistry: Cancelled {entry.kind} task {task_id} after {elapsed:.2f}s ({reason}).")
+        return {
+            "task_id": task_id,
+            "kind": entry.kind,
+            "ran_ms": int(elapsed * 1000),
+            "estimated_saved_ms": int(saved * 1000) if saved is not None else None, # None until a task of this kind has completed
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "running": len(self._running),
+            "running_tasks": [
+                {"task_id": entry.task_id, "kind": entry.kind, "running_ms": int((now - entry.started_at) * 1000)}
+                for entry in self._running.values()
+            ],
+            "cancelled": sum(stats.cancelled for stats in self._stats.values()),
+            "estimated_compute_saved_ms": int(sum(stats.estimated_seconds_saved for stats in self._stats.values()) * 1000),
+            "kinds": {
+                kind: {
+                    "completed": stats.completed,
+                    "cancelled": stats.cancelled,
+                    "avg_duration_ms": int(stats.avg_duration_seconds * 1000) if stats.avg_duration_seconds is not None else None,
+                    "ran_before_cancel_ms": int(stats.seconds_before_cancel * 1000),
+                    "estimated_saved_ms": int(stats.estimated_seconds_saved * 1000),
+                }
+                for kind, stats in self._stats.items()
+            },
+        }
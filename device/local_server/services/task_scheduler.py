@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from ..core.config import settings
+from ..utils.metrics import metrics, LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+# Work classes competing for the shared vLLM backend.
+CLASS_INTERACTIVE = "interactive" # User requests through the full flow (streamed or not)
+CLASS_COMMAND = "command" # Commands issued by the cloud server
+CLASS_BATCH = "batch" # process_batch_prompts_concurrently items
+TASK_CLASSES = (CLASS_INTERACTIVE, CLASS_COMMAND, CLASS_BATCH)
+
+class _ClassQueue:
+    """Slots in use, FIFO waiters and fair-share bookkeeping for one work class."""
+    def __init__(self, name: str, limit: int, weight: float, window_size: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.weight = max(weight, 1e-6)
+        self.running = 0 # Backend slots held
+        self.active = 0 # Tasks in progress, holding a slot or not
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.virtual_time = 0.0 # Start tag of this class's next grant; advances by 1/weight per grant
+        self.admitted = 0
+        self.wait_window = LatencyWindow(window_size)
+
+class TaskScheduler:
+    """
+    Shares the vLLM backend between work classes. At most `backend_concurrency` requests run at once
+    and each class is capped by its own limit. When a slot frees up, the backlogged class with the
+    lowest virtual start time gets it (start-time fair queueing over slot grants), so with the
+    default weights interactive requests get eight slots for every batch item and a queue of batch
+    work cannot hold them back. Within a class, waiters are served FIFO.
+    """
+    def __init__(self,
+                 backend_concurrency: Optional[int] = None,
+                 class_concurrency: Optional[Dict[str, int]] = None,
+                 class_weights: Optional[Dict[str, float]] = None):
+        scheduler_settings = settings.scheduler
+        self.backend_concurrency = max(1, backend_concurrency if backend_concurrency is not None else scheduler_settings.backend_concurrency)
+        class_concurrency = class_concurrency if class_concurrency is not None else scheduler_settings.class_concurrency
+        class_weights = class_weights if class_weights is not None else scheduler_settings.class_weights
+        self._queues: Dict[str, _ClassQueue] = {
+            name: _ClassQueue(name, class_concurrency.get(name, self.backend_concurrency), class_weights.get(name, 1.0),
+                              settings.metrics.latency_window_size)
+            for name in TASK_CLASSES
+        }
+        self._running = 0
+        self._virtual_clock = 0.0 # Start tag of the most recent grant
+
+    def _queue(self, task_class: str) -> _ClassQueue:
+        queue = self._queues.get(task_class)
+        if queue is None:
+            raise ValueError(f"Unknown task class '{task_class}'; expected one of {TASK_CLASSES}")
+        return queue
+
+    def _activate(self, queue: _ClassQueue):
+        # A class that was idle must not bank credit for the time it asked for nothing.
+        queue.virtual_time = max(queue.virtual_time, self._virtual_clock)
+
+    def _grant(self, queue: _ClassQueue):
+        queue.running += 1
+        self._running += 1
+        self._virtual_clock = queue.virtual_time
+        queue.virtual_time += 1.0 / queue.weight
+        queue.admitted += 1
+
+    def _dispatch(self):
+        while self._running < self.backend_concurrency:
+            eligible = [queue for queue in self._queues.values() if queue.waiters and queue.running < queue.limit]
+            if not eligible:
+                return
+            queue = min(eligible, key=lambda q: q.virtual_time)
+            waiter = queue.waiters.popleft()
+            if waiter.done(): # Cancelled while queued
+                continue
+            self._grant(queue)
+            waiter.set_result(None)
+
+    async def acquire(self, task_class: str) -> float:
+        """Waits for a backend slot for `task_class`; returns the seconds spent queued."""
+        queue = self._queue(task_class)
+        start_time = time.monotonic()
+        if not queue.waiters and not queue.running:
+            self._activate(queue)
+        if not queue.waiters and queue.running < queue.limit and self._running < self.backend_concurrency:
+            self._grant(queue)
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            queue.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release(task_class) # The slot was handed over just as we were cancelled; pass it on
+                elif waiter in queue.waiters:
+                    queue.waiters.remove(waiter)
+                raise
+        waited = time.monotonic() - start_time
+        queue.wait_window.observe(waited)
+        metrics.observe(f"queue_wait_{task_class}", waited)
+        return waited
+
+    def release(self, task_class: str):
+        queue = self._queue(task_class)
+        queue.running -= 1
+        self._running -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, task_class: str) -> AsyncIterator[float]:
+        """Holds a backend slot for the block; yields the seconds spent queued for it."""
+        waited = await self.acquire(task_class)
+        try:
+            yield waited
+        finally:
+            self.release(task_class)
+
+    def task_started(self, task_class: str):
+        """Counts a task of this class as in progress (whether or not it currently holds a backend slot)."""
+        self._queue(task_class).active += 1
+
+    def task_finished(self, task_class: str):
+        queue = self._queue(task_class)
+        queue.active = max(0, queue.active - 1)
+
+    @property
+    def active_count(self) -> int:
+        return sum(queue.active for queue in self._queues.values())
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue.waiters) for queue in self._queues.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "backend_concurrency": self.backend_concurrency,
+            "running": self._running,
+            "queued": self.queue_depth,
+            "classes": {
+                name: {
+                    "active": queue.active,
+                    "running": queue.running,
+                    "queued": len(queue.waiters),
+                    "limit": queue.limit,
+                    "weight": queue.weight,
+                    "admitted": queue.admitted,
+                    "queue_wait_ms": queue.wait_window.percentiles(),
+                }
+                for name, queue in self._queues.items()
+            },
+        }
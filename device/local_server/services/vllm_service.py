@@ -1,5 +1,8 @@
+import asyncio
 import httpx
-from typing import Dict, Any, Optional
+import json
+import time
+from typing import AsyncIterator, Dict, Any, List, Optional
 import logging
 
 from ..core.config import settings # Adjusted import path
@@ -17,6 +20,22 @@ class VLLMServiceError(Exception):
     def __str__(self):
         return f"VLLMServiceError: {self.message} (Status Code: {self.status_code})"
 
+class VLLMHealthState:
+    """Result of the most recent vLLM health probe."""
+    def __init__(self, healthy: bool, checked_at: float, endpoint: Optional[str], probe_duration_ms: int):
+        self.healthy = healthy
+        self.checked_at = checked_at # Unix timestamp
+        self.endpoint = endpoint # URL that answered, if any
+        self.probe_duration_ms = probe_duration_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "checked_at": self.checked_at,
+            "endpoint": self.endpoint,
+            "probe_duration_ms": self.probe_duration_ms,
+        }
+
 class VLLMService:
     def __init__(self, http_client: httpx.AsyncClient):
         self.client = http_client
@@ -28,15 +47,20 @@ class VLLMService:
         # vLLM OpenAI API server might not have a standard /health. Listing models is a good check.
         self.models_url = f"{base_url}/models"
         self.health_check_url = f"{base_url.rsplit('/v1', 1)[0]}/health" # Guessing a root health endpoint
+        self._health: Optional[VLLMHealthState] = None
+        self._working_endpoint: Optional[str] = None # Probed first (and alone) next time
+        self._dead_endpoints: Dict[str, float] = {} # Returned 404/405 -> when; skipped for vllm.dead_endpoint_retry_seconds
+        self._probe_task: Optional[asyncio.Future] = None
+        self._prober_task: Optional[asyncio.Task] = None
 
         logger.info(f"VLLMService initialized. Chat completions URL: {self.chat_completions_url}, Models URL: {self.models_url}")
 
-    async def generate_response(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """向vLLM服务发送请求并获取生成结果 using chat completions endpoint"""
+    def _build_request_payload(self, params: Optional[Dict[str, Any]], **body: Any) -> Dict[str, Any]:
+        """OpenAI-style request body: model, the endpoint-specific `body` fields, then generation params."""
         current_params = params if params else {}
         request_payload = {
             "model": settings.vllm.model_name_or_path,
-            "messages": [{"role": "user", "content": prompt}],
+            **body,
             "max_tokens": current_params.get("max_tokens", settings.vllm.default_max_tokens),
             "temperature": current_params.get("temperature", settings.vllm.default_temperature),
         }
@@ -44,11 +68,30 @@ class VLLMService:
         for key, value in current_params.items():
             if key not in request_payload and value is not None:
                 request_payload[key] = value
+        return request_payload
+
+    async def generate_response(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """向vLLM服务发送请求并获取生成结果 using chat completions endpoint"""
+        request_payload = self._build_request_payload(params, messages=[{"role": "user", "content": prompt}])
+        return await self._post_json(self.chat_completions_url, request_payload)
+
+    async def generate_completions(self, prompts: List[str], params: Optional[Dict[str, Any]] = None) -> List[str]:
+        """
+        Sends several prompts in one /completions request (the OpenAI API accepts a list) and returns the
+        generated texts in prompt order. Raw completion: the prompts are not wrapped in the chat template.
+        """
+        request_payload = self._build_request_payload(params, prompt=list(prompts))
+        response = await self._post_json(self.completions_url, request_payload)
+        choices = response.get("choices") or []
+        if len(choices) != len(prompts):
+            raise VLLMServiceError(f"vLLM returned {len(choices)} completions for {len(prompts)} prompts")
+        return [choice.get("text", "") for choice in sorted(choices, key=lambda choice: choice.get("index", 0))]
 
-        logger.debug(f"Sending request to vLLM ({self.chat_completions_url}): {request_payload}")
+    async def _post_json(self, url: str, request_payload: Dict[str, Any]) -> Dict[str, Any]:
+        logger.debug(f"Sending request to vLLM ({url}): {request_payload}")
         try:
             response = await self.client.post(
-                self.chat_completions_url, 
+                url, 
                 json=request_payload, 
                 timeout=settings.vllm.request_timeout
             )
@@ -72,35 +115,79 @@ class VLLMService:
             logger.error(error_message, exc_info=True)
             raise VLLMServiceError(error_message, underlying_exception=e) from e
 
-    async def check_health(self) -> bool:
+    async def stream_response(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
         """
-        Checks vLLM service health.
-        Tries a dedicated health endpoint first, then listing models.
+        Streams the chat completion (OpenAI server-sent events) and yields content deltas as vLLM produces
+        them. Closing the generator early closes the HTTP response, which makes vLLM abort the request.
         """
-        # Try a common health endpoint pattern (often at the root of the service, not under /v1)
-        health_endpoints_to_try = [
-            self.health_check_url, 
-            settings.vllm.api_base_url.rstrip("/v1").rstrip("/") + "/healthz", # another common one
-            settings.vllm.api_base_url.rstrip("/v1").rstrip("/") + "/live",
-            settings.vllm.api_base_url.rstrip("/v1").rstrip("/") + "/ready",
-        ]
-        for endpoint in health_endpoints_to_try:
-            try:
-                logger.debug(f"Attempting health check at {endpoint}")
-                response = await self.client.get(endpoint, timeout=5.0)
-                if response.status_code == 200:
-                    logger.info(f"vLLM health check: OK (endpoint {endpoint} responded with 200).")
-                    return True
-                logger.debug(f"Health check at {endpoint} failed with status {response.status_code}")
-            except httpx.RequestError:
-                logger.debug(f"Health check at {endpoint} failed (RequestError).")
-            except Exception:
-                logger.debug(f"Health check at {endpoint} failed (Exception).", exc_info=True)
-        
-        # Fallback to listing models if specific health endpoints fail
-        logger.info("Specific health endpoints failed or not found, trying to list models as health check.")
+        request_payload = self._build_request_payload(params, messages=[{"role": "user", "content": prompt}], stream=True)
+
+        logger.debug(f"Streaming request to vLLM ({self.chat_completions_url}): {request_payload}")
         try:
-            response = await self.client.get(self.models_url, timeout=10.0)
+            async with self.client.stream("POST", self.chat_completions_url, json=request_payload,
+                                          timeout=settings.vllm.request_timeout) as response:
+                if response.status_code >= 400:
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    error_message = f"vLLM API HTTP error: {response.status_code} - {body}"
+                    logger.error(error_message)
+                    raise VLLMServiceError(error_message, status_code=response.status_code)
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue # Blank separators and SSE comments
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+        except VLLMServiceError:
+            raise
+        except httpx.TimeoutException as e:
+            error_message = f"vLLM streaming request timed out after {settings.vllm.request_timeout}s: {e}"
+            logger.error(error_message, exc_info=True)
+            raise VLLMServiceError(error_message, underlying_exception=e) from e
+        except httpx.RequestError as e:
+            error_message = f"vLLM streaming request network error: {e}"
+            logger.error(error_message, exc_info=True)
+            raise VLLMServiceError(error_message, underlying_exception=e) from e
+        except ValueError as e: # Malformed event payload
+            error_message = f"Malformed vLLM stream event: {e}"
+            logger.error(error_message, exc_info=True)
+            raise VLLMServiceError(error_message, underlying_exception=e) from e
+
+    def _health_endpoints(self):
+        base = settings.vllm.api_base_url.rstrip("/v1").rstrip("/")
+        return [self.health_check_url, base + "/healthz", base + "/live", base + "/ready"]
+
+    def _is_dead(self, endpoint: str) -> bool:
+        marked_at = self._dead_endpoints.get(endpoint)
+        if marked_at is None:
+            return False
+        if time.monotonic() - marked_at >= settings.vllm.dead_endpoint_retry_seconds:
+            del self._dead_endpoints[endpoint]
+            return False
+        return True
+
+    async def _probe_endpoint(self, endpoint: str) -> bool:
+        try:
+            logger.debug(f"Attempting health check at {endpoint}")
+            response = await self.client.get(endpoint, timeout=settings.vllm.health_probe_timeout_seconds)
+            if response.status_code == 200:
+                return True
+            logger.debug(f"Health check at {endpoint} failed with status {response.status_code}")
+            if response.status_code in (404, 405):
+                # The route does not exist on this server; no point asking again until it may have been restarted.
+                self._dead_endpoints[endpoint] = time.monotonic()
+        except httpx.RequestError:
+            logger.debug(f"Health check at {endpoint} failed (RequestError).")
+        except Exception:
+            logger.debug(f"Health check at {endpoint} failed (Exception).", exc_info=True)
+        return False
+
+    async def _probe_models_endpoint(self) -> bool:
+        try:
+            response = await self.client.get(self.models_url, timeout=settings.vllm.health_probe_timeout_seconds)
             if response.status_code == 200:
                 models_data = response.json().get("data", [])
                 if any(m.get("id") == settings.vllm.model_name_or_path for m in models_data):
@@ -122,3 +209,73 @@ class VLLMService:
             logger.error(f"vLLM health check failed (Exception on models endpoint): {e}", exc_info=True)
             return False
 
+    async def _run_probes(self) -> bool:
+        """
+        One health probe. The endpoint that answered last time is asked first, alone; otherwise the
+        dedicated health endpoints not known to be missing are probed concurrently, and the models
+        listing is the fallback.
+        """
+        start_time = time.monotonic()
+        healthy, endpoint = False, None
+        if self._working_endpoint is not None:
+            if self._working_endpoint == self.models_url:
+                healthy = await self._probe_models_endpoint()
+            else:
+                healthy = await self._probe_endpoint(self._working_endpoint)
+            endpoint = self._working_endpoint if healthy else None
+            if not healthy:
+                logger.info(f"vLLM health check: Previously working endpoint {self._working_endpoint} failed, probing all endpoints.")
+
+        if not healthy:
+            candidates = [url for url in self._health_endpoints() if not self._is_dead(url)]
+            results = await asyncio.gather(*(self._probe_endpoint(url) for url in candidates))
+            endpoint = next((url for url, ok in zip(candidates, results) if ok), None)
+            if endpoint is not None:
+                healthy = True
+                logger.info(f"vLLM health check: OK (endpoint {endpoint} responded with 200).")
+            else:
+                # Fallback to listing models if specific health endpoints fail
+                logger.info("Specific health endpoints failed or not found, trying to list models as health check.")
+                healthy = await self._probe_models_endpoint()
+                endpoint = self.models_url if healthy else None
+
+        self._working_endpoint = endpoint
+        self._health = VLLMHealthState(healthy, time.time(), endpoint, int((time.monotonic() - start_time) * 1000))
+        return healthy
+
+    async def probe_health(self) -> bool:
+        """Probes vLLM now and refreshes the cached state. Concurrent callers share one probe."""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.ensure_future(self._run_probes())
+        return await asyncio.shield(self._probe_task)
+
+    async def check_health(self) -> bool:
+        """
+        Checks vLLM service health.
+        Returns the cached result while the background prober is running or the last probe is
+        younger than vllm.health_cache_ttl_seconds; otherwise probes first.
+        """
+        state = self._health
+        if state is not None:
+            prober_running = self._prober_task is not None and not self._prober_task.done()
+            if prober_running or time.time() - state.checked_at < settings.vllm.health_cache_ttl_seconds:
+                return state.healthy
+        return await self.probe_health()
+
+    def get_health_state(self) -> Optional["VLLMHealthState"]:
+        return self._health
+
+    async def run_health_prober(self, interval: Optional[float] = None):
+        """Probes on a fixed interval so check_health() never waits on the network. Cancel to stop."""
+        interval = interval if interval is not None else settings.vllm.health_probe_interval_seconds
+        self._prober_task = asyncio.current_task()
+        logger.info(f"VLLMService: Background health prober started (interval {interval}s).")
+        try:
+            while True:
+                try:
+                    await self.probe_health()
+                except Exception as e:
+                    logger.error(f"VLLMService: Health probe failed unexpectedly: {e}", exc_info=True)
+                await asyncio.sleep(interval)
+        finally:
+            self._prober_task = None
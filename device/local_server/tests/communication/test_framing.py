@@ -0,0 +1,271 @@
+import pytest
+import asyncio
+import json
+import random
+import zlib
+from unittest.mock import patch, AsyncMock
+
+from local_server.core.config import AppSettings, RemoteServerSettings
+from local_server.communication import framing
+from local_server.communication.framing import (
+    FRAMING_JSON, FRAMING_JSON_FRAMED, FRAMING_MSGPACK, FRAME_HEADER,
+    COMPRESSION_ZLIB, COMPRESSION_ZSTD, FRAME_FLAG_ZLIB, FrameCompressor, JsonFramedCodec,
+    decompress_body, negotiate_compression, supported_compressions, HELLO_MESSAGE_TYPE,
+    FramingError, JsonLineCodec, MsgpackFrameCodec,
+    FrameDecoder, FrameTooLargeError,
+    build_hello_message, get_codec, negotiate_framing, supported_framings
+)
+from local_server.communication.protocol_models import BaseMessage
+from local_server.communication.tcp_client import TCPRemoteClient
+from local_server.communication.tcp_server import start_tcp_server
+
+TEST_HOST = "127.0.0.1"
+TEST_PORT = 9994
+
+def _refinement_message() -> BaseMessage:
+    return BaseMessage(message_type="local_request_cloud_refinement", payload={
+        "original_user_prompt": "请解释量子纠缠 " * 20,
+        "local_model_draft_result": "Quantum entanglement is... " * 40,
+        "confidence_assessment": {"rouge_l_score": 0.21, "keyword_triggers_found": [], "requires_cloud_refinement": True}
+    })
+
+def test_json_line_codec_round_trip():
+    codec = JsonLineCodec()
+    message = _refinement_message()
+    encoded = codec.encode(message)
+    assert encoded.endswith(b"\n")
+    assert codec.decode(encoded.rstrip(b"\n")) == json.loads(message.model_dump_json())
+
+def test_msgpack_codec_round_trip():
+    pytest.importorskip("msgpack")
+    codec = MsgpackFrameCodec()
+    message = _refinement_message()
+    encoded = codec.encode(message)
+    body_length, flags = FRAME_HEADER.unpack(encoded[:FRAME_HEADER.size])
+    assert body_length == len(encoded) - FRAME_HEADER.size
+    assert flags == 0
+    decoded = codec.decode(encoded[FRAME_HEADER.size:])
+    assert BaseMessage(**decoded) == message
+
+def test_msgpack_codec_rejects_garbage():
+    pytest.importorskip("msgpack")
+    with pytest.raises(FramingError):
+        MsgpackFrameCodec().decode(b"\xc1\xc1\xc1")
+
+def test_negotiate_framing_prefers_peer_order_and_falls_back_to_json():
+    assert negotiate_framing(None) == FRAMING_JSON
+    assert negotiate_framing(["cbor", "json"]) == FRAMING_JSON
+    if FRAMING_MSGPACK in supported_framings():
+        assert negotiate_framing(["msgpack", "json"]) == FRAMING_MSGPACK
+
+def test_negotiate_framing_without_msgpack_installed():
+    with patch.object(framing, "msgpack", None):
+        assert supported_framings() == [FRAMING_JSON_FRAMED, FRAMING_JSON]
+        assert negotiate_framing(["msgpack", "json"]) == FRAMING_JSON
+        with pytest.raises(FramingError):
+            get_codec(FRAMING_MSGPACK)
+
+def test_build_hello_message_always_offers_json_fallback():
+    hello = build_hello_message(FRAMING_MSGPACK, "device_1")
+    assert hello.message_type == HELLO_MESSAGE_TYPE
+    assert hello.payload["framings"] == [FRAMING_MSGPACK, FRAMING_JSON]
+    assert build_hello_message(FRAMING_JSON, "device_1").payload["framings"] == [FRAMING_JSON]
+
+def _drain(decoder: FrameDecoder):
+    frames = []
+    while (frame := decoder.next_frame()) is not None:
+        frames.append(frame)
+    return frames
+
+def _make_frame_body(size: int) -> bytes:
+    # Mixed ASCII and 3-byte UTF-8 characters so chunk boundaries regularly split a character.
+    unit = "Owl chat history 你好世界，请总结以下内容。".encode("utf-8")
+    body = (unit * (size // len(unit) + 1))[:size]
+    return body.decode("utf-8", errors="ignore").encode("utf-8") # Trim a partial trailing character
+
+def _encode_line(body: bytes) -> bytes:
+    return body + b"\n"
+
+def _encode_length_prefixed(body: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(body), 0) + body
+
+def test_frame_decoder_keeps_multibyte_characters_split_across_reads():
+    frame = "请帮我写一首关于春天的诗".encode("utf-8")
+    decoder = FrameDecoder(max_frame_size=1024)
+    frames = []
+    for i in range(len(frame)):
+        decoder.feed(frame[i:i + 1])
+        frames.extend(_drain(decoder))
+    decoder.feed(b"\n")
+    frames.extend(_drain(decoder))
+    assert [f.decode("utf-8") for f in frames] == ["请帮我写一首关于春天的诗"]
+
+def test_frame_decoder_switches_mode_with_data_already_buffered():
+    decoder = FrameDecoder(max_frame_size=1024)
+    decoder.feed(b'{"hello": 1}\n' + _encode_length_prefixed(b"binary-body"))
+    assert decoder.next_frame() == b'{"hello": 1}'
+    decoder.length_prefixed = True
+    assert decoder.next_frame() == b"binary-body"
+    assert decoder.next_frame() is None
+    assert decoder.buffered_bytes == 0
+
+def test_frame_decoder_rejects_oversized_line_frame():
+    decoder = FrameDecoder(max_frame_size=100)
+    decoder.feed(b"x" * 101)
+    with pytest.raises(FrameTooLargeError):
+        decoder.next_frame()
+
+def test_frame_decoder_rejects_oversized_announced_frame():
+    decoder = FrameDecoder(max_frame_size=100, length_prefixed=True)
+    decoder.feed(FRAME_HEADER.pack(101, 0))
+    with pytest.raises(FrameTooLargeError):
+        decoder.next_frame()
+
+@pytest.mark.parametrize("length_prefixed", [False, True])
+@pytest.mark.parametrize("seed", range(3))
+def test_frame_decoder_fuzz_random_chunking(length_prefixed, seed):
+    rng = random.Random(seed)
+    sizes = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+    bodies = [_make_frame_body(rng.choice(sizes) + rng.randint(0, 512)) for _ in range(6)]
+    encode = _encode_length_prefixed if length_prefixed else _encode_line
+    stream = b"".join(encode(body) for body in bodies)
+
+    decoder = FrameDecoder(max_frame_size=11 * 1024 * 1024, length_prefixed=length_prefixed)
+    received = []
+    offset = 0
+    while offset < len(stream):
+        chunk_size = rng.choice([1, 7, 4096, 65536, 262144, rng.randint(1, 1 << 20)])
+        decoder.feed(stream[offset:offset + chunk_size])
+        offset += chunk_size
+        received.extend(_drain(decoder))
+
+    assert received == bodies
+    assert decoder.buffered_bytes == 0
+    assert all(body.decode("utf-8") for body in received)
+
+@pytest.fixture
+def msgpack_settings():
+    pytest.importorskip("msgpack")
+    app_settings = AppSettings(remote_server=RemoteServerSettings(
+        host=TEST_HOST, command_port=TEST_PORT, wire_framing=FRAMING_MSGPACK, protocol_hello_timeout_seconds=0.5
+    ))
+    with patch("local_server.communication.tcp_client.settings", app_settings), \
+         patch("local_server.communication.tcp_server.settings", app_settings):
+        yield app_settings
+
+@pytest.fixture
+def compression_settings():
+    app_settings = AppSettings(remote_server=RemoteServerSettings(
+        host=TEST_HOST, command_port=TEST_PORT, wire_framing=FRAMING_JSON, wire_compression=COMPRESSION_ZLIB,
+        compression_min_bytes=512, protocol_hello_timeout_seconds=0.5
+    ))
+    with patch("local_server.communication.tcp_client.settings", app_settings), \
+         patch("local_server.communication.tcp_server.settings", app_settings), \
+         patch("local_server.communication.framing.settings", app_settings):
+        yield app_settings
+
+@pytest.mark.asyncio
+async def test_client_and_server_negotiate_msgpack(msgpack_settings):
+    handler = AsyncMock(return_value=None)
+    server_task = asyncio.create_task(start_tcp_server(TEST_HOST, TEST_PORT, handler, "framing_server"))
+    await asyncio.sleep(0.1)
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id="framing_client")
+    try:
+        assert await client.connect() is True
+        assert client._codec.name == FRAMING_MSGPACK
+        assert await client.send_heartbeat() is True
+        await asyncio.sleep(0.1)
+        handler.assert_called_once()
+        received = handler.call_args[0][0]
+        assert received["message_type"] == "heartbeat"
+        assert received["payload"]["local_server_id"] == "framing_client"
+    finally:
+        await client.close()
+        server_task.cancel()
+        try: await server_task
+        except asyncio.CancelledError: pass
+
+@pytest.mark.asyncio
+async def test_client_falls_back_to_json_when_server_ignores_hello(msgpack_settings):
+    received_lines = []
+
+    async def legacy_server(reader, writer):
+        # An older server: reads lines and never answers protocol_hello.
+        while line := await reader.readline():
+            received_lines.append(json.loads(line))
+        writer.close()
+
+    server = await asyncio.start_server(legacy_server, TEST_HOST, TEST_PORT)
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id="framing_client")
+    try:
+        assert await client.connect() is True
+        assert client._codec.name == FRAMING_JSON
+        assert await client.send_heartbeat() is True
+        await asyncio.sleep(0.1)
+        assert [m["message_type"] for m in received_lines] == [HELLO_MESSAGE_TYPE, "heartbeat"]
+    finally:
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+@pytest.mark.parametrize("algorithm", [COMPRESSION_ZLIB, COMPRESSION_ZSTD])
+def test_compressed_frame_round_trip_and_stats(algorithm):
+    if algorithm not in supported_compressions():
+        pytest.skip(f"{algorithm} not installed")
+    codec = JsonFramedCodec(compressor=FrameCompressor(algorithm, min_bytes=512))
+    message = _refinement_message()
+    encoded = codec.encode(message)
+    body_length, flags = FRAME_HEADER.unpack(encoded[:FRAME_HEADER.size])
+    assert flags != 0
+    assert body_length < len(message.model_dump_json())
+    assert codec.decode(encoded[FRAME_HEADER.size:], flags) == json.loads(message.model_dump_json())
+
+    stats = codec.compressor.stats.snapshot()
+    assert stats["frames_compressed"] == 1
+    assert stats["frames_decompressed"] == 1
+    assert 0 < stats["ratio"] < 1
+
+def test_small_frames_are_sent_uncompressed():
+    codec = JsonFramedCodec(compressor=FrameCompressor(COMPRESSION_ZLIB, min_bytes=4096))
+    encoded = codec.encode(BaseMessage(message_type="heartbeat", payload={"local_server_id": "s1", "status": "ok"}))
+    assert FRAME_HEADER.unpack(encoded[:FRAME_HEADER.size])[1] == 0
+    assert codec.compressor.stats.frames_considered == 0
+
+def test_decompression_is_capped():
+    bomb = zlib.compress(b"a" * 100_000)
+    with pytest.raises(FrameTooLargeError):
+        decompress_body(bomb, FRAME_FLAG_ZLIB, max_size=1024)
+    with pytest.raises(FramingError):
+        decompress_body(b"not zlib", FRAME_FLAG_ZLIB, max_size=1024)
+
+def test_negotiate_compression_requires_length_prefixed_framing():
+    assert negotiate_compression([COMPRESSION_ZLIB], FRAMING_JSON) is None
+    assert negotiate_compression([COMPRESSION_ZLIB], FRAMING_JSON_FRAMED) == COMPRESSION_ZLIB
+    assert negotiate_compression(["brotli"], FRAMING_JSON_FRAMED) is None
+    assert negotiate_compression(None, FRAMING_JSON_FRAMED) is None
+
+@pytest.mark.asyncio
+async def test_client_and_server_negotiate_compressed_json_frames(compression_settings):
+    handler = AsyncMock(return_value={"status": "ok", "echo": "量子" * 2000})
+    server_task = asyncio.create_task(start_tcp_server(TEST_HOST, TEST_PORT, handler, "compression_server"))
+    await asyncio.sleep(0.1)
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id="compression_client")
+    responses = []
+    client.on_unsolicited_message_callback = AsyncMock(side_effect=lambda message: responses.append(message))
+    try:
+        assert await client.connect() is True
+        assert client._codec.name == FRAMING_JSON_FRAMED
+        assert client._codec.compressor.algorithm == COMPRESSION_ZLIB
+        assert await client._send_message_internal(_refinement_message()) is True
+        await asyncio.sleep(0.2)
+        assert handler.call_args[0][0]["payload"]["original_user_prompt"].startswith("请解释量子纠缠")
+        assert responses[0]["payload"]["echo"] == "量子" * 2000
+
+        stats = client.get_pool_stats()[0]["compression"]
+        assert stats["frames_compressed"] == 1
+        assert stats["frames_decompressed"] == 1
+    finally:
+        await client.close()
+        server_task.cancel()
+        try: await server_task
+        except asyncio.CancelledError: pass
@@ -0,0 +1,29 @@
+import pytest
+import asyncio
+from unittest.mock import patch
+
+from local_server.communication.metrics_http_server import handle_metrics_request
+
+TEST_HOST = "127.0.0.1"
+
+async def _http_get(port: int, path: str) -> bytes:
+    reader, writer = await asyncio.open_connection(TEST_HOST, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_serves_prometheus_text():
+    server = await asyncio.start_server(handle_metrics_request, TEST_HOST, 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        with patch("local_server.communication.metrics_http_server.metrics") as mock_metrics:
+            mock_metrics.render_prometheus.return_value = "local_server_stage_duration_seconds_count 3\n"
+            response = await _http_get(port, "/metrics")
+        assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+        assert b"Content-Type: text/plain; version=0.0.4" in response
+        assert response.endswith(b"\r\n\r\nlocal_server_stage_duration_seconds_count 3\n")
+
+        assert (await _http_get(port, "/other")).startswith(b"HTTP/1.1 404")
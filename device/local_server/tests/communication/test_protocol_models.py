@@ -11,7 +11,9 @@ from local_server.communication.protocol_models import (
     ConfidenceAssessmentData, LocalRequestCloudRefinementPayload,
     CloudRefinementResponseToLocalPayload, CloudRefinementDiagnostics,
     LocalConfidentResultNotificationPayload,
-    HeartbeatPayload
+    HeartbeatPayload,
+    new_task_id, utc_timestamp, parse_incoming_message, validate_model, get_type_adapter,
+    ProtocolValidationError
 )
 
 # --- Test BaseMessage ---
@@ -178,3 +180,54 @@ def test_nested_payload_serialization():
     reconstructed_owl_details = ExecuteOwlTaskDetails(**reconstructed_cmd_payload.command_details)
     assert reconstructed_owl_details.agent_task_description == "Run Owl Test"
 
+
+def test_fast_factories_match_legacy_formats():
+    task_id = new_task_id()
+    assert uuid.UUID(task_id).version == 4
+    assert str(uuid.UUID(task_id)) == task_id
+    assert new_task_id() != task_id
+
+    ts = utc_timestamp()
+    assert ts.endswith("Z")
+    parsed = datetime.datetime.fromisoformat(ts[:-1])
+    assert abs((datetime.datetime.utcnow() - parsed).total_seconds()) < 5
+
+def test_parse_incoming_message_defers_payload_validation():
+    cmd_payload = RemoteCommandToLocalPayload(command_action="get_local_status")
+    raw = BaseMessage(message_type="remote_command_to_local", payload=cmd_payload.model_dump()).model_dump()
+
+    incoming = parse_incoming_message(raw)
+    assert incoming.task_id == raw["task_id"]
+    assert incoming.payload is raw["payload"]
+    parsed = incoming.parsed_payload()
+    assert isinstance(parsed, RemoteCommandToLocalPayload)
+    assert incoming.parsed_payload() is parsed # Cached
+
+    bad = parse_incoming_message({"task_id": "t1", "message_type": "remote_command_to_local", "payload": {"command_action": "nope"}})
+    with pytest.raises(ValidationError):
+        bad.parsed_payload()
+
+    unknown = parse_incoming_message({"message_type": "custom", "payload": {"a": 1}})
+    assert unknown.parsed_payload() == {"a": 1}
+    assert uuid.UUID(unknown.task_id)
+
+def test_parse_incoming_message_envelope_checks():
+    with pytest.raises(ProtocolValidationError):
+        parse_incoming_message({"task_id": "t1", "payload": {}})
+    with pytest.raises(ProtocolValidationError):
+        parse_incoming_message({"task_id": 5, "message_type": "x", "payload": {}})
+    with pytest.raises(ProtocolValidationError):
+        parse_incoming_message({"task_id": "t1", "message_type": "x", "payload": []})
+
+def test_parse_incoming_message_trusted_skips_envelope_checks_only():
+    raw = {"task_id": "t1", "message_type": "heartbeat", "payload": {"local_server_id": "s1", "status": "not_a_status"}}
+    incoming = parse_incoming_message(raw, trusted=True)
+    assert incoming.payload is raw["payload"]
+    with pytest.raises(ValidationError):
+        incoming.parsed_payload()
+
+def test_validate_model_reuses_adapter():
+    assert get_type_adapter(ExecuteOwlTaskDetails) is get_type_adapter(ExecuteOwlTaskDetails)
+    details = validate_model(ExecuteOwlTaskDetails, {"agent_task_description": "Run"})
+    assert details.agent_task_description == "Run"
+    assert isinstance(validate_model(GetLocalStatusDetails, None), GetLocalStatusDetails)
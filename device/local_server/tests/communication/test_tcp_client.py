@@ -1,11 +1,12 @@
 import pytest
+import pytest_asyncio
 import asyncio
 import json
 from unittest.mock import patch, AsyncMock, MagicMock
 
 from local_server.core.config import AppSettings, RemoteServerSettings
 from local_server.communication.tcp_client import TCPRemoteClient, TCPClientError, TCPClientConnectionError, TCPClientTimeoutError
-from local_server.communication.protocol_models import BaseMessage, HeartbeatPayload, LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload
+from local_server.communication.protocol_models import BaseMessage, HeartbeatPayload, LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload, ConfidenceAssessmentData
 
 CLIENT_ID = "test_client_01"
 TEST_HOST = "127.0.0.1"
@@ -25,7 +26,7 @@ def mock_settings():
     with patch("local_server.communication.tcp_client.settings", app_settings):
         yield app_settings
 
-@pytest.fixture
+@pytest_asyncio.fixture
 async def mock_tcp_server():
     """A simple mock TCP server for testing client connections."""
     server_store = {"received_data": [], "responses_to_send": [], "server_task": None, "clients": []}
@@ -78,7 +79,7 @@ async def mock_tcp_server():
     await server.wait_closed()
     print("MockServer: Shutdown complete.")
 
-@pytest.fixture
+@pytest_asyncio.fixture
 async def tcp_client(mock_settings):
     client = TCPRemoteClient(
         host=TEST_HOST,
@@ -159,7 +160,7 @@ async def test_tcp_client_request_cloud_refinement_success(tcp_client, mock_tcp_
     request_data = LocalRequestCloudRefinementPayload(
         original_user_prompt="prompt", 
         local_model_draft_result="draft",
-        confidence_assessment=MagicMock() # Mocked for simplicity
+        confidence_assessment=ConfidenceAssessmentData(requires_cloud_refinement=True)
     )
     
     response_payload = CloudRefinementResponseToLocalPayload(status="success", refined_result="refined_text")
@@ -181,9 +182,11 @@ async def test_tcp_client_request_cloud_refinement_success(tcp_client, mock_tcp_
         await asyncio.sleep(0.1) # Allow send to happen and task_id to be captured
         assert sent_task_id is not None
         
-        # Now, queue the server's response
+        # Now, send the server's response (the request has already been received, so queueing it would never flush)
         server_response_msg = BaseMessage(task_id=sent_task_id, message_type="cloud_refinement_response", payload=response_payload.model_dump())
-        mock_tcp_server["responses_to_send"].append(server_response_msg.model_dump_json())
+        server_writer = mock_tcp_server["clients"][0]
+        server_writer.write(server_response_msg.model_dump_json().encode() + b"\n")
+        await server_writer.drain()
         
         # Await the client's request method
         cloud_response = await response_task
@@ -199,7 +202,7 @@ async def test_tcp_client_request_cloud_refinement_timeout(tcp_client, mock_tcp_
     await tcp_client.connect()
     assert tcp_client.is_connected
 
-    request_data = LocalRequestCloudRefinementPayload(original_user_prompt="p", local_model_draft_result="d", confidence_assessment=MagicMock())
+    request_data = LocalRequestCloudRefinementPayload(original_user_prompt="p", local_model_draft_result="d", confidence_assessment=ConfidenceAssessmentData(requires_cloud_refinement=True))
     
     # Server will not send a response for this request
     with pytest.raises(TCPClientTimeoutError):
@@ -295,3 +298,275 @@ async def test_tcp_client_shutdown_cancels_tasks(tcp_client, mock_tcp_server):
     try: await maintain_task
     except asyncio.CancelledError: pass
 
+
+def _refinement_request() -> LocalRequestCloudRefinementPayload:
+    return LocalRequestCloudRefinementPayload(
+        original_user_prompt="prompt",
+        local_model_draft_result="draft",
+        confidence_assessment=ConfidenceAssessmentData(requires_cloud_refinement=True)
+    )
+
+@pytest.mark.asyncio
+async def test_tcp_client_pool_routes_to_least_outstanding_connection(mock_tcp_server, mock_settings):
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id=CLIENT_ID, pool_size=3)
+    try:
+        assert await client.connect() is True
+        assert all(stats["connected"] for stats in client.get_pool_stats())
+        assert len(mock_tcp_server["clients"]) == 3
+
+        requests = [asyncio.create_task(client.request_cloud_refinement(_refinement_request(), timeout=2)) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        # Server never answers, so each request stays outstanding on a different connection.
+        assert sorted(stats["outstanding"] for stats in client.get_pool_stats()) == [1, 1, 1]
+        assert len(client._pending_requests) == 3
+
+        for task in requests:
+            task.cancel()
+        await asyncio.gather(*requests, return_exceptions=True)
+    finally:
+        await client.close()
+
+@pytest.mark.asyncio
+async def test_tcp_client_pool_connection_failure_is_isolated(mock_tcp_server, mock_settings):
+    mock_settings.remote_server.session_resume_enabled = False # Dropped requests fail immediately
+    on_disconnect = AsyncMock()
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id=CLIENT_ID, on_disconnect_callback=on_disconnect, pool_size=2)
+    maintain_task = None
+    try:
+        assert await client.connect() is True
+        first = asyncio.create_task(client.request_cloud_refinement(_refinement_request(), timeout=3))
+        second = asyncio.create_task(client.request_cloud_refinement(_refinement_request(), timeout=3))
+        await asyncio.sleep(0.1)
+
+        # Drop only the server side of connection #0.
+        dropped = client._connections[0]
+        dropped_sockname = dropped.writer.get_extra_info("sockname")
+        server_writer = next(w for w in mock_tcp_server["clients"] if w.get_extra_info("peername") == dropped_sockname)
+        server_writer.close()
+        await asyncio.sleep(0.2)
+
+        assert not dropped.is_connected
+        assert client._connections[1].is_connected
+        assert client.is_connected
+        on_disconnect.assert_not_called() # The pool as a whole is still up
+
+        # Exactly one request failed; the other is still waiting on connection #1.
+        assert [first.done(), second.done()].count(True) == 1
+        failed = first if first.done() else second
+        still_pending = second if failed is first else first
+        assert isinstance(failed.exception(), TCPClientConnectionError)
+        assert not still_pending.done()
+
+        # The dropped connection reconnects on its own.
+        maintain_task = asyncio.create_task(client.maintain_connection_loop())
+        await asyncio.sleep(0.2)
+        assert dropped.is_connected
+        still_pending.cancel()
+        await asyncio.gather(still_pending, return_exceptions=True)
+    finally:
+        await client.close()
+        if maintain_task:
+            maintain_task.cancel()
+            await asyncio.gather(maintain_task, return_exceptions=True)
+
+async def _start_streaming_cloud(chunks, chunk_delay: float):
+    """Mock cloud that answers a streamed refinement with one chunk per `chunk_delay`, then the final response."""
+    requests = []
+
+    async def handle_connection(reader, writer):
+        while line := await reader.readline():
+            request = json.loads(line)
+            requests.append(request)
+            task_id = request["task_id"]
+            for sequence, delta in enumerate(chunks):
+                await asyncio.sleep(chunk_delay)
+                chunk = BaseMessage(task_id=task_id, message_type="cloud_refinement_chunk", payload={"sequence": sequence, "delta": delta})
+                writer.write(chunk.model_dump_json().encode() + b"\n")
+                await writer.drain()
+            final = BaseMessage(task_id=task_id, message_type="cloud_refinement_response_to_local",
+                                payload={"status": "success", "refined_result": "".join(chunks)})
+            writer.write(final.model_dump_json().encode() + b"\n")
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle_connection, TEST_HOST, TEST_PORT)
+    return server, requests
+
+@pytest.mark.asyncio
+async def test_tcp_client_stream_cloud_refinement_yields_chunks_as_they_arrive(mock_settings):
+    chunks = ["Quantum ", "entanglement ", "links ", "two ", "particles."]
+    server, requests = await _start_streaming_cloud(chunks, chunk_delay=0.1)
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id=CLIENT_ID)
+    try:
+        assert await client.connect() is True
+        start = asyncio.get_running_loop().time()
+        stream = await client.stream_cloud_refinement(_refinement_request())
+        received = []
+        first_chunk_at = None
+        async for chunk in stream:
+            if first_chunk_at is None:
+                first_chunk_at = asyncio.get_running_loop().time() - start
+            received.append(chunk.delta)
+        total = asyncio.get_running_loop().time() - start
+
+        assert requests[0]["payload"]["stream"] is True
+        assert received == chunks
+        assert stream.final.refined_result == "".join(chunks)
+        # Time-to-first-token is one chunk interval, not the whole generation time.
+        assert first_chunk_at < 0.3
+        assert total >= 0.5
+        assert stream.time_to_first_chunk_ms < 300
+        assert client.get_pool_stats()[0]["outstanding"] == 0
+    finally:
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_tcp_client_stream_cloud_refinement_chunk_timeout(mock_settings):
+    mock_settings.remote_server.cloud_stream_chunk_timeout_seconds = 0.2
+    server, _ = await _start_streaming_cloud(["slow"], chunk_delay=1.0)
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id=CLIENT_ID)
+    try:
+        assert await client.connect() is True
+        stream = await client.stream_cloud_refinement(_refinement_request())
+        with pytest.raises(TCPClientTimeoutError):
+            async for _ in stream:
+                pass
+        assert client.get_pool_stats()[0]["outstanding"] == 0
+    finally:
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+async def _start_flaky_cloud(drop_first: int, session_aware: bool = False, lose_dropped: bool = False):
+    """
+    Mock cloud that drops the connection on the first `drop_first` refinement requests it sees, then answers.
+    With `lose_dropped` a dropped request never counts as received (it was lost before the cloud read it).
+    """
+    state = {"requests": [], "hellos": [], "received": {}}
+
+    async def handle_connection(reader, writer):
+        session_id = None
+        while line := await reader.readline():
+            message = json.loads(line)
+            if message["message_type"] == "protocol_hello":
+                state["hellos"].append(message["payload"])
+                session_id = message["payload"]["session"]["session_id"]
+                ack = {"framing": "json", "compression": None}
+                if session_aware:
+                    ack["session"] = {"resumed": session_id in state["received"], "last_received_seq": state["received"].get(session_id, 0)}
+                    state["received"].setdefault(session_id, 0)
+                reply = BaseMessage(task_id=message["task_id"], message_type="protocol_hello_ack", payload=ack)
+                writer.write(reply.model_dump_json().encode() + b"\n")
+                await writer.drain()
+                continue
+            state["requests"].append(message)
+            dropping = len(state["requests"]) <= drop_first
+            if session_id and not (dropping and lose_dropped):
+                state["received"][session_id] = state["received"].get(session_id, 0) + 1
+            if dropping:
+                break # Drop the connection with the request unanswered
+            response = BaseMessage(task_id=message["task_id"], message_type="cloud_refinement_response_to_local",
+                                   payload={"status": "success", "refined_result": f"refined #{len(state['requests'])}"})
+            writer.write(response.model_dump_json().encode() + b"\n")
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle_connection, TEST_HOST, TEST_PORT)
+    return server, state
+
+@pytest.mark.asyncio
+async def test_tcp_client_replays_in_flight_request_after_reconnect(mock_settings):
+    mock_settings.remote_server.tcp_client_reconnect_delay_seconds = 0.1
+    mock_settings.remote_server.session_resume_enabled = True
+    server, state = await _start_flaky_cloud(drop_first=1, session_aware=True, lose_dropped=True)
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id=CLIENT_ID)
+    maintain_task = asyncio.create_task(client.maintain_connection_loop())
+    try:
+        await asyncio.sleep(0.1)
+        response = await client.request_cloud_refinement(_refinement_request(), timeout=3)
+
+        assert response.refined_result == "refined #2"
+        assert len(state["requests"]) == 2
+        assert state["requests"][0]["task_id"] == state["requests"][1]["task_id"] # Same task_id, so the cloud can dedupe
+        stats = client.get_pool_stats()[0]
+        assert stats["session"]["replayed"] == 1
+        assert stats["outstanding"] == 0
+    finally:
+        await client.close()
+        maintain_task.cancel()
+        await asyncio.gather(maintain_task, return_exceptions=True)
+        server.close()
+        await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_tcp_client_resumed_request_keeps_original_deadline(mock_settings):
+    mock_settings.remote_server.tcp_client_reconnect_delay_seconds = 0.1
+    mock_settings.remote_server.session_resume_enabled = True
+    server, state = await _start_flaky_cloud(drop_first=100, session_aware=True, lose_dropped=True)
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id=CLIENT_ID)
+    maintain_task = asyncio.create_task(client.maintain_connection_loop())
+    try:
+        await asyncio.sleep(0.1)
+        start = asyncio.get_running_loop().time()
+        with pytest.raises(TCPClientTimeoutError):
+            await client.request_cloud_refinement(_refinement_request(), timeout=0.5)
+        assert asyncio.get_running_loop().time() - start < 0.8
+        assert client.get_pool_stats()[0]["outstanding"] == 0
+    finally:
+        await client.close()
+        maintain_task.cancel()
+        await asyncio.gather(maintain_task, return_exceptions=True)
+        server.close()
+        await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_tcp_client_session_handshake_skips_requests_server_already_has(mock_settings):
+    mock_settings.remote_server.tcp_client_reconnect_delay_seconds = 0.1
+    mock_settings.remote_server.session_resume_enabled = True
+    server, state = await _start_flaky_cloud(drop_first=1, session_aware=True)
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id=CLIENT_ID)
+    maintain_task = asyncio.create_task(client.maintain_connection_loop())
+    try:
+        await asyncio.sleep(0.1)
+        request = asyncio.create_task(client.request_cloud_refinement(_refinement_request(), timeout=3))
+        await asyncio.sleep(1.5) # Dropped, then reconnected and resumed on the next maintain-loop check
+
+        assert len(state["hellos"]) == 2
+        assert state["hellos"][0]["session"]["session_id"] == state["hellos"][1]["session"]["session_id"]
+        assert len(state["requests"]) == 1 # Server reported it already had seq 1, so nothing was replayed
+        assert client.get_pool_stats()[0]["session"]["replayed"] == 0
+        assert not request.done() # Still waiting for the server to deliver the response
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+    finally:
+        await client.close()
+        maintain_task.cancel()
+        await asyncio.gather(maintain_task, return_exceptions=True)
+        server.close()
+        await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_tcp_client_does_not_replay_to_peer_that_did_not_resume_session(mock_settings):
+    mock_settings.remote_server.tcp_client_reconnect_delay_seconds = 0.1
+    mock_settings.remote_server.session_resume_enabled = True
+    server, state = await _start_flaky_cloud(drop_first=1) # Acks the hello without confirming a session
+    client = TCPRemoteClient(host=TEST_HOST, port=TEST_PORT, client_id=CLIENT_ID)
+    maintain_task = asyncio.create_task(client.maintain_connection_loop())
+    try:
+        await asyncio.sleep(0.1)
+        with pytest.raises(TCPClientConnectionError):
+            await client.request_cloud_refinement(_refinement_request(), timeout=3)
+
+        assert len(state["hellos"]) == 2 # Failed only once reconnected and the session was not resumed
+        assert len(state["requests"]) == 1 # Never sent twice: this cloud cannot dedupe a replay
+        stats = client.get_pool_stats()[0]
+        assert stats["session"]["replayed"] == 0
+        assert stats["outstanding"] == 0
+    finally:
+        await client.close()
+        maintain_task.cancel()
+        await asyncio.gather(maintain_task, return_exceptions=True)
+        server.close()
+        await server.wait_closed()
@@ -1,11 +1,14 @@
 import pytest
+import pytest_asyncio
 import asyncio
 import json
+import logging
 from unittest.mock import patch, AsyncMock, MagicMock
 
 from local_server.core.config import AppSettings, RemoteServerSettings
 from local_server.communication.tcp_server import start_tcp_server
 from local_server.communication.protocol_models import BaseMessage
+from local_server.services.admission_control import AdmissionController, AdmissionRejectedError
 
 SERVER_ID = "test_server_01"
 TEST_HOST = "127.0.0.1"
@@ -19,12 +22,12 @@ def mock_settings():
     with patch("local_server.communication.tcp_server.settings", app_settings):
         yield app_settings
 
-@pytest.fixture
+@pytest_asyncio.fixture
 async def mock_message_handler():
     handler = AsyncMock(return_value=None) # Default: no response payload
     return handler
 
-@pytest.fixture
+@pytest_asyncio.fixture
 async def running_tcp_server(mock_settings, mock_message_handler):
     """Starts the TCP server and yields, then shuts it down."""
     server_task = asyncio.create_task(
@@ -126,8 +129,9 @@ async def test_tcp_server_sends_response_from_handler(running_tcp_server):
 
 @pytest.mark.asyncio
 async def test_tcp_server_handles_client_disconnect(running_tcp_server, caplog):
+    caplog.set_level(logging.INFO, logger="local_server.communication.tcp_server")
     reader, writer = await asyncio.open_connection(TEST_HOST, TEST_PORT)
-    peername = writer.get_extra_info("peername")
+    peername = writer.get_extra_info("sockname") # How the server sees this client
     print(f"TestClient: Connected as {peername}")
 
     # Client abruptly closes connection
@@ -137,12 +141,12 @@ async def test_tcp_server_handles_client_disconnect(running_tcp_server, caplog):
 
     await asyncio.sleep(0.1) # Give server time to process disconnect
     # Check logs for disconnect message
-    assert f"Client {peername} disconnected." in caplog.text or f"Connection closed for {peername}" in caplog.text
+    assert f"Client {peername} (Session:" in caplog.text and "disconnected" in caplog.text
 
 @pytest.mark.asyncio
 async def test_tcp_server_handles_invalid_json(running_tcp_server, caplog):
     reader, writer = await asyncio.open_connection(TEST_HOST, TEST_PORT)
-    peername = writer.get_extra_info("peername")
+    peername = writer.get_extra_info("sockname") # How the server sees this client
 
     invalid_json_message = "this is not json\n"
     writer.write(invalid_json_message.encode())
@@ -150,7 +154,7 @@ async def test_tcp_server_handles_invalid_json(running_tcp_server, caplog):
     print(f"TestClient: Sent invalid JSON: {invalid_json_message.strip()}")
 
     await asyncio.sleep(0.1)
-    assert f"Error decoding JSON from client {peername}" in caplog.text
+    assert f"Invalid JSON from {peername}" in caplog.text
     
     # Server should not call handler for invalid JSON
     running_tcp_server["handler"].assert_not_called()
@@ -213,3 +217,125 @@ async def test_tcp_server_max_clients(mock_settings, mock_message_handler, caplo
         try: await server_task
         except asyncio.CancelledError: pass
 
+
+@pytest.mark.asyncio
+async def test_tcp_server_slow_owl_task_does_not_delay_status_query(mock_settings):
+    owl_started = asyncio.Event()
+
+    async def slow_owl_handler(message_dict, writer):
+        action = message_dict["payload"]["command_action"]
+        if action == "execute_owl_task":
+            owl_started.set()
+            await asyncio.sleep(10) # Simulates a long-running Owl agent task
+        return {"original_command_action": action, "status": "success"}
+
+    server_task = asyncio.create_task(start_tcp_server(TEST_HOST, TEST_PORT, slow_owl_handler, SERVER_ID))
+    await asyncio.sleep(0.1)
+    try:
+        reader, writer = await asyncio.open_connection(TEST_HOST, TEST_PORT)
+        owl_msg = BaseMessage(message_type="remote_command_to_local", payload={"command_action": "execute_owl_task"})
+        status_msg = BaseMessage(message_type="remote_command_to_local", payload={"command_action": "get_local_status"})
+        writer.write(owl_msg.model_dump_json().encode() + b"\n")
+        writer.write(status_msg.model_dump_json().encode() + b"\n")
+        await writer.drain()
+        await asyncio.wait_for(owl_started.wait(), timeout=1.0)
+
+        loop = asyncio.get_running_loop()
+        sent_at = loop.time()
+        response_data = await asyncio.wait_for(reader.readline(), timeout=1.0)
+        elapsed = loop.time() - sent_at
+
+        response_msg = BaseMessage.model_validate_json(response_data.decode().strip())
+        assert response_msg.task_id == status_msg.task_id # Out-of-order response matched by task_id
+        assert response_msg.payload["original_command_action"] == "get_local_status"
+        assert elapsed < 1.0
+
+        writer.close()
+        await writer.wait_closed()
+    finally:
+        server_task.cancel()
+        try: await server_task
+        except asyncio.CancelledError: pass
+
+@pytest.mark.asyncio
+async def test_tcp_server_in_flight_window_limits_concurrency(mock_settings):
+    running = 0
+    peak = 0
+
+    async def counting_handler(message_dict, writer):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return {"status": "ok"}
+
+    server_task = asyncio.create_task(start_tcp_server(TEST_HOST, TEST_PORT, counting_handler, SERVER_ID, max_in_flight=2))
+    await asyncio.sleep(0.1)
+    try:
+        reader, writer = await asyncio.open_connection(TEST_HOST, TEST_PORT)
+        sent_ids = set()
+        for i in range(6):
+            msg = BaseMessage(message_type="remote_command_to_local", payload={"command_action": "get_local_status"})
+            sent_ids.add(msg.task_id)
+            writer.write(msg.model_dump_json().encode() + b"\n")
+        await writer.drain()
+
+        received_ids = set()
+        for _ in range(6):
+            line = await asyncio.wait_for(reader.readline(), timeout=2.0)
+            received_ids.add(BaseMessage.model_validate_json(line.decode().strip()).task_id)
+
+        assert received_ids == sent_ids
+        assert peak == 2
+        writer.close()
+        await writer.wait_closed()
+    finally:
+        server_task.cancel()
+        try: await server_task
+        except asyncio.CancelledError: pass
+
+@pytest.mark.asyncio
+async def test_tcp_server_answers_status_while_admission_queues_are_full(mock_settings):
+    admission = AdmissionController(action_concurrency={"execute_owl_task": 1, "query_local_model_direct": 2},
+                                    default_concurrency=1, max_queued_per_action=3, exempt_actions=["get_local_status"])
+    release = asyncio.Event()
+
+    async def admitting_handler(message_dict, writer):
+        action = message_dict["payload"]["command_action"]
+        try:
+            async with admission.admit(action):
+                if action != "get_local_status":
+                    await release.wait()
+        except AdmissionRejectedError:
+            return {"original_command_action": action, "status": "busy"}
+        return {"original_command_action": action, "status": "success"}
+
+    window = admission.required_connection_window(["execute_owl_task", "query_local_model_direct", "get_local_status"])
+    server_task = asyncio.create_task(start_tcp_server(TEST_HOST, TEST_PORT, admitting_handler, SERVER_ID, max_in_flight=window))
+    await asyncio.sleep(0.1)
+    try:
+        reader, writer = await asyncio.open_connection(TEST_HOST, TEST_PORT)
+        # 1 + 3 owl and 2 + 3 direct queries fill the admission queues; one more of each is turned away
+        for action, count in (("execute_owl_task", 5), ("query_local_model_direct", 6)):
+            for _ in range(count):
+                msg = BaseMessage(message_type="remote_command_to_local", payload={"command_action": action})
+                writer.write(msg.model_dump_json().encode() + b"\n")
+        status_msg = BaseMessage(message_type="remote_command_to_local", payload={"command_action": "get_local_status"})
+        writer.write(status_msg.model_dump_json().encode() + b"\n")
+        await writer.drain()
+
+        replies = []
+        for _ in range(3):
+            line = await asyncio.wait_for(reader.readline(), timeout=1.0)
+            replies.append(BaseMessage.model_validate_json(line.decode().strip()))
+        statuses = sorted((reply.payload["original_command_action"], reply.payload["status"]) for reply in replies)
+        assert statuses == [("execute_owl_task", "busy"), ("get_local_status", "success"), ("query_local_model_direct", "busy")]
+
+        release.set()
+        writer.close()
+        await writer.wait_closed()
+    finally:
+        server_task.cancel()
+        try: await server_task
+        except asyncio.CancelledError: pass
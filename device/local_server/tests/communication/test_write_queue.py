@@ -0,0 +1,81 @@
+import pytest
+import asyncio
+
+from local_server.communication.write_queue import OutboundWriteQueue, WriteQueueClosedError
+
+class _RecordingWriter:
+    """Minimal StreamWriter stand-in that records writes and can hold drain() open."""
+    def __init__(self):
+        self.writes = []
+        self.drain_gate = asyncio.Event()
+        self.drain_gate.set()
+        self.fail_with = None
+
+    def write(self, data: bytes):
+        if self.fail_with:
+            raise self.fail_with
+        self.writes.append(bytes(data))
+
+    async def drain(self):
+        await self.drain_gate.wait()
+
+@pytest.mark.asyncio
+async def test_frames_queued_in_same_tick_share_one_write():
+    writer = _RecordingWriter()
+    queue = OutboundWriteQueue(writer, "test", flush_interval=0, max_batch_bytes=1024, max_queued_bytes=4096)
+
+    for i in range(10):
+        await queue.enqueue(f"msg{i}\n".encode())
+    await queue.close()
+
+    assert len(writer.writes) == 1
+    assert writer.writes[0] == b"".join(f"msg{i}\n".encode() for i in range(10))
+    assert queue.frames == 10
+
+@pytest.mark.asyncio
+async def test_wait_flushed_returns_after_drain():
+    writer = _RecordingWriter()
+    writer.drain_gate.clear()
+    queue = OutboundWriteQueue(writer, "test", flush_interval=0, max_batch_bytes=1024, max_queued_bytes=4096)
+
+    send_task = asyncio.create_task(queue.enqueue(b"hello\n", wait_flushed=True))
+    await asyncio.sleep(0.05)
+    assert writer.writes == [b"hello\n"]
+    assert not send_task.done() # Written but still draining
+
+    writer.drain_gate.set()
+    await asyncio.wait_for(send_task, timeout=1)
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_enqueue_blocks_when_queue_is_full():
+    writer = _RecordingWriter()
+    writer.drain_gate.clear()
+    queue = OutboundWriteQueue(writer, "test", flush_interval=0, max_batch_bytes=1024, max_queued_bytes=100)
+
+    await queue.enqueue(b"x" * 80)
+    await asyncio.sleep(0.01) # First batch is now stuck in drain()
+    blocked = asyncio.create_task(queue.enqueue(b"y" * 40))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+    assert queue.queued_bytes == 80
+
+    writer.drain_gate.set()
+    await asyncio.wait_for(blocked, timeout=1)
+    await queue.close()
+    assert b"".join(writer.writes) == b"x" * 80 + b"y" * 40
+
+@pytest.mark.asyncio
+async def test_write_failure_fails_waiters_and_later_sends():
+    writer = _RecordingWriter()
+    writer.fail_with = ConnectionResetError("peer gone")
+    errors = []
+    async def on_error(e):
+        errors.append(e)
+    queue = OutboundWriteQueue(writer, "test", flush_interval=0, max_batch_bytes=1024, max_queued_bytes=4096, on_error=on_error)
+
+    with pytest.raises(WriteQueueClosedError):
+        await queue.enqueue(b"a\n", wait_flushed=True)
+    assert isinstance(errors[0], ConnectionResetError)
+    with pytest.raises(WriteQueueClosedError):
+        await queue.enqueue(b"b\n")
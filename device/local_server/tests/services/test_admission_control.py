@@ -0,0 +1,85 @@
+import pytest
+import asyncio
+
+from local_server.services.admission_control import AdmissionController, AdmissionRejectedError
+
+@pytest.mark.asyncio
+async def test_admission_limits_concurrency_and_runs_waiters_in_order():
+    controller = AdmissionController(action_concurrency={"query": 2}, default_concurrency=4, max_queued_per_action=4, exempt_actions=[])
+    running = 0
+    peak = 0
+    order = []
+    release = asyncio.Event()
+
+    async def command(i):
+        nonlocal running, peak
+        async with controller.admit("query"):
+            running += 1
+            peak = max(peak, running)
+            order.append(i)
+            await release.wait()
+            running -= 1
+
+    tasks = [asyncio.create_task(command(i)) for i in range(5)]
+    await asyncio.sleep(0.05)
+    assert peak == 2
+    assert controller.queue_depth == 3
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == [0, 1, 2, 3, 4]
+    snapshot = controller.snapshot()["actions"]["query"]
+    assert snapshot["running"] == 0
+    assert snapshot["admitted"] == 5
+
+@pytest.mark.asyncio
+async def test_admission_rejects_when_queue_is_full():
+    controller = AdmissionController(action_concurrency={"owl": 1}, max_queued_per_action=1, exempt_actions=[])
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.admit("owl"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0.01)
+    with pytest.raises(AdmissionRejectedError) as exc_info:
+        async with controller.admit("owl"):
+            pass
+    assert exc_info.value.retry_after_seconds > 0
+    assert exc_info.value.queue_depth == 1
+    assert controller.rejected_count == 1
+
+    release.set()
+    await asyncio.gather(holder, waiter)
+    assert controller.queue_depth == 0
+
+@pytest.mark.asyncio
+async def test_admission_cancelled_waiter_gives_up_its_place():
+    controller = AdmissionController(action_concurrency={"owl": 1}, max_queued_per_action=2, exempt_actions=[])
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.admit("owl"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0.01)
+    cancelled = asyncio.create_task(hold())
+    await asyncio.sleep(0.01)
+    cancelled.cancel()
+    await asyncio.gather(cancelled, return_exceptions=True)
+    assert controller.queue_depth == 0
+
+    release.set()
+    await holder
+    async with controller.admit("owl"): # Slot is free again
+        assert controller.snapshot()["actions"]["owl"]["running"] == 1
+
+@pytest.mark.asyncio
+async def test_exempt_actions_bypass_limits():
+    controller = AdmissionController(default_concurrency=1, max_queued_per_action=0, exempt_actions=["get_local_status"])
+    async with controller.admit("get_local_status"):
+        async with controller.admit("get_local_status"):
+            pass
+    assert controller.rejected_count == 0
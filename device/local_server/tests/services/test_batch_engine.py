@@ -0,0 +1,85 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from local_server.services.batch_engine import BatchEngine
+from local_server.services.task_scheduler import TaskScheduler
+from local_server.services.vllm_service import VLLMService, VLLMServiceError
+
+def _scheduler():
+    return TaskScheduler(backend_concurrency=100, class_concurrency={}, class_weights={})
+
+def _chat_vllm(delay=0.0):
+    service = MagicMock(spec=VLLMService)
+    state = {"in_flight": 0, "peak": 0, "calls": []}
+
+    async def generate(prompt, params=None):
+        state["calls"].append(prompt)
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            state["in_flight"] -= 1
+        if prompt == "fail":
+            raise VLLMServiceError("boom")
+        return {"choices": [{"message": {"content": f"answer to {prompt}"}}]}
+
+    service.generate_response = AsyncMock(side_effect=generate)
+    return service, state
+
+@pytest.mark.asyncio
+async def test_bounded_concurrency_and_streamed_results():
+    service, state = _chat_vllm(delay=0.01)
+    engine = BatchEngine(service, _scheduler(), max_concurrency=3, pack_size=1, result_buffer=4)
+
+    seen = []
+    async for result in engine.run([f"p{i}" for i in range(20)]):
+        seen.append(result["index"])
+        assert result["generated_text"] == f"answer to p{result['index']}"
+
+    assert sorted(seen) == list(range(20))
+    assert state["peak"] == 3
+
+@pytest.mark.asyncio
+async def test_identical_prompts_generated_once():
+    service, state = _chat_vllm()
+    engine = BatchEngine(service, _scheduler(), max_concurrency=4, pack_size=1)
+
+    results = {result["index"]: result async for result in engine.run(["a", "b", "a", "fail", "a"])}
+
+    assert sorted(state["calls"]) == ["a", "b", "fail"]
+    assert results[2]["generated_text"] == results[4]["generated_text"] == "answer to a"
+    assert results[2]["duplicate_of"] == results[4]["duplicate_of"] == 0
+    assert "duplicate_of" not in results[0]
+    assert results[3]["status"] == "error"
+    assert "boom" in results[3]["error_message"]
+    assert len({result["request_id"] for result in results.values()}) == 5
+
+@pytest.mark.asyncio
+async def test_packed_prompts_use_completions():
+    service = MagicMock(spec=VLLMService)
+    service.generate_completions = AsyncMock(side_effect=lambda prompts, params=None: [p.upper() for p in prompts])
+    engine = BatchEngine(service, _scheduler(), max_concurrency=2, pack_size=4)
+
+    results = {result["index"]: result async for result in engine.run([f"p{i}" for i in range(10)], {"max_tokens": 5})}
+
+    assert [len(call.args[0]) for call in service.generate_completions.await_args_list] == [4, 4, 2]
+    assert all(call.args[1] == {"max_tokens": 5} for call in service.generate_completions.await_args_list)
+    assert results[9]["generated_text"] == "P9"
+    assert results[9]["packed_with"] == 2
+    service.generate_response.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_closing_early_cancels_outstanding_work():
+    service, state = _chat_vllm(delay=0.05)
+    engine = BatchEngine(service, _scheduler(), max_concurrency=2, pack_size=1, result_buffer=1)
+
+    stream = engine.run([f"p{i}" for i in range(50)])
+    first = await stream.__anext__()
+    await stream.aclose()
+    await asyncio.sleep(0.1)
+
+    assert first["status"] == "success"
+    assert len(state["calls"]) < 10
+    assert state["in_flight"] == 0
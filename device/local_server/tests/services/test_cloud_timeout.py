@@ -0,0 +1,45 @@
+from unittest.mock import patch
+
+from local_server.core.config import AppSettings, CloudTimeoutSettings
+from local_server.services.cloud_timeout import AdaptiveTimeout
+
+def _timeout(**overrides) -> AdaptiveTimeout:
+    params = dict(percentile=95, margin_factor=1.5, margin_seconds=0.5, floor_seconds=1.0,
+                  ceiling_seconds=10.0, min_samples=5, window_size=50)
+    params.update(overrides)
+    return AdaptiveTimeout(**params)
+
+def test_uses_ceiling_until_enough_samples_then_tracks_latency():
+    timeout = _timeout()
+    for _ in range(4):
+        timeout.observe(2.0)
+    assert timeout.current() == 10.0
+
+    timeout.observe(2.0)
+    assert timeout.current() == 3.5 # 2.0 * 1.5 + 0.5
+
+def test_value_is_clamped_to_floor_and_ceiling():
+    fast = _timeout()
+    slow = _timeout()
+    for _ in range(10):
+        fast.observe(0.05)
+        slow.observe(20.0)
+    assert fast.current() == 1.0
+    assert slow.current() == 10.0
+
+    disabled = AppSettings(cloud_timeout=CloudTimeoutSettings(adaptive=False))
+    with patch("local_server.services.cloud_timeout.settings", disabled):
+        assert fast.current() == 10.0
+
+def test_timeouts_ratchet_the_value_up_to_the_ceiling():
+    timeout = _timeout(margin_factor=1.0, floor_seconds=0.1, window_size=10)
+    for _ in range(10):
+        timeout.observe(0.5)
+    values = [timeout.current()]
+    while values[-1] < 10.0 and len(values) < 50:
+        timeout.observe_timeout(values[-1])
+        values.append(timeout.current())
+
+    assert values[0] == 1.0
+    assert values == sorted(values) and values[-1] == 10.0
+    assert timeout.snapshot()["timeouts"] == len(values) - 1
@@ -0,0 +1,91 @@
+import pytest
+import asyncio
+
+from local_server.services.command_dedupe import CommandDedupeCache, DEDUPE_IN_FLIGHT, DEDUPE_REPLAYED
+
+@pytest.mark.asyncio
+async def test_duplicate_attaches_to_in_flight_execution():
+    cache = CommandDedupeCache(max_entries=10, ttl_seconds=60)
+    calls = 0
+    release = asyncio.Event()
+
+    async def execute():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "result"
+
+    first = asyncio.create_task(cache.run("task-1", execute))
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(cache.run("task-1", execute))
+    await asyncio.sleep(0.01)
+    release.set()
+
+    assert await first == ("result", None)
+    assert await second == ("result", DEDUPE_IN_FLIGHT)
+    assert calls == 1
+
+@pytest.mark.asyncio
+async def test_completed_result_is_replayed_until_ttl_expires():
+    cache = CommandDedupeCache(max_entries=10, ttl_seconds=0.05)
+    calls = 0
+
+    async def execute():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    assert await cache.run("task-1", execute) == (1, None)
+    assert await cache.run("task-1", execute) == (1, DEDUPE_REPLAYED)
+    await asyncio.sleep(0.1)
+    assert await cache.run("task-1", execute) == (2, None)
+    assert cache.snapshot()["replay_hits"] == 1
+
+@pytest.mark.asyncio
+async def test_uncacheable_results_and_errors_run_again():
+    cache = CommandDedupeCache(max_entries=10, ttl_seconds=60)
+
+    async def busy():
+        return "busy"
+    async def failing():
+        raise RuntimeError("boom")
+
+    assert await cache.run("task-1", busy, cacheable=lambda result: result != "busy") == ("busy", None)
+    assert await cache.run("task-1", busy, cacheable=lambda result: result != "busy") == ("busy", None)
+    with pytest.raises(RuntimeError):
+        await cache.run("task-2", failing)
+    with pytest.raises(RuntimeError):
+        await cache.run("task-2", failing)
+    assert cache.snapshot()["misses"] == 4
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_execution():
+    cache = CommandDedupeCache(max_entries=10, ttl_seconds=60)
+    release = asyncio.Event()
+
+    async def execute():
+        await release.wait()
+        return "done"
+
+    original = asyncio.create_task(cache.run("task-1", execute))
+    await asyncio.sleep(0.01)
+    original.cancel() # e.g. the connection it arrived on dropped
+    await asyncio.gather(original, return_exceptions=True)
+
+    retry = asyncio.create_task(cache.run("task-1", execute))
+    await asyncio.sleep(0.01)
+    release.set()
+    assert await retry == ("done", DEDUPE_IN_FLIGHT)
+
+@pytest.mark.asyncio
+async def test_oldest_completed_entries_evicted_past_max_entries():
+    cache = CommandDedupeCache(max_entries=2, ttl_seconds=60)
+
+    async def execute():
+        return "ok"
+
+    for task_id in ("a", "b", "c"):
+        await cache.run(task_id, execute)
+    await cache.run("d", execute) # Purge runs before each lookup
+    assert cache.snapshot()["entries"] <= 3
+    assert (await cache.run("a", execute))[1] is None
@@ -0,0 +1,73 @@
+import pytest
+from unittest.mock import patch
+
+from local_server.core.config import AppSettings
+from local_server.services import near_duplicate_cache as near_duplicate_module
+from local_server.services.near_duplicate_cache import NearDuplicateCache, MinHasher, char_shingles, estimate_jaccard
+
+@pytest.fixture(autouse=True)
+def cache_settings():
+    app_settings = AppSettings()
+    with patch("local_server.services.near_duplicate_cache.settings", app_settings):
+        yield app_settings
+
+def test_char_shingles_work_without_spaces():
+    assert char_shingles("量子纠缠", 2) == {"量子", "子纠", "纠缠"}
+    assert char_shingles("Hi", 3) == {"hi"} # Shorter than a shingle: the whole text is one shingle
+    assert char_shingles("A  b", 3) == char_shingles("a b", 3)
+
+def test_signature_estimates_jaccard():
+    hasher = MinHasher(num_perm=256, shingle_size=3)
+    a = "Explain how quantum entanglement works in simple terms for a beginner."
+    b = "Explain how quantum entanglement works in simple terms for a beginner!"
+    c = "Write a haiku about autumn leaves falling in the quiet mountain temple."
+    assert estimate_jaccard(hasher.signature(a), hasher.signature(b)) > 0.85
+    assert estimate_jaccard(hasher.signature(a), hasher.signature(c)) < 0.2
+
+def test_numpy_and_pure_python_signatures_match():
+    if near_duplicate_module.np is None:
+        pytest.skip("numpy not installed")
+    text = "请简单解释一下量子纠缠是什么"
+    vectorised = MinHasher(num_perm=32, shingle_size=3).signature(text)
+    with patch.object(near_duplicate_module, "np", None):
+        assert MinHasher(num_perm=32, shingle_size=3).signature(text) == vectorised
+
+def test_lookup_matches_chinese_near_duplicate_and_rejects_others():
+    cache = NearDuplicateCache(threshold=0.7, num_perm=128, bands=32, shingle_size=2, max_entries=10)
+    cache.add("请用简单的语言解释一下量子纠缠是什么原理", {"result_text": "云端答案"})
+    value, similarity = cache.lookup("请用简单的语言解释一下量子纠缠是什么原理？")
+    assert value == {"result_text": "云端答案"}
+    assert similarity >= 0.7
+    assert cache.lookup("今天北京的天气怎么样，需要带伞吗") == (None, 0.0)
+    assert cache.snapshot()["hits"] == 1
+    assert cache.snapshot()["misses"] == 1
+
+def test_scope_mismatch_and_eviction():
+    cache = NearDuplicateCache(threshold=0.8, num_perm=64, bands=16, shingle_size=3, max_entries=2)
+    cache.add("Summarize the plot of Hamlet in three sentences.", {"result_text": "hamlet"}, scope="t=0")
+    assert cache.lookup("Summarize the plot of Hamlet in three sentences.", scope="t=1") == (None, 0.0)
+
+    cache.add("Summarize the plot of Macbeth in three sentences please.", {"result_text": "macbeth"}, scope="t=0")
+    cache.add("List the prime numbers below one hundred in order.", {"result_text": "primes"}, scope="t=0")
+    assert len(cache) == 2
+    assert cache.lookup("Summarize the plot of Hamlet in three sentences.", scope="t=0")[0] != {"result_text": "hamlet"}
+    assert cache.lookup("List the prime numbers below one hundred in order.", scope="t=0")[0] == {"result_text": "primes"}
+    assert sum(len(bucket) for bucket in cache._buckets) <= 2 * cache.bands # Evicted entry left no band keys behind
+
+def test_entries_expire_after_ttl(cache_settings):
+    cache_settings.response_cache.ttl_seconds = 60.0
+    assert NearDuplicateCache().ttl_seconds == 60.0 # Follows the response cache unless set
+
+    cache = NearDuplicateCache(threshold=0.8, num_perm=64, bands=16, shingle_size=3, ttl_seconds=10.0)
+    with patch("local_server.services.near_duplicate_cache.time.monotonic", return_value=1000.0):
+        cache.add("Summarize the plot of Hamlet in three sentences.", {"result_text": "hamlet"})
+    with patch("local_server.services.near_duplicate_cache.time.monotonic", return_value=1009.0):
+        assert cache.lookup("Summarize the plot of Hamlet in three sentences!")[0] == {"result_text": "hamlet"}
+    with patch("local_server.services.near_duplicate_cache.time.monotonic", return_value=1010.0):
+        assert cache.lookup("Summarize the plot of Hamlet in three sentences!") == (None, 0.0)
+    assert len(cache) == 0
+    assert all(not bucket for bucket in cache._buckets)
+
+def test_num_perm_must_divide_into_bands():
+    with pytest.raises(ValueError):
+        NearDuplicateCache(num_perm=10, bands=3)
@@ -0,0 +1,103 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from local_server.services.refinement_batcher import RefinementBatcher
+from local_server.communication.tcp_client import TCPRemoteClient, TCPClientTimeoutError
+from local_server.communication.protocol_models import (
+    LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload, ConfidenceAssessmentData,
+    CloudBatchRefinementResponseToLocalPayload, BatchRefinementResult
+)
+
+def _request(prompt: str) -> LocalRequestCloudRefinementPayload:
+    return LocalRequestCloudRefinementPayload(
+        original_user_prompt=prompt,
+        local_model_draft_result=f"draft for {prompt}",
+        confidence_assessment=ConfidenceAssessmentData(requires_cloud_refinement=True)
+    )
+
+@pytest.fixture
+def mock_tcp_client():
+    client = MagicMock(spec=TCPRemoteClient)
+    client.request_cloud_refinement = AsyncMock(
+        side_effect=lambda request, timeout=None: CloudRefinementResponseToLocalPayload(status="success", refined_result=f"single: {request.original_user_prompt}"))
+
+    async def answer_batch(batch, timeout=None):
+        await asyncio.sleep(0.01)
+        # Reversed order: results are matched by request_id, not position
+        return CloudBatchRefinementResponseToLocalPayload(batch_id=batch.batch_id, results=[
+            BatchRefinementResult(request_id=item.request_id, status="success", refined_result=f"refined: {item.original_user_prompt}")
+            for item in reversed(batch.requests)
+        ])
+    client.request_cloud_batch_refinement = AsyncMock(side_effect=answer_batch)
+    return client
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_batch_and_fan_out(mock_tcp_client):
+    batcher = RefinementBatcher(mock_tcp_client, window_ms=20, max_batch_size=20)
+    responses = await asyncio.gather(*(batcher.refine(_request(f"q{i}")) for i in range(5)))
+
+    assert [response.refined_result for response in responses] == [f"refined: q{i}" for i in range(5)]
+    mock_tcp_client.request_cloud_batch_refinement.assert_awaited_once()
+    mock_tcp_client.request_cloud_refinement.assert_not_called()
+    assert batcher.snapshot()["cloud_requests_saved"] == 4
+
+@pytest.mark.asyncio
+async def test_size_cap_sends_without_waiting_for_window(mock_tcp_client):
+    batcher = RefinementBatcher(mock_tcp_client, window_ms=10_000, max_batch_size=3)
+    responses = await asyncio.wait_for(asyncio.gather(*(batcher.refine(_request(f"q{i}")) for i in range(3))), timeout=1)
+
+    assert len(responses) == 3
+    assert len(mock_tcp_client.request_cloud_batch_refinement.call_args[0][0].requests) == 3
+
+@pytest.mark.asyncio
+async def test_lone_request_is_sent_unbatched(mock_tcp_client):
+    batcher = RefinementBatcher(mock_tcp_client, window_ms=5)
+    response = await batcher.refine(_request("alone"))
+
+    assert response.refined_result == "single: alone"
+    mock_tcp_client.request_cloud_batch_refinement.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_batch_failure_reaches_every_caller_and_missing_results_are_errors(mock_tcp_client):
+    batcher = RefinementBatcher(mock_tcp_client, window_ms=5)
+    mock_tcp_client.request_cloud_batch_refinement.side_effect = TCPClientTimeoutError("cloud too slow")
+    outcomes = await asyncio.gather(batcher.refine(_request("a")), batcher.refine(_request("b")), return_exceptions=True)
+    assert all(isinstance(outcome, TCPClientTimeoutError) for outcome in outcomes)
+
+    async def partial_batch(batch, timeout=None):
+        first = batch.requests[0]
+        return CloudBatchRefinementResponseToLocalPayload(batch_id=batch.batch_id, results=[
+            BatchRefinementResult(request_id=first.request_id, status="success", refined_result="ok")])
+    mock_tcp_client.request_cloud_batch_refinement.side_effect = partial_batch
+    first, second = await asyncio.gather(batcher.refine(_request("a")), batcher.refine(_request("b")))
+    assert first.status == "success"
+    assert second.status == "error"
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_is_left_out_of_the_batch(mock_tcp_client):
+    batcher = RefinementBatcher(mock_tcp_client, window_ms=20)
+    leaving = asyncio.create_task(batcher.refine(_request("leaving")))
+    staying = [asyncio.create_task(batcher.refine(_request(f"q{i}"))) for i in range(2)]
+    await asyncio.sleep(0)
+    leaving.cancel()
+    await asyncio.gather(*staying)
+
+    sent = mock_tcp_client.request_cloud_batch_refinement.call_args[0][0]
+    assert [item.original_user_prompt for item in sent.requests] == ["q0", "q1"]
+
+@pytest.mark.asyncio
+async def test_each_caller_keeps_its_own_timeout(mock_tcp_client):
+    async def slow_batch(batch, timeout=None):
+        await asyncio.sleep(0.2)
+        return CloudBatchRefinementResponseToLocalPayload(batch_id=batch.batch_id, results=[
+            BatchRefinementResult(request_id=item.request_id, status="success", refined_result="late")
+            for item in batch.requests])
+    mock_tcp_client.request_cloud_batch_refinement.side_effect = slow_batch
+    batcher = RefinementBatcher(mock_tcp_client, window_ms=5)
+
+    impatient, patient = await asyncio.gather(batcher.refine(_request("a"), timeout=0.05),
+                                              batcher.refine(_request("b"), timeout=1.0), return_exceptions=True)
+    assert isinstance(impatient, TCPClientTimeoutError)
+    assert patient.refined_result == "late"
+    assert mock_tcp_client.request_cloud_batch_refinement.call_args.kwargs["timeout"] == 1.0
@@ -0,0 +1,55 @@
+import pytest
+import asyncio
+from unittest.mock import patch
+
+from local_server.core.config import AppSettings
+from local_server.services.response_cache import ResponseCache, make_cache_key, CACHE_TIER_MEMORY, CACHE_TIER_DISK
+
+@pytest.fixture(autouse=True)
+def cache_settings():
+    app_settings = AppSettings()
+    with patch("local_server.services.response_cache.settings", app_settings):
+        yield app_settings
+
+def test_cache_key_normalizes_prompt_and_includes_params():
+    assert make_cache_key("What is  quantum\nentanglement? ") == make_cache_key("What is quantum entanglement?")
+    assert make_cache_key("ＡＢＣ") == make_cache_key("ABC") # NFKC folds full-width characters
+    assert make_cache_key("prompt") != make_cache_key("prompt", {"temperature": 0.0})
+    assert make_cache_key("prompt", {"max_tokens": 10, "temperature": 0.0}) == make_cache_key("prompt", {"temperature": 0.0, "max_tokens": 10})
+
+@pytest.mark.asyncio
+async def test_memory_tier_lru_and_ttl():
+    cache = ResponseCache(max_entries=2, ttl_seconds=0.1)
+    await cache.put("a", {"result_text": "A"})
+    await cache.put("b", {"result_text": "B"})
+    assert await cache.get("a") == ({"result_text": "A"}, CACHE_TIER_MEMORY) # "a" is now most recent
+    await cache.put("c", {"result_text": "C"})
+    assert await cache.get("b") == (None, None) # Evicted as least recently used
+    await asyncio.sleep(0.15)
+    assert await cache.get("a") == (None, None) # Expired
+    assert cache.snapshot()["memory_hits"] == 1
+
+@pytest.mark.asyncio
+async def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = ResponseCache(max_entries=10, ttl_seconds=60, disk_path=path)
+    await first.put("key", {"result_text": "persisted", "source": "cloud_refined_success"})
+    first.close()
+
+    second = ResponseCache(max_entries=10, ttl_seconds=60, disk_path=path)
+    assert await second.get("key") == ({"result_text": "persisted", "source": "cloud_refined_success"}, CACHE_TIER_DISK)
+    assert (await second.get("key"))[1] == CACHE_TIER_MEMORY # Promoted on the disk hit
+    snapshot = second.snapshot()
+    assert snapshot["disk_hits"] == 1
+    assert snapshot["hit_rate"] == 1.0
+    second.close()
+
+@pytest.mark.asyncio
+async def test_disk_tier_expired_rows_are_misses_and_purged(tmp_path):
+    cache = ResponseCache(max_entries=10, ttl_seconds=0.05, disk_path=str(tmp_path / "cache.sqlite3"))
+    await cache.put("old", {"result_text": "stale"})
+    await cache.put("older", {"result_text": "stale"})
+    await asyncio.sleep(0.1)
+    assert await cache.purge_expired() == 2
+    assert await cache.get("old") == (None, None)
+    cache.close()
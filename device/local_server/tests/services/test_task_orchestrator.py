@@ -8,11 +8,14 @@ from local_server.services.task_orchestrator import TaskOrchestrator, TaskOrches
 from local_server.services.vllm_service import VLLMService, VLLMServiceError
 from local_server.services.confidence_service import ConfidenceService, ConfidenceResult
 from local_server.services.owl_agent_service import OwlAgentService, OwlAgentServiceError
+from local_server.services.admission_control import AdmissionController
+from local_server.services.task_scheduler import TaskScheduler
 from local_server.communication.tcp_client import TCPRemoteClient, TCPClientError, TCPClientTimeoutError
 from local_server.communication.protocol_models import (
     BaseMessage, RemoteCommandToLocalPayload, ExecuteOwlTaskDetails, QueryLocalModelDirectDetails, GetLocalStatusDetails,
     LocalResponseToRemotePayload, LocalRequestCloudRefinementPayload, CloudRefinementResponseToLocalPayload,
-    ConfidenceAssessmentData, LocalConfidentResultNotificationPayload
+    ConfidenceAssessmentData, LocalConfidentResultNotificationPayload,
+    CloudBatchRefinementResponseToLocalPayload, BatchRefinementResult
 )
 
 # --- Fixtures for Mocks and Settings ---
@@ -37,6 +40,7 @@ def mock_vllm_service():
 def mock_confidence_service():
     service = MagicMock(spec=ConfidenceService)
     service.assess = AsyncMock()
+    service.check_prompt_triggers = AsyncMock(return_value=[])
     # Default: high confidence, no refinement needed
     service.assess.return_value = ConfidenceResult(needs_refinement=False, score=0.9, keywords_found=[], details={})
     return service
@@ -152,7 +156,8 @@ async def test_process_user_request_vllm_failure(task_orchestrator, mock_vllm_se
 
     assert result["result_text"] is None
     assert result["source"] == "error_orchestration"
-    assert "Local LLM generation failed: vLLM is down" in result["error"]
+    assert result["error"].startswith("Local LLM generation failed:")
+    assert "vLLM is down" in result["error"]
     assert result["details"]["stages"][0]["status"] == "error"
 
 # --- Tests for process_incoming_tcp_message ---
@@ -174,6 +179,7 @@ async def test_process_tcp_execute_owl_task_success(task_orchestrator, mock_owl_
     assert response.status == "success"
     assert response.data == owl_result_data
     mock_owl_agent_service.execute_task.assert_called_once_with(task_description=agent_task_desc, agent_config_override=None)
+    assert task_orchestrator.scheduler.snapshot()["classes"]["command"]["admitted"] == 1 # Ran inside a scheduler slot
 
 @pytest.mark.asyncio
 async def test_process_tcp_query_local_model_direct_success(task_orchestrator, mock_vllm_service):
@@ -200,7 +206,8 @@ async def test_process_tcp_get_local_status(task_orchestrator, mock_settings, mo
     cmd_payload = RemoteCommandToLocalPayload(command_action="get_local_status")
     incoming_msg = BaseMessage(task_id=task_id, message_type="remote_command_to_local", payload=cmd_payload.model_dump())
 
-    response_payload_content = await task_orchestrator.process_incoming_tcp_message(incoming_msg.model_dump(), MagicMock())
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        response_payload_content = await task_orchestrator.process_incoming_tcp_message(incoming_msg.model_dump(), MagicMock())
 
     assert response_payload_content is not None
     response = LocalResponseToRemotePayload(**response_payload_content)
@@ -214,10 +221,7 @@ async def test_process_tcp_get_local_status(task_orchestrator, mock_settings, mo
 @pytest.mark.asyncio
 async def test_process_tcp_unknown_command_action(task_orchestrator):
     task_id = str(uuid.uuid4())
-    cmd_payload = RemoteCommandToLocalPayload(command_action="do_magic", command_details={})
-    # Pydantic will raise validation error for unknown command_action in RemoteCommandToLocalPayload itself.
-    # So, this test needs to bypass that or test the model validation separately.
-    # Assuming the model allows it for this test (e.g. by mocking validation or using a dict):
+    # RemoteCommandToLocalPayload rejects unknown actions, so build the payload as a raw dict.
     raw_payload = {"command_action": "do_magic", "command_details": {}}
     incoming_msg = BaseMessage(task_id=task_id, message_type="remote_command_to_local", payload=raw_payload)
 
@@ -226,7 +230,7 @@ async def test_process_tcp_unknown_command_action(task_orchestrator):
     assert response_payload_content is not None
     response = LocalResponseToRemotePayload(**response_payload_content)
     assert response.status == "error"
-    assert "Unknown command_action: do_magic" in response.error_message
+    assert "do_magic" in response.error_message # Rejected while validating the command payload
 
 @pytest.mark.asyncio
 async def test_process_tcp_unhandled_message_type(task_orchestrator):
@@ -275,3 +279,564 @@ async def test_process_batch_prompts_empty_list(task_orchestrator, mock_vllm_ser
     assert results == []
     mock_vllm_service.generate_response.assert_not_called()
 
+
+# --- Tests for stream_user_request_full_flow ---
+class _FakeCloudStream:
+    """Stands in for CloudRefinementStream: yields chunks with a delay, then exposes the final response."""
+    def __init__(self, deltas, delay, final=None, error=None):
+        self._deltas = list(deltas)
+        self._delay = delay
+        self._final = final
+        self._error = error
+        self.final = None
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._deltas:
+            if self._error:
+                raise self._error
+            self.final = self._final
+            raise StopAsyncIteration
+        await asyncio.sleep(self._delay)
+        delta = self._deltas.pop(0)
+        return MagicMock(delta=delta)
+
+    async def aclose(self):
+        self.closed = True
+
+async def _collect(agen):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    events = []
+    async for event in agen:
+        events.append((loop.time() - start, event))
+    return events
+
+def _local_stream(deltas, delay=0.0, started=None, cancelled=None):
+    """Stands in for VLLMService.stream_response: an async generator of deltas with an optional delay each."""
+    async def generator(prompt, params=None):
+        if started is not None:
+            started.set()
+        try:
+            for delta in deltas:
+                await asyncio.sleep(delay)
+                yield delta
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.set()
+            raise
+    return MagicMock(side_effect=generator)
+
+@pytest.mark.asyncio
+async def test_stream_user_request_yields_cloud_tokens_as_they_arrive(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client):
+    deltas = ["Quantum ", "physics ", "studies ", "tiny ", "things."]
+    mock_vllm_service.stream_response = _local_stream(["It's ", "complicated."])
+    mock_confidence_service.assess.return_value = ConfidenceResult(needs_refinement=True, score=0.2, keywords_found=[], details={"reason_for_refinement": "low"})
+    fake_stream = _FakeCloudStream(deltas, delay=0.1, final=CloudRefinementResponseToLocalPayload(status="success", refined_result="".join(deltas)))
+    mock_tcp_client.stream_cloud_refinement = AsyncMock(return_value=fake_stream)
+
+    events = await _collect(task_orchestrator.stream_user_request_full_flow("Explain quantum physics."))
+
+    kinds = [event["type"] for _, event in events]
+    assert kinds == ["token", "token", "switch"] + ["token"] * len(deltas) + ["final"]
+    assert [event["text"] for _, event in events[:2]] == ["It's ", "complicated."]
+    assert events[2][1] == {"type": "switch", "from": "local", "to": "cloud", "reason": "low"}
+    cloud_tokens = [event for _, event in events[3:-1]]
+    assert [t["text"] for t in cloud_tokens] == deltas
+    assert all(t["source"] == "cloud" for t in cloud_tokens)
+    first_cloud_token_at = events[3][0]
+    final_at, final = events[-1]
+    assert final["source"] == "cloud_refined_success"
+    assert final["result_text"] == "".join(deltas)
+    # The first cloud token reaches the caller after one chunk interval, well before the full refinement.
+    assert first_cloud_token_at < 0.3
+    assert final_at >= 0.5
+    assert final["details"]["escalation"]["partial_draft"] is False
+    assert set(final["details"]["time_to_first_token_ms"]) == {"local", "cloud"}
+    cloud_stage = next(s for s in final["details"]["stages"] if s["name"] == "cloud_refinement")
+    assert cloud_stage["time_to_first_token_ms"] < 300
+    assert cloud_stage["chunks"] == len(deltas)
+    assert fake_stream.closed
+    assert task_orchestrator.scheduler.active_count == 0
+
+@pytest.mark.asyncio
+async def test_stream_user_request_high_confidence_streams_local_tokens(task_orchestrator, mock_vllm_service, mock_tcp_client):
+    mock_vllm_service.stream_response = _local_stream(["Local ", "answer."], delay=0.05)
+    mock_tcp_client.stream_cloud_refinement = AsyncMock()
+
+    events = await _collect(task_orchestrator.stream_user_request_full_flow("Tell me a joke."))
+
+    assert [event for _, event in events[:2]] == [{"type": "token", "text": "Local ", "source": "local"},
+                                                  {"type": "token", "text": "answer.", "source": "local"}]
+    assert events[0][0] < events[1][0] # Delivered as generated, not in one piece at the end
+    final = events[-1][1]
+    assert final["source"] == "local_high_confidence"
+    assert final["result_text"] == "Local answer."
+    assert list(final["details"]["time_to_first_token_ms"]) == ["local"]
+    mock_tcp_client.stream_cloud_refinement.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_stream_user_request_falls_back_to_local_on_stream_timeout(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client):
+    mock_vllm_service.stream_response = _local_stream(["Local ", "draft."])
+    mock_confidence_service.assess.return_value = ConfidenceResult(needs_refinement=True, score=0.2, keywords_found=[], details={})
+    mock_tcp_client.stream_cloud_refinement = AsyncMock(return_value=_FakeCloudStream([], delay=0, error=TCPClientTimeoutError("stalled")))
+
+    events = [event for _, event in await _collect(task_orchestrator.stream_user_request_full_flow("Why?"))]
+
+    assert [event["type"] for event in events] == ["token", "token", "final"] # Local text already shown in full; no switch
+    assert events[-1]["source"] == "local_fallback_cloud_timeout"
+    assert events[-1]["result_text"] == "Local draft."
+
+@pytest.mark.asyncio
+async def test_stream_user_request_escalates_mid_stream_and_cancels_local(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client, mock_settings):
+    mock_settings.confidence.stream_assess_interval_chars = 10
+    local_cancelled = asyncio.Event()
+    mock_vllm_service.stream_response = _local_stream(["off-topic " * 1] * 50, delay=0.02, cancelled=local_cancelled)
+    mock_confidence_service.assess.return_value = ConfidenceResult(needs_refinement=True, score=0.0, keywords_found=[], details={})
+    fake_stream = _FakeCloudStream(["Better."], delay=0.05, final=CloudRefinementResponseToLocalPayload(status="success", refined_result="Better."))
+    mock_tcp_client.stream_cloud_refinement = AsyncMock(return_value=fake_stream)
+
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        events = [event for _, event in await _collect(task_orchestrator.stream_user_request_full_flow("Explain entropy."))]
+
+    assert [event["type"] for event in events] == ["token", "switch", "token", "final"]
+    payload = mock_tcp_client.stream_cloud_refinement.await_args.args[0]
+    assert payload.local_model_draft_result == "off-topic "
+    assert payload.refinement_hints == {"partial_draft": True}
+    assert events[-1]["source"] == "cloud_refined_success"
+    assert events[-1]["details"]["escalation"]["partial_draft"] is True
+    assert local_cancelled.is_set() # The background fallback draft was abandoned once the cloud answered
+
+@pytest.mark.asyncio
+async def test_stream_user_request_keyword_trigger_skips_local_tokens_and_falls_back(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client):
+    mock_confidence_service.check_prompt_triggers.return_value = ["urgent"]
+    mock_vllm_service.stream_response = _local_stream(["Local ", "draft."], delay=0.05)
+    mock_tcp_client.stream_cloud_refinement = AsyncMock(return_value=_FakeCloudStream(["Par"], delay=0, error=TCPClientError("dropped")))
+
+    events = [event for _, event in await _collect(task_orchestrator.stream_user_request_full_flow("URGENT: help"))]
+
+    assert events[0] == {"type": "token", "text": "Par", "source": "cloud"} # Nothing local was shown, so no switch first
+    assert events[1] == {"type": "switch", "from": "cloud", "to": "local", "reason": "local_fallback_cloud_tcp_error"}
+    assert events[2] == {"type": "token", "text": "Local draft.", "source": "local"}
+    assert events[-1]["result_text"] == "Local draft."
+    mock_confidence_service.assess.assert_not_called()
+
+# --- Admission control for remote commands ---
+@pytest.mark.asyncio
+async def test_process_tcp_command_busy_when_admission_queue_full(task_orchestrator, mock_vllm_service):
+    task_orchestrator.admission = AdmissionController(action_concurrency={"query_local_model_direct": 1}, max_queued_per_action=0, exempt_actions=["get_local_status"])
+    release = asyncio.Event()
+
+    async def slow_generate(**kwargs):
+        await release.wait()
+        return {"choices": [{"message": {"content": "done"}}]}
+    mock_vllm_service.generate_response.side_effect = slow_generate
+
+    def query_msg():
+        cmd_payload = RemoteCommandToLocalPayload(command_action="query_local_model_direct", command_details={"prompt": "hi"})
+        return BaseMessage(message_type="remote_command_to_local", payload=cmd_payload.model_dump()).model_dump()
+
+    first = asyncio.create_task(task_orchestrator.process_incoming_tcp_message(query_msg(), MagicMock()))
+    await asyncio.sleep(0.01)
+    busy = LocalResponseToRemotePayload(**await task_orchestrator.process_incoming_tcp_message(query_msg(), MagicMock()))
+    assert busy.status == "busy"
+    assert busy.retry_after_seconds > 0
+
+    status_msg = BaseMessage(message_type="remote_command_to_local", payload=RemoteCommandToLocalPayload(command_action="get_local_status").model_dump())
+    status = LocalResponseToRemotePayload(**await task_orchestrator.process_incoming_tcp_message(status_msg.model_dump(), MagicMock()))
+    assert status.data["rejected_commands"] == 1
+    assert await task_orchestrator.get_admission_stats() == {"queued_commands_count": 0, "rejected_commands_count": 1}
+
+    release.set()
+    assert LocalResponseToRemotePayload(**await first).status == "success"
+
+# --- task_id dedupe for retried remote commands ---
+@pytest.mark.asyncio
+async def test_retried_command_with_same_task_id_runs_once(task_orchestrator, mock_vllm_service):
+    release = asyncio.Event()
+
+    async def slow_generate(**kwargs):
+        await release.wait()
+        return {"choices": [{"message": {"content": "done"}}]}
+    mock_vllm_service.generate_response.side_effect = slow_generate
+
+    cmd_payload = RemoteCommandToLocalPayload(command_action="query_local_model_direct", command_details={"prompt": "hi"})
+    msg = BaseMessage(task_id="retry-task-1", message_type="remote_command_to_local", payload=cmd_payload.model_dump()).model_dump()
+
+    first = asyncio.create_task(task_orchestrator.process_incoming_tcp_message(msg, MagicMock()))
+    await asyncio.sleep(0.01)
+    attached = asyncio.create_task(task_orchestrator.process_incoming_tcp_message(msg, MagicMock()))
+    await asyncio.sleep(0.01)
+    release.set()
+    first_response, attached_response = await asyncio.gather(first, attached)
+    replayed_response = await task_orchestrator.process_incoming_tcp_message(msg, MagicMock())
+
+    assert first_response == attached_response == replayed_response
+    assert LocalResponseToRemotePayload(**replayed_response).status == "success"
+    assert mock_vllm_service.generate_response.await_count == 1
+    snapshot = task_orchestrator.command_dedupe.snapshot()
+    assert snapshot["in_flight_hits"] == 1
+    assert snapshot["replay_hits"] == 1
+
+# --- Response cache ---
+@pytest.mark.asyncio
+async def test_repeated_prompt_served_from_response_cache(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client):
+    mock_vllm_service.generate_response.return_value = {"choices": [{"message": {"content": "Local draft."}}]}
+    mock_confidence_service.assess.return_value = ConfidenceResult(score=0.1, keywords_found=[], needs_refinement=True)
+    mock_tcp_client.request_cloud_refinement.return_value = CloudRefinementResponseToLocalPayload(status="success", refined_result="Cloud answer.")
+
+    greedy = {"temperature": 0.0}
+    first = await task_orchestrator.process_user_request_full_flow("What is  entanglement?", generation_params=greedy)
+    second = await task_orchestrator.process_user_request_full_flow("What is entanglement?", generation_params=greedy)
+
+    assert first["source"] == second["source"] == "cloud_refined_success"
+    assert second["result_text"] == "Cloud answer."
+    assert second["details"]["cache"] == {"hit": True, "tier": "memory"}
+    assert mock_vllm_service.generate_response.await_count == 1
+    assert mock_tcp_client.request_cloud_refinement.await_count == 1
+
+    bypassed = await task_orchestrator.process_user_request_full_flow("What is entanglement?", generation_params=greedy, bypass_cache=True)
+    assert "cache" not in bypassed["details"]
+    assert mock_vllm_service.generate_response.await_count == 2
+
+@pytest.mark.asyncio
+async def test_response_cache_skips_fallbacks_and_hot_temperatures(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client, mock_settings):
+    mock_vllm_service.generate_response.return_value = {"choices": [{"message": {"content": "Local draft."}}]}
+    mock_confidence_service.assess.return_value = ConfidenceResult(score=0.1, keywords_found=[], needs_refinement=True)
+    mock_tcp_client.request_cloud_refinement.side_effect = TCPClientTimeoutError("slow cloud")
+
+    await task_orchestrator.process_user_request_full_flow("prompt", generation_params={"temperature": 0.0})
+    fallback_again = await task_orchestrator.process_user_request_full_flow("prompt", generation_params={"temperature": 0.0})
+    assert fallback_again["source"] == "local_fallback_cloud_timeout"
+    assert mock_tcp_client.request_cloud_refinement.await_count == 2 # Fallback was not cached
+
+    # Sampled requests skip the cache by default, including those relying on vllm.default_temperature
+    mock_confidence_service.assess.return_value = ConfidenceResult(score=0.9, keywords_found=[], needs_refinement=False)
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        await task_orchestrator.process_user_request_full_flow("sampled", generation_params={"temperature": 0.9})
+        await task_orchestrator.process_user_request_full_flow("sampled")
+    assert task_orchestrator.response_cache.snapshot()["memory_entries"] == 0
+
+@pytest.mark.asyncio
+async def test_near_duplicate_prompt_served_cloud_answer(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client, mock_settings):
+    mock_vllm_service.generate_response.return_value = {"choices": [{"message": {"content": "Local draft."}}]}
+    mock_confidence_service.assess.return_value = ConfidenceResult(score=0.1, keywords_found=[], needs_refinement=True)
+    mock_tcp_client.request_cloud_refinement.return_value = CloudRefinementResponseToLocalPayload(status="success", refined_result="Cloud answer.")
+    mock_settings.near_duplicate_cache.enabled = True
+    mock_settings.near_duplicate_cache.jaccard_threshold = 0.7
+
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        greedy = {"temperature": 0.0}
+        await task_orchestrator.process_user_request_full_flow("Please explain quantum entanglement in simple terms.", generation_params=greedy)
+        similar = await task_orchestrator.process_user_request_full_flow("Please explain quantum entanglement in simple terms!", generation_params=greedy)
+        other_params = await task_orchestrator.process_user_request_full_flow("Please explain quantum entanglement in simple terms!", generation_params={**greedy, "max_tokens": 5})
+
+    assert similar["result_text"] == "Cloud answer."
+    assert similar["details"]["cache"]["tier"] == "near_duplicate"
+    assert similar["details"]["cache"]["similarity"] >= 0.7
+    assert "cache" not in other_params["details"] # Different generation params never share answers
+    assert mock_tcp_client.request_cloud_refinement.await_count == 2
+
+# --- Speculative cloud refinement ---
+@pytest.mark.asyncio
+async def test_speculative_refinement_overlaps_local_and_cloud(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client, mock_settings):
+    mock_settings.confidence.speculative_cloud_refinement = True
+    mock_confidence_service.check_prompt_triggers.return_value = ["urgent"]
+    local_cancelled = asyncio.Event()
+
+    async def slow_local(**kwargs):
+        try:
+            await asyncio.sleep(0.5)
+        except asyncio.CancelledError:
+            local_cancelled.set()
+            raise
+        return {"choices": [{"message": {"content": "Local draft."}}]}
+
+    async def cloud(payload, timeout=None):
+        assert payload.local_model_draft_result == ""
+        assert payload.refinement_hints == {"speculative": True, "local_draft_pending": True}
+        await asyncio.sleep(0.1)
+        return CloudRefinementResponseToLocalPayload(status="success", refined_result="Cloud answer.")
+
+    mock_vllm_service.generate_response.side_effect = slow_local
+    mock_tcp_client.request_cloud_refinement.side_effect = cloud
+
+    start = asyncio.get_running_loop().time()
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        response = await task_orchestrator.process_user_request_full_flow("URGENT: explain this")
+    elapsed = asyncio.get_running_loop().time() - start
+
+    assert response["source"] == "cloud_refined_success"
+    assert response["result_text"] == "Cloud answer."
+    assert response["details"]["speculative_refinement"]["local_cancelled"] is True
+    assert elapsed < 0.4 # Cloud was not held back by local generation
+    await asyncio.wait_for(local_cancelled.wait(), 1)
+    mock_confidence_service.assess.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_speculative_refinement_falls_back_to_local_draft(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client, mock_settings):
+    mock_settings.confidence.speculative_cloud_refinement = True
+    mock_confidence_service.check_prompt_triggers.return_value = ["urgent"]
+
+    async def local(**kwargs):
+        await asyncio.sleep(0.2)
+        return {"choices": [{"message": {"content": "Local draft."}}]}
+
+    async def failing_cloud(payload, timeout=None):
+        await asyncio.sleep(0.2)
+        raise TCPClientTimeoutError("slow cloud")
+
+    mock_vllm_service.generate_response.side_effect = local
+    mock_tcp_client.request_cloud_refinement.side_effect = failing_cloud
+
+    start = asyncio.get_running_loop().time()
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        response = await task_orchestrator.process_user_request_full_flow("URGENT: explain this")
+    elapsed = asyncio.get_running_loop().time() - start
+
+    assert response["source"] == "local_fallback_cloud_timeout"
+    assert response["result_text"] == "Local draft."
+    assert elapsed < 0.35 # max(local, cloud), not their sum
+
+@pytest.mark.asyncio
+async def test_speculative_refinement_only_for_triggered_prompts(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client, mock_settings):
+    mock_settings.confidence.speculative_cloud_refinement = True
+    mock_vllm_service.generate_response.return_value = {"choices": [{"message": {"content": "Local draft."}}]}
+
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        response = await task_orchestrator.process_user_request_full_flow("Tell me a joke.")
+
+    assert response["source"] == "local_high_confidence"
+    assert "speculative_refinement" not in response["details"]
+    mock_tcp_client.request_cloud_refinement.assert_not_called()
+
+# --- Scheduling onto the vLLM backend ---
+@pytest.mark.asyncio
+async def test_interactive_request_not_starved_by_batch(task_orchestrator, mock_vllm_service):
+    task_orchestrator.scheduler = TaskScheduler(backend_concurrency=1, class_concurrency={}, class_weights={"interactive": 8.0, "command": 4.0, "batch": 1.0})
+    finished = []
+
+    async def generate(prompt, params=None):
+        await asyncio.sleep(0.02)
+        finished.append(prompt)
+        return {"choices": [{"message": {"content": f"answer to {prompt}"}}]}
+
+    mock_vllm_service.generate_response.side_effect = generate
+    batch = asyncio.create_task(task_orchestrator.process_batch_prompts_concurrently([f"batch {i}" for i in range(10)]))
+    await asyncio.sleep(0.005)
+    response = await task_orchestrator.process_user_request_full_flow("interactive prompt")
+    await batch
+
+    assert response["source"] == "local_high_confidence"
+    assert finished.index("interactive prompt") <= 1 # Behind at most the batch item already running
+    local_stage = next(s for s in response["details"]["stages"] if s["name"] == "local_llm_generation")
+    assert local_stage["queue_wait_ms"] < 100
+    classes = task_orchestrator.scheduler.snapshot()["classes"]
+    assert classes["batch"]["admitted"] == 10
+    assert classes["interactive"]["admitted"] == 1
+    assert task_orchestrator.scheduler.active_count == 0
+
+# --- Cancelling running work ---
+@pytest.mark.asyncio
+async def test_cancel_task_stops_running_command_and_frees_backend_slot(task_orchestrator, mock_vllm_service):
+    vllm_cancelled = asyncio.Event()
+
+    async def slow_generate(**kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            vllm_cancelled.set()
+            raise
+    mock_vllm_service.generate_response.side_effect = slow_generate
+
+    query = RemoteCommandToLocalPayload(command_action="query_local_model_direct", command_details={"prompt": "hi"})
+    query_msg = BaseMessage(task_id="long-query", message_type="remote_command_to_local", payload=query.model_dump()).model_dump()
+    running = asyncio.create_task(task_orchestrator.process_incoming_tcp_message(query_msg, MagicMock()))
+    await asyncio.sleep(0.01)
+    assert task_orchestrator.scheduler.snapshot()["running"] == 1
+
+    cancel = RemoteCommandToLocalPayload(command_action="cancel_task", command_details={"task_id": "long-query"})
+    cancel_msg = BaseMessage(message_type="remote_command_to_local", payload=cancel.model_dump()).model_dump()
+    cancel_response = LocalResponseToRemotePayload(**await task_orchestrator.process_incoming_tcp_message(cancel_msg, MagicMock()))
+    assert cancel_response.status == "success"
+    assert cancel_response.data["kind"] == "query_local_model_direct"
+
+    cancelled_response = LocalResponseToRemotePayload(**await running)
+    assert cancelled_response.status == "cancelled"
+    assert vllm_cancelled.is_set()
+    assert task_orchestrator.scheduler.snapshot()["running"] == 0
+    assert task_orchestrator.admission.snapshot()["actions"]["query_local_model_direct"]["running"] == 0
+    assert task_orchestrator.task_registry.snapshot()["cancelled"] == 1
+
+    again = LocalResponseToRemotePayload(**await task_orchestrator.process_incoming_tcp_message(cancel_msg, MagicMock()))
+    assert again.status == "error" # Nothing running under that task_id any more
+
+@pytest.mark.asyncio
+async def test_cancel_task_stops_full_flow(task_orchestrator, mock_vllm_service, mock_tcp_client):
+    async def slow_generate(**kwargs):
+        await asyncio.sleep(10)
+    mock_vllm_service.generate_response.side_effect = slow_generate
+
+    flow = asyncio.create_task(task_orchestrator.process_user_request_full_flow("Long question", request_id="req-1"))
+    await asyncio.sleep(0.01)
+    cancel = RemoteCommandToLocalPayload(command_action="cancel_task", command_details={"task_id": "req-1", "reason": "user closed the app"})
+    cancel_msg = BaseMessage(message_type="remote_command_to_local", payload=cancel.model_dump()).model_dump()
+    assert LocalResponseToRemotePayload(**await task_orchestrator.process_incoming_tcp_message(cancel_msg, MagicMock())).status == "success"
+
+    result = await flow
+    assert result["source"] == "cancelled"
+    assert "user closed the app" in result["error"]
+    assert task_orchestrator.scheduler.active_count == 0
+    assert task_orchestrator.scheduler.snapshot()["running"] == 0
+    mock_tcp_client.request_cloud_refinement.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_cancel_task_stops_streamed_full_flow(task_orchestrator, mock_vllm_service):
+    mock_vllm_service.stream_response = _local_stream(["Quick ", "answer."], delay=0.05)
+    await _collect(task_orchestrator.stream_user_request_full_flow("Warm-up question", request_id="req-warm"))
+
+    cancelled = asyncio.Event()
+    mock_vllm_service.stream_response = _local_stream(["token "] * 50, delay=0.05, cancelled=cancelled)
+    stream = task_orchestrator.stream_user_request_full_flow("Long question", request_id="req-2")
+    first = await stream.__anext__()
+    assert first["type"] == "token"
+    assert "req-2" in task_orchestrator.task_registry
+
+    cancel = RemoteCommandToLocalPayload(command_action="cancel_task", command_details={"task_id": "req-2", "reason": "user closed the app"})
+    cancel_msg = BaseMessage(message_type="remote_command_to_local", payload=cancel.model_dump()).model_dump()
+    response = LocalResponseToRemotePayload(**await task_orchestrator.process_incoming_tcp_message(cancel_msg, MagicMock()))
+    assert response.status == "success"
+    assert response.data["kind"] == "full_flow"
+    assert response.data["estimated_saved_ms"] > 0 # The warm-up flow took ~100ms; this one was cancelled after one token
+
+    rest = [event async for event in stream]
+    assert len(rest) < 49 # Stopped part-way
+    assert rest[-1]["type"] == "final"
+    assert rest[-1]["source"] == "cancelled"
+    assert "user closed the app" in rest[-1]["error"]
+    assert cancelled.is_set() # The local generation was aborted
+    assert "req-2" not in task_orchestrator.task_registry
+    assert task_orchestrator.scheduler.active_count == 0
+    assert task_orchestrator.scheduler.snapshot()["running"] == 0
+
+# --- Per-stage latency histograms ---
+@pytest.mark.asyncio
+async def test_full_flow_stage_durations_land_in_per_source_histograms(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client):
+    with patch("local_server.services.task_orchestrator.metrics") as mock_metrics:
+        mock_vllm_service.generate_response.return_value = {"choices": [{"message": {"content": "Local draft."}}]}
+        await task_orchestrator.process_user_request_full_flow("Confident prompt", bypass_cache=True)
+
+        mock_confidence_service.assess.return_value = ConfidenceResult(needs_refinement=True, score=0.1, keywords_found=[], details={})
+        mock_tcp_client.request_cloud_refinement.side_effect = TCPClientTimeoutError("Cloud too slow")
+        await task_orchestrator.process_user_request_full_flow("Hard prompt", bypass_cache=True)
+
+    series = {(c.args[0], c.args[1]) for c in mock_metrics.observe_stage.call_args_list}
+    assert ("local_llm_generation", "local_high_confidence") in series
+    assert ("total", "local_high_confidence") in series
+    assert ("local_llm_generation", "local_fallback_cloud_timeout") in series
+    assert ("cloud_refinement", "local_fallback_cloud_timeout") in series
+    assert ("cloud_refinement", "local_high_confidence") not in series
+
+# --- Batched cloud refinement ---
+@pytest.mark.asyncio
+async def test_concurrent_low_confidence_flows_share_one_cloud_batch(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client, mock_settings):
+    mock_settings.refinement_batch.enabled = True
+    mock_vllm_service.generate_response.return_value = {"choices": [{"message": {"content": "Weak draft."}}]}
+    mock_confidence_service.assess.return_value = ConfidenceResult(needs_refinement=True, score=0.1, keywords_found=[], details={})
+
+    async def answer_batch(batch, timeout=None):
+        return CloudBatchRefinementResponseToLocalPayload(batch_id=batch.batch_id, results=[
+            BatchRefinementResult(request_id=item.request_id, status="success", refined_result=f"Cloud: {item.original_user_prompt}")
+            for item in batch.requests
+        ])
+    mock_tcp_client.request_cloud_batch_refinement = AsyncMock(side_effect=answer_batch)
+
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        results = await asyncio.gather(*(task_orchestrator.process_user_request_full_flow(f"Question {i}", bypass_cache=True) for i in range(3)))
+
+    assert [r["result_text"] for r in results] == [f"Cloud: Question {i}" for i in range(3)]
+    assert all(r["source"] == "cloud_refined_success" for r in results)
+    mock_tcp_client.request_cloud_batch_refinement.assert_awaited_once()
+    mock_tcp_client.request_cloud_refinement.assert_not_called()
+
+# --- Adaptive cloud timeout and soft deadline ---
+@pytest.mark.asyncio
+async def test_cloud_refinement_gets_adaptive_timeout(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client):
+    mock_vllm_service.generate_response.return_value = {"choices": [{"message": {"content": "Weak draft."}}]}
+    mock_confidence_service.assess.return_value = ConfidenceResult(needs_refinement=True, score=0.1, keywords_found=[], details={})
+    mock_tcp_client.request_cloud_refinement.return_value = CloudRefinementResponseToLocalPayload(status="success", refined_result="Cloud answer.")
+    task_orchestrator.cloud_timeout.current = MagicMock(return_value=4.2)
+
+    result = await task_orchestrator.process_user_request_full_flow("Question", bypass_cache=True)
+
+    assert mock_tcp_client.request_cloud_refinement.call_args.kwargs["timeout"] == 4.2
+    assert result["details"]["stages"][-1]["timeout_ms"] == 4200
+    assert task_orchestrator.cloud_timeout.snapshot()["samples"] == 1
+
+    # A fast error answer says nothing about how long a refinement takes
+    mock_tcp_client.request_cloud_refinement.return_value = CloudRefinementResponseToLocalPayload(status="error", error_message="overloaded")
+    await task_orchestrator.process_user_request_full_flow("Question", bypass_cache=True)
+    assert task_orchestrator.cloud_timeout.snapshot()["samples"] == 1
+
+@pytest.mark.asyncio
+async def test_streamed_cloud_refinement_gets_adaptive_timeout(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client):
+    mock_vllm_service.stream_response = _local_stream(["Weak ", "draft."])
+    mock_confidence_service.assess.return_value = ConfidenceResult(needs_refinement=True, score=0.1, keywords_found=[], details={})
+    mock_tcp_client.stream_cloud_refinement = AsyncMock(return_value=_FakeCloudStream(
+        ["Cloud ", "answer."], delay=0, final=CloudRefinementResponseToLocalPayload(status="success", refined_result="Cloud answer.")))
+    task_orchestrator.cloud_timeout.current = MagicMock(return_value=4.2)
+
+    final = [event async for event in task_orchestrator.stream_user_request_full_flow("Question")][-1]
+
+    assert mock_tcp_client.stream_cloud_refinement.call_args.kwargs["timeout"] == 4.2
+    assert final["source"] == "cloud_refined_success"
+    assert final["details"]["stages"][-1]["timeout_ms"] == 4200
+    assert task_orchestrator.cloud_timeout.snapshot()["samples"] == 1
+
+    # A stalled stream is recorded at the timeout it was given
+    mock_tcp_client.stream_cloud_refinement = AsyncMock(return_value=_FakeCloudStream([], delay=0, error=TCPClientTimeoutError("stalled")))
+    final = [event async for event in task_orchestrator.stream_user_request_full_flow("Question")][-1]
+    assert final["source"] == "local_fallback_cloud_timeout"
+    assert task_orchestrator.cloud_timeout.snapshot()["timeouts"] == 1
+    assert task_orchestrator.cloud_timeout.snapshot()["samples"] == 2
+
+@pytest.mark.asyncio
+async def test_soft_deadline_returns_local_draft_then_delivers_cloud_upgrade(task_orchestrator, mock_vllm_service, mock_confidence_service, mock_tcp_client, mock_settings):
+    mock_settings.cloud_timeout.soft_deadline_seconds = 0.05
+    mock_vllm_service.generate_response.return_value = {"choices": [{"message": {"content": "Weak draft."}}]}
+    mock_confidence_service.assess.return_value = ConfidenceResult(needs_refinement=True, score=0.1, keywords_found=[], details={})
+
+    async def slow_cloud(request, timeout=None):
+        await asyncio.sleep(0.2)
+        return CloudRefinementResponseToLocalPayload(status="success", refined_result="Cloud answer.")
+    mock_tcp_client.request_cloud_refinement.side_effect = slow_cloud
+    upgrades = []
+
+    async def on_upgrade(upgrade):
+        upgrades.append(upgrade)
+
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        result = await task_orchestrator.process_user_request_full_flow("Question", generation_params={"temperature": 0.0}, on_upgrade=on_upgrade)
+        assert result["result_text"] == "Weak draft."
+        assert result["source"] == "local_soft_deadline"
+        assert result["details"]["cloud_upgrade"] == {"pending": True}
+        assert upgrades == []
+
+        await asyncio.gather(*task_orchestrator._cloud_upgrades)
+        assert upgrades == [{"request_id": result["request_id"], "result_text": "Cloud answer.",
+                             "source": "cloud_refined_success", "upgrade_of": "local_soft_deadline"}]
+        # The late cloud answer is cached for the next identical prompt
+        repeat = await task_orchestrator.process_user_request_full_flow("Question", generation_params={"temperature": 0.0})
+    assert repeat["result_text"] == "Cloud answer."
+    assert repeat["details"]["cache"]["hit"] is True
+
+def test_tcp_server_window_fits_admission_capacity(task_orchestrator, mock_settings):
+    # owl 1 + 8, direct queries 2 + 8, plus one slot each for get_local_status and cancel_task
+    mock_settings.remote_server.tcp_server_max_in_flight_per_connection = 16
+    with patch("local_server.services.task_orchestrator.settings", mock_settings):
+        assert task_orchestrator.tcp_server_in_flight_window() == 21
+        mock_settings.remote_server.tcp_server_max_in_flight_per_connection = 64
+        assert task_orchestrator.tcp_server_in_flight_window() == 64
@@ -0,0 +1,67 @@
+import pytest
+import asyncio
+
+from local_server.services.task_registry import TaskRegistry, TaskCancelledError
+
+@pytest.mark.asyncio
+async def test_cancel_stops_running_task_and_estimates_saving():
+    registry = TaskRegistry()
+
+    async def quick():
+        await asyncio.sleep(0.1)
+        return "done"
+
+    assert await registry.run("task-1", "query", quick) == "done"
+    cleaned_up = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            cleaned_up.set()
+
+    running = asyncio.create_task(registry.run("task-2", "query", slow))
+    await asyncio.sleep(0.01)
+    assert "task-2" in registry
+    cancellation = registry.cancel("task-2", reason="client left")
+    assert cancellation["kind"] == "query"
+    assert 0 < cancellation["estimated_saved_ms"] <= 100
+
+    with pytest.raises(TaskCancelledError) as exc_info:
+        await running
+    assert exc_info.value.reason == "client left"
+    assert cleaned_up.is_set()
+    assert len(registry) == 0
+    snapshot = registry.snapshot()
+    assert snapshot["cancelled"] == 1
+    assert snapshot["kinds"]["query"]["completed"] == 1
+    assert snapshot["estimated_compute_saved_ms"] == cancellation["estimated_saved_ms"]
+
+@pytest.mark.asyncio
+async def test_cancel_unknown_or_finished_task_returns_none():
+    registry = TaskRegistry()
+
+    async def quick():
+        return 1
+
+    assert await registry.run("task-1", "query", quick) == 1
+    assert registry.cancel("task-1") is None
+    assert registry.cancel("never-seen") is None
+    assert registry.snapshot()["cancelled"] == 0
+
+@pytest.mark.asyncio
+async def test_caller_cancellation_is_not_counted_as_cancel_task():
+    registry = TaskRegistry()
+    started = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await asyncio.sleep(10)
+
+    caller = asyncio.create_task(registry.run("task-1", "owl", slow))
+    await started.wait()
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    assert len(registry) == 0
+    assert registry.snapshot()["cancelled"] == 0
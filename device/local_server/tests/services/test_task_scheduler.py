@@ -0,0 +1,90 @@
+import pytest
+import asyncio
+
+from local_server.services.task_scheduler import TaskScheduler, CLASS_INTERACTIVE, CLASS_COMMAND, CLASS_BATCH
+
+@pytest.mark.asyncio
+async def test_scheduler_enforces_backend_and_class_limits():
+    scheduler = TaskScheduler(backend_concurrency=3, class_concurrency={CLASS_BATCH: 2}, class_weights={})
+    release = asyncio.Event()
+    peak = {"total": 0, CLASS_BATCH: 0}
+    running = {"total": 0, CLASS_BATCH: 0}
+
+    async def job(task_class):
+        async with scheduler.slot(task_class):
+            running["total"] += 1
+            peak["total"] = max(peak["total"], running["total"])
+            if task_class == CLASS_BATCH:
+                running[CLASS_BATCH] += 1
+                peak[CLASS_BATCH] = max(peak[CLASS_BATCH], running[CLASS_BATCH])
+            await release.wait()
+            running["total"] -= 1
+            if task_class == CLASS_BATCH:
+                running[CLASS_BATCH] -= 1
+
+    tasks = [asyncio.create_task(job(CLASS_BATCH)) for _ in range(4)]
+    tasks += [asyncio.create_task(job(CLASS_INTERACTIVE)) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    snapshot = scheduler.snapshot()
+    assert snapshot["running"] == 3
+    assert snapshot["classes"][CLASS_BATCH]["running"] == 2 # Batch capped even though it asked first
+    assert snapshot["classes"][CLASS_INTERACTIVE]["running"] == 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert peak == {"total": 3, CLASS_BATCH: 2}
+    assert scheduler.snapshot()["running"] == 0
+
+@pytest.mark.asyncio
+async def test_weighted_fair_queueing_lets_interactive_overtake_batch_backlog():
+    scheduler = TaskScheduler(backend_concurrency=1, class_concurrency={}, class_weights={CLASS_INTERACTIVE: 8.0, CLASS_COMMAND: 4.0, CLASS_BATCH: 1.0})
+    order = []
+
+    async def job(task_class, name):
+        async with scheduler.slot(task_class):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    tasks = [asyncio.create_task(job(CLASS_BATCH, f"b{i}")) for i in range(6)]
+    await asyncio.sleep(0) # The batch backlog forms first
+    tasks += [asyncio.create_task(job(CLASS_INTERACTIVE, f"i{i}")) for i in range(3)]
+    tasks += [asyncio.create_task(job(CLASS_COMMAND, "c0"))]
+    await asyncio.gather(*tasks)
+
+    assert order[:6] == ["b0", "i0", "c0", "i1", "i2", "b1"] # b0 was already running when the others arrived
+    waits = scheduler.snapshot()["classes"]
+    assert waits[CLASS_BATCH]["queue_wait_ms"]["p99"] > waits[CLASS_INTERACTIVE]["queue_wait_ms"]["p99"]
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_up_its_place():
+    scheduler = TaskScheduler(backend_concurrency=1, class_concurrency={}, class_weights={})
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot(CLASS_INTERACTIVE):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(scheduler.acquire(CLASS_BATCH))
+    await asyncio.sleep(0)
+    assert scheduler.queue_depth == 1
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    release.set()
+    await holder
+    assert scheduler.snapshot()["running"] == 0
+    assert scheduler.queue_depth == 0
+    async with scheduler.slot(CLASS_BATCH) as waited:
+        assert waited < 0.05
+
+def test_active_count_tracks_tasks_per_class():
+    scheduler = TaskScheduler(backend_concurrency=1, class_concurrency={}, class_weights={})
+    scheduler.task_started(CLASS_INTERACTIVE)
+    scheduler.task_started(CLASS_BATCH)
+    assert scheduler.active_count == 2
+    scheduler.task_finished(CLASS_BATCH)
+    scheduler.task_finished(CLASS_BATCH) # Never goes negative
+    assert scheduler.active_count == 1
+    with pytest.raises(ValueError):
+        scheduler.task_started("unknown")
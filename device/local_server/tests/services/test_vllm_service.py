@@ -1,5 +1,7 @@
 import pytest
+import asyncio
 import httpx
+import json
 from unittest.mock import patch, AsyncMock
 
 from local_server.core.config import AppSettings, VLLMSettings
@@ -130,9 +132,60 @@ async def test_generate_response_empty_content(vllm_service, httpx_mock, mock_se
     assert response["choices"][0]["message"]["content"] == ""
     await vllm_service.client.aclose()
 
+@pytest.mark.asyncio
+async def test_generate_completions_packs_prompts(vllm_service, httpx_mock):
+    httpx_mock.add_response(url=vllm_service.completions_url, json={"choices": [{"index": 1, "text": "two"}, {"index": 0, "text": "one"}]})
+
+    texts = await vllm_service.generate_completions(["first", "second"], {"temperature": 0.0})
+
+    assert texts == ["one", "two"] # Ordered by choice index, not response order
+    request_payload = json.loads(httpx_mock.get_requests()[0].content)
+    assert request_payload["prompt"] == ["first", "second"]
+    assert request_payload["temperature"] == 0.0
+    await vllm_service.client.aclose()
+
+@pytest.mark.asyncio
+async def test_generate_completions_count_mismatch(vllm_service, httpx_mock):
+    httpx_mock.add_response(url=vllm_service.completions_url, json={"choices": [{"index": 0, "text": "one"}]})
+    with pytest.raises(VLLMServiceError):
+        await vllm_service.generate_completions(["first", "second"])
+    await vllm_service.client.aclose()
+
+@pytest.mark.asyncio
+async def test_stream_response_yields_deltas(vllm_service, httpx_mock):
+    events = [
+        {"choices": [{"delta": {"role": "assistant"}}]},
+        {"choices": [{"delta": {"content": "Hel"}}]},
+        {"choices": [{"delta": {"content": "lo"}}]},
+        {"choices": [{"delta": {}, "finish_reason": "stop"}]},
+    ]
+    body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+    httpx_mock.add_response(url=vllm_service.chat_completions_url, content=body.encode(), headers={"content-type": "text/event-stream"})
+
+    deltas = [delta async for delta in vllm_service.stream_response("Hi", {"max_tokens": 3})]
+
+    assert deltas == ["Hel", "lo"]
+    request_payload = json.loads(httpx_mock.get_requests()[0].content)
+    assert request_payload["stream"] is True
+    assert request_payload["max_tokens"] == 3
+    await vllm_service.client.aclose()
+
+@pytest.mark.asyncio
+async def test_stream_response_http_status_error(vllm_service, httpx_mock):
+    httpx_mock.add_response(url=vllm_service.chat_completions_url, status_code=503, text="overloaded")
+    with pytest.raises(VLLMServiceError) as excinfo:
+        async for _ in vllm_service.stream_response("Hi"):
+            pass
+    assert excinfo.value.status_code == 503
+    assert "overloaded" in str(excinfo.value)
+    await vllm_service.client.aclose()
+
 @pytest.mark.asyncio
 async def test_check_health_success_dedicated_endpoint(vllm_service, httpx_mock):
     httpx_mock.add_response(url=vllm_service.health_check_url, status_code=200, text="OK")
+    # The other dedicated endpoints are probed concurrently
+    for url in ["http://testhost:8000/healthz", "http://testhost:8000/live", "http://testhost:8000/ready"]:
+        httpx_mock.add_response(url=url, status_code=404)
     assert await vllm_service.check_health() is True
     await vllm_service.client.aclose()
 
@@ -179,3 +232,71 @@ async def test_check_health_models_endpoint_request_error(vllm_service, httpx_mo
     assert await vllm_service.check_health() is False
     await vllm_service.client.aclose()
 
+
+@pytest.mark.asyncio
+async def test_check_health_remembers_working_endpoint_and_skips_dead_ones(vllm_service, httpx_mock):
+    httpx_mock.add_response(url=vllm_service.health_check_url, status_code=404)
+    httpx_mock.add_response(url="http://testhost:8000/healthz", status_code=404)
+    httpx_mock.add_response(url="http://testhost:8000/live", status_code=404)
+    httpx_mock.add_response(url="http://testhost:8000/ready", status_code=200, is_reusable=True)
+
+    assert await vllm_service.probe_health() is True
+    assert await vllm_service.probe_health() is True
+    assert await vllm_service.probe_health() is True
+
+    # First probe tries all four concurrently; later ones only ask the endpoint that answered.
+    requested = [str(request.url) for request in httpx_mock.get_requests()]
+    assert requested.count("http://testhost:8000/ready") == 3
+    assert requested.count(vllm_service.health_check_url) == 1
+    assert vllm_service.get_health_state().endpoint == "http://testhost:8000/ready"
+    await vllm_service.client.aclose()
+
+@pytest.mark.asyncio
+async def test_dead_health_endpoint_is_probed_again_after_retry_period(vllm_service, httpx_mock, mock_settings):
+    httpx_mock.add_response(url=vllm_service.health_check_url, status_code=404)
+    httpx_mock.add_response(url=vllm_service.health_check_url, status_code=200) # After a vLLM upgrade adds /health
+    for url in ["http://testhost:8000/healthz", "http://testhost:8000/live"]:
+        httpx_mock.add_response(url=url, status_code=404, is_reusable=True)
+    httpx_mock.add_response(url="http://testhost:8000/ready", status_code=200)
+    httpx_mock.add_response(url="http://testhost:8000/ready", status_code=503, is_reusable=True)
+
+    assert await vllm_service.probe_health() is True
+    assert vllm_service._is_dead(vllm_service.health_check_url)
+    # Still inside the retry period: a failing /ready leaves only the models listing, which is not mocked
+    httpx_mock.add_response(url=vllm_service.models_url, status_code=503)
+    assert await vllm_service.probe_health() is False
+
+    for url in list(vllm_service._dead_endpoints):
+        vllm_service._dead_endpoints[url] -= mock_settings.vllm.dead_endpoint_retry_seconds
+    assert await vllm_service.probe_health() is True
+    assert vllm_service.get_health_state().endpoint == vllm_service.health_check_url
+    await vllm_service.client.aclose()
+
+@pytest.mark.asyncio
+async def test_check_health_serves_cached_state_while_prober_runs(vllm_service, httpx_mock, mock_settings):
+    httpx_mock.add_response(url=vllm_service.health_check_url, status_code=200, is_reusable=True)
+    for url in ["http://testhost:8000/healthz", "http://testhost:8000/live", "http://testhost:8000/ready"]:
+        httpx_mock.add_response(url=url, status_code=404)
+
+    prober = asyncio.create_task(vllm_service.run_health_prober(interval=60))
+    await asyncio.sleep(0.05)
+    requests_after_first_probe = len(httpx_mock.get_requests())
+    for _ in range(10):
+        assert await vllm_service.check_health() is True
+    assert len(httpx_mock.get_requests()) == requests_after_first_probe # No inline probing
+    assert vllm_service.get_health_state().to_dict()["healthy"] is True
+
+    prober.cancel()
+    await asyncio.gather(prober, return_exceptions=True)
+    await vllm_service.client.aclose()
+
+@pytest.mark.asyncio
+async def test_concurrent_check_health_calls_share_one_probe(vllm_service, httpx_mock):
+    httpx_mock.add_response(url=vllm_service.health_check_url, status_code=200)
+    for url in ["http://testhost:8000/healthz", "http://testhost:8000/live", "http://testhost:8000/ready"]:
+        httpx_mock.add_response(url=url, status_code=404)
+
+    results = await asyncio.gather(*(vllm_service.check_health() for _ in range(5)))
+    assert results == [True] * 5
+    assert len(httpx_mock.get_requests()) == 4
+    await vllm_service.client.aclose()
@@ -0,0 +1,30 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from local_server.utils import event_loop
+from local_server.utils.event_loop import install_event_loop_policy
+
+@pytest.fixture(autouse=True)
+def restore_policy():
+    yield
+    asyncio.set_event_loop_policy(None)
+
+def test_uvloop_falls_back_to_asyncio_when_missing(caplog):
+    with patch.object(event_loop, "uvloop", None):
+        assert install_event_loop_policy("uvloop") == "asyncio"
+    assert "not installed" in caplog.text
+    assert type(asyncio.get_event_loop_policy()).__module__.startswith("asyncio")
+
+def test_uvloop_policy_installed_when_available():
+    class _FakePolicy(asyncio.DefaultEventLoopPolicy):
+        pass
+    class _FakeUvloop:
+        EventLoopPolicy = _FakePolicy
+    with patch.object(event_loop, "uvloop", _FakeUvloop):
+        assert install_event_loop_policy("UVLOOP") == "uvloop"
+    assert isinstance(asyncio.get_event_loop_policy(), _FakePolicy)
+
+def test_unknown_loop_name_uses_asyncio():
+    assert install_event_loop_policy("trio") == "asyncio"
@@ -0,0 +1,49 @@
+import pytest
+import asyncio
+import time
+from unittest.mock import patch
+
+from local_server.utils.loop_watchdog import LoopWatchdog
+from local_server.utils.metrics import MetricsRegistry
+
+def _blocking_handler():
+    time.sleep(0.3) # Stand-in for subprocess.run / CPU-bound scoring on the loop
+
+@pytest.mark.asyncio
+async def test_stall_captures_blocking_stack_and_duration():
+    watchdog = LoopWatchdog(interval=0.02, stall_threshold=0.1, max_reports=5)
+    registry = MetricsRegistry()
+    with patch("local_server.utils.loop_watchdog.metrics", registry):
+        watchdog_task = asyncio.create_task(watchdog.run())
+        await asyncio.sleep(0.05)
+
+        async def handler():
+            _blocking_handler()
+        await asyncio.create_task(handler(), name="blocking-handler")
+        await asyncio.sleep(0.05) # Let the loop tick so the stall is closed out
+
+        watchdog_task.cancel()
+        await asyncio.gather(watchdog_task, return_exceptions=True)
+
+    snapshot = watchdog.snapshot()
+    assert snapshot["stalls_total"] == 1
+    report = snapshot["recent_stalls"][0]
+    assert report["task"] == "blocking-handler"
+    assert any("_blocking_handler" in line for line in report["stack"])
+    assert report["duration_ms"] >= 250
+    assert snapshot["max_lag_ms"] >= 250
+    assert snapshot["lag_histogram_ms"]["le_500"] == 1
+    assert registry.snapshot()["loop_lag_ms.p99"] >= 250 # Also fed to the heartbeat metrics
+
+@pytest.mark.asyncio
+async def test_idle_loop_reports_no_stalls():
+    watchdog = LoopWatchdog(interval=0.01, stall_threshold=0.2)
+    watchdog_task = asyncio.create_task(watchdog.run())
+    await asyncio.sleep(0.1)
+    watchdog_task.cancel()
+    await asyncio.gather(watchdog_task, return_exceptions=True)
+
+    snapshot = watchdog.snapshot(include_stacks=False)
+    assert snapshot["stalls_total"] == 0
+    assert snapshot["recent_stalls"] == []
+    assert sum(snapshot["lag_histogram_ms"].values()) >= 5
@@ -0,0 +1,117 @@
+import pytest
+import time
+from unittest.mock import patch
+
+from local_server.core.config import AppSettings, MetricsSettings
+from local_server.utils.metrics import LatencyWindow, LatencyHistogram, MetricsRegistry
+
+@pytest.fixture
+def metrics_settings():
+    app_settings = AppSettings(metrics=MetricsSettings(latency_window_size=100, full_snapshot_every=5))
+    with patch("local_server.utils.metrics.settings", app_settings):
+        yield app_settings
+
+def test_latency_window_percentiles_and_ring_overwrite():
+    window = LatencyWindow(capacity=100)
+    for ms in range(1, 101):
+        window.observe(ms / 1000)
+    assert window.percentiles() == {"p50": 50.0, "p95": 95.0, "p99": 99.0}
+
+    # The oldest samples are overwritten once the ring is full.
+    for _ in range(100):
+        window.observe(1.0)
+    assert window.percentiles()["p50"] == 1000.0
+    assert window.total_count == 200
+
+def test_latency_window_caches_each_quantile_set_separately():
+    window = LatencyWindow(capacity=100)
+    for ms in range(1, 101):
+        window.observe(ms / 1000)
+    assert window.percentiles() == {"p50": 50.0, "p95": 95.0, "p99": 99.0}
+    assert window.percentiles((50, 99.9)) == {"p50": 50.0, "p99.9": 100.0}
+    assert window.percentiles([95]) == {"p95": 95.0}
+    window.observe(0.5)
+    assert window.percentiles((50, 99.9))["p99.9"] == 500.0
+
+def test_latency_window_empty():
+    assert LatencyWindow(capacity=10).percentiles() == {}
+
+def test_latency_histogram_percentiles_within_bucket_precision():
+    histogram = LatencyHistogram(sub_bucket_bits=8)
+    for ms in range(1, 10001):
+        histogram.observe(ms / 1000)
+    percentiles = histogram.percentiles()
+    for name, exact_ms in (("p50", 5000), ("p90", 9000), ("p99", 9900), ("p99.9", 9990)):
+        assert exact_ms <= percentiles[name] <= exact_ms * (1 + 1 / 128)
+    assert histogram.summary()["max"] == 10000.0
+    assert len(histogram._counts) < 1200 # Log-linear: far fewer buckets than distinct values
+    assert histogram.cumulative_counts([1, 100, 100000]) == [1, 100, 10000]
+
+def test_stage_histograms_keep_sources_apart_and_render_prometheus(metrics_settings):
+    registry = MetricsRegistry()
+    registry.observe_stage("local_llm_generation", "local_high_confidence", 0.02)
+    registry.observe_stage("local_llm_generation", "local_fallback_cloud_timeout", 0.03)
+    registry.observe_stage("cloud_refinement", "local_fallback_cloud_timeout", 5.0)
+
+    histograms = registry.stage_histograms()
+    assert set(histograms["local_llm_generation"]) == {"local_high_confidence", "local_fallback_cloud_timeout"}
+    assert histograms["cloud_refinement"]["local_fallback_cloud_timeout"]["count"] == 1
+
+    text = registry.render_prometheus()
+    assert "# TYPE local_server_stage_duration_seconds histogram" in text
+    labels = 'stage="cloud_refinement",source="local_fallback_cloud_timeout"'
+    assert f'local_server_stage_duration_seconds_bucket{{{labels},le="2.5"}} 0' in text
+    assert f'local_server_stage_duration_seconds_bucket{{{labels},le="5"}} 1' in text
+    assert f'local_server_stage_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+    assert f"local_server_stage_duration_seconds_count{{{labels}}} 1" in text
+
+def test_heartbeat_delta_sends_full_then_only_changes(metrics_settings):
+    registry = MetricsRegistry()
+    queue_depth = {"value": 0}
+    registry.register_gauge("queue_depth", lambda: queue_depth["value"])
+    registry.observe("confidence", 0.004)
+
+    first = registry.heartbeat_delta()
+    assert first["seq"] == 1 and first["full"] is True
+    assert first["values"]["queue_depth"] == 0
+    assert first["values"]["latency.confidence.p50"] == 4.0
+    assert "memory_rss_mb" in first["values"]
+
+    queue_depth["value"] = 3
+    second = registry.heartbeat_delta()
+    assert second["full"] is False
+    assert second["values"]["queue_depth"] == 3
+    assert "latency.confidence.p50" not in second["values"] # Unchanged since the last beat
+
+def test_heartbeat_delta_periodic_full_snapshot(metrics_settings):
+    registry = MetricsRegistry()
+    fulls = [registry.heartbeat_delta()["full"] for _ in range(10)]
+    assert fulls == [True, False, False, False, True, False, False, False, False, True]
+
+def test_cache_hit_rates_and_count_deltas(metrics_settings):
+    registry = MetricsRegistry()
+    for hit in (True, True, False, True):
+        registry.record_cache("prompt", hit)
+    first = registry.heartbeat_delta()["values"]
+    assert first["cache.prompt.hit_rate"] == 0.75
+    assert first["cache.prompt.hits_delta"] == 3
+    assert first["cache.prompt.misses_delta"] == 1
+
+    registry.record_cache("prompt", False)
+    second = registry.heartbeat_delta()["values"]
+    assert second["cache.prompt.hits_delta"] == 0
+    assert second["cache.prompt.misses_delta"] == 1
+    assert second["cache.prompt.hit_rate"] == 0.6
+
+def test_heartbeat_delta_is_cheap(metrics_settings):
+    registry = MetricsRegistry()
+    for stage in ("local_generation", "confidence", "cloud_refinement"):
+        for i in range(100):
+            registry.observe(stage, i / 1000)
+    registry.heartbeat_delta()
+    start = time.perf_counter()
+    for _ in range(100):
+        registry.observe("confidence", 0.001) # Invalidate one window per beat, as in production
+        registry.heartbeat_delta()
+    per_beat = (time.perf_counter() - start) / 100
+    assert per_beat < 0.001
@@ -0,0 +1,33 @@
+import asyncio
+import logging
+
+try:
+    import uvloop # Optional: pip install uvloop (not available on Windows)
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_ASYNCIO = "asyncio"
+EVENT_LOOP_UVLOOP = "uvloop"
+
+def available_event_loops() -> list:
+    """Loop implementations usable in this environment, default first."""
+    return [EVENT_LOOP_ASYNCIO] + ([EVENT_LOOP_UVLOOP] if uvloop is not None else [])
+
+def install_event_loop_policy(name: str) -> str:
+    """
+    Installs the event loop policy for `name` ("asyncio" or "uvloop") before asyncio.run() creates
+    the loop. Falls back to the default asyncio loop, with a warning, when uvloop is requested but
+    not installed. Returns the name of the loop actually in use.
+    """
+    name = (name or EVENT_LOOP_ASYNCIO).lower()
+    if name == EVENT_LOOP_UVLOOP:
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return EVENT_LOOP_UVLOOP
+        logger.warning("Event loop 'uvloop' requested but uvloop is not installed; using the default asyncio loop.")
+    elif name != EVENT_LOOP_ASYNCIO:
+        logger.warning(f"Unknown event loop '{name}'; using the default asyncio loop.")
+    asyncio.set_event_loop_policy(None) # Restore the default policy
+    return EVENT_LOOP_ASYNCIO
@@ -0,0 +1,137 @@
+import asyncio
+import bisect
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from ..core.config import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the lag histogram buckets; anything slower lands in the final "+inf" bucket.
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+class LoopWatchdog:
+    """
+    Detects event-loop stalls. A coroutine on the loop ticks every `interval` and records how late
+    each wake-up was into a histogram. A daemon thread checks that the tick keeps advancing; once it
+    has been stuck longer than `stall_threshold`, the thread grabs the loop thread's current Python
+    stack (and the running asyncio task), which points at whatever synchronous call is blocking:
+    subprocess.run, ROUGE scoring, a slow callback, etc.
+    """
+    def __init__(self,
+                 interval: Optional[float] = None,
+                 stall_threshold: Optional[float] = None,
+                 max_reports: Optional[int] = None):
+        metrics_settings = settings.metrics
+        self.interval = interval if interval is not None else metrics_settings.loop_lag_sample_interval_seconds
+        self.stall_threshold = stall_threshold if stall_threshold is not None else metrics_settings.loop_stall_threshold_seconds
+        self._bucket_counts: List[int] = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self._max_lag_ms = 0.0
+        self._stalls_total = 0
+        self._reports: Deque[Dict[str, Any]] = deque(maxlen=max_reports if max_reports is not None else metrics_settings.loop_stall_reports_kept)
+        self._open_report: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock() # Guards the stall reports, which both threads touch
+        self._last_tick = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Loop side ---
+    def _record_lag(self, lag_seconds: float):
+        lag_ms = lag_seconds * 1000
+        self._bucket_counts[bisect.bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        if lag_ms > self._max_lag_ms:
+            self._max_lag_ms = lag_ms
+        metrics.observe_loop_lag(lag_seconds)
+
+    def _tick(self, now: float):
+        self._last_tick = now
+        with self._lock:
+            report, self._open_report = self._open_report, None
+        if report is not None:
+            # The stall is over; now we know how long it really lasted.
+            report["duration_ms"] = round((now - report["_started"]) * 1000, 1)
+            logger.warning(f"LoopWatchdog: Event loop was blocked for {report['duration_ms']:.0f} ms (task: {report['task']}).")
+
+    async def run(self):
+        """Ticks the loop and runs the watchdog thread until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"LoopWatchdog: Started (interval {self.interval}s, stall threshold {self.stall_threshold}s).")
+        try:
+            while True:
+                scheduled = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._record_lag(max(0.0, now - scheduled))
+                self._tick(now)
+        finally:
+            self._stop_event.set()
+
+    # --- Watchdog thread ---
+    def _watch(self):
+        check_every = max(0.01, min(self.interval, self.stall_threshold) / 2)
+        while not self._stop_event.wait(check_every):
+            # Allow for the tick's own sleep interval before calling it a stall.
+            stalled_for = time.monotonic() - self._last_tick - self.interval
+            if stalled_for < self.stall_threshold:
+                continue
+            with self._lock:
+                if self._open_report is not None:
+                    continue # Already captured this stall
+                report = self._open_report = self._capture(stalled_for)
+                self._reports.append(report)
+                self._stalls_total += 1
+            logger.warning(f"LoopWatchdog: Event loop blocked for over {stalled_for * 1000:.0f} ms in task {report['task']}. "
+                           f"Stack:\n{''.join(report['stack'])}")
+
+    def _capture(self, stalled_for: float) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        task_name = None
+        if self._loop is not None:
+            try:
+                task = asyncio.current_task(self._loop)
+                task_name = task.get_name() if task is not None else None
+            except RuntimeError:
+                pass
+        return {
+            "detected_at": time.time(),
+            "detected_after_ms": round(stalled_for * 1000, 1),
+            "duration_ms": None, # Filled in when the loop ticks again
+            "task": task_name,
+            "stack": stack,
+            "_started": self._last_tick + self.interval,
+        }
+
+    # --- Reporting ---
+    def snapshot(self, include_stacks: bool = True) -> Dict[str, Any]:
+        """Lag histogram (ms bucket upper bound -> count) plus the most recent stall reports."""
+        histogram = {f"le_{bound}": count for bound, count in zip(LAG_BUCKETS_MS, self._bucket_counts)}
+        histogram["le_inf"] = self._bucket_counts[-1]
+        with self._lock:
+            reports = [
+                {key: value for key, value in report.items() if not key.startswith("_") and (include_stacks or key != "stack")}
+                for report in self._reports
+            ]
+            stalls_total = self._stalls_total
+        return {
+            "lag_histogram_ms": histogram,
+            "max_lag_ms": round(self._max_lag_ms, 1),
+            "stalls_total": stalls_total,
+            "recent_stalls": reports,
+        }
+
+# Process-wide watchdog started by main.py and reported through get_local_status.
+loop_watchdog = LoopWatchdog()
@@ -0,0 +1,308 @@
+import logging
+import math
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from ..core.config import settings
+
+try:
+    import resource # Unix only; used when /proc is unavailable
+except ImportError:
+    resource = None
+
+try:
+    import pynvml # Optional: pip install nvidia-ml-py
+except ImportError:
+    pynvml = None
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages timed by the orchestrator. Any other name passed to observe() gets its own window too.
+STAGE_LOCAL_GENERATION = "local_generation"
+STAGE_CONFIDENCE = "confidence"
+STAGE_CLOUD_REFINEMENT = "cloud_refinement"
+# Time to first token of the streamed full flow per token source, measured from the start of the request.
+STAGE_TTFT_LOCAL = "ttft_local"
+STAGE_TTFT_CLOUD = "ttft_cloud"
+
+# Per-stage histogram series for the end-to-end duration of a request (details["total_duration_ms"]).
+STAGE_TOTAL = "total"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+class LatencyWindow:
+    """
+    Fixed-size ring buffer of the most recent samples (seconds). Percentiles are computed on demand
+    and cached per set of quantiles until the next sample.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._samples: List[float] = [0.0] * self.capacity
+        self._next = 0
+        self._size = 0
+        self.total_count = 0
+        self._cached: Dict[Tuple[float, ...], Dict[str, float]] = {}
+
+    def observe(self, seconds: float) -> None:
+        self._samples[self._next] = seconds
+        self._next = (self._next + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+        self.total_count += 1
+        self._cached.clear()
+
+    def percentiles(self, quantiles: Iterable[int] = (50, 95, 99)) -> Dict[str, float]:
+        """Nearest-rank percentiles in milliseconds, e.g. {"p50": 12.3, ...}; empty when no samples."""
+        quantiles = tuple(quantiles)
+        cached = self._cached.get(quantiles)
+        if cached is not None:
+            return cached
+        if not self._size:
+            return {}
+        ordered = sorted(self._samples[:self._size])
+        result = {}
+        for q in quantiles:
+            index = min(self._size - 1, max(0, math.ceil(q / 100.0 * self._size) - 1))
+            result[f"p{q}"] = round(ordered[index] * 1000, 2)
+        self._cached[quantiles] = result
+        return result
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of durations, recorded in microseconds. Values below
+    2**sub_bucket_bits get a bucket each; above that, every power of two is split into
+    2**(sub_bucket_bits - 1) equal buckets, so a bucket is never wider than 1/2**(sub_bucket_bits - 1)
+    of the values in it. Only non-empty buckets are stored, recording is O(1), and unlike
+    LatencyWindow nothing is forgotten: counts are cumulative since startup, as Prometheus expects.
+    """
+    def __init__(self, sub_bucket_bits: int = 8):
+        self.sub_bucket_bits = max(1, sub_bucket_bits)
+        self._counts: Dict[int, int] = {} # Bucket lower bound (us) -> samples
+        self.count = 0
+        self.sum_seconds = 0.0
+        self.max_us = 0
+
+    def _bucket(self, value_us: int) -> int:
+        shift = value_us.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value_us
+        return (value_us >> shift) << shift
+
+    def _upper_bound(self, bucket: int) -> int:
+        shift = bucket.bit_length() - self.sub_bucket_bits
+        return bucket + (1 << shift) - 1 if shift > 0 else bucket
+
+    def observe(self, seconds: float) -> None:
+        value_us = max(0, int(seconds * 1_000_000))
+        bucket = self._bucket(value_us)
+        self._counts[bucket] = self._counts.get(bucket, 0) + 1
+        self.count += 1
+        self.sum_seconds += seconds
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def percentiles(self, quantiles: Iterable[float] = (50, 90, 99, 99.9)) -> Dict[str, float]:
+        """Nearest-rank percentiles in milliseconds (the upper bound of the bucket holding the rank), e.g. {"p99": 41.2}."""
+        if not self.count:
+            return {}
+        buckets = sorted(self._counts.items())
+        result = {}
+        for q in quantiles:
+            rank = max(1, math.ceil(q / 100.0 * self.count))
+            seen = 0
+            for bucket, bucket_count in buckets:
+                seen += bucket_count
+                if seen >= rank:
+                    result[f"p{q:g}"] = round(min(self._upper_bound(bucket), self.max_us) / 1000, 2)
+                    break
+        return result
+
+    def cumulative_counts(self, bounds_ms: Iterable[float]) -> List[int]:
+        """Samples at or below each bound (ms), by bucket lower bound; the Prometheus `le` buckets."""
+        buckets = sorted(self._counts.items())
+        result = []
+        index, seen = 0, 0
+        for bound_ms in sorted(bounds_ms):
+            bound_us = bound_ms * 1000
+            while index < len(buckets) and buckets[index][0] <= bound_us:
+                seen += buckets[index][1]
+                index += 1
+            result.append(seen)
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {"count": self.count}
+        if self.count:
+            summary.update(self.percentiles())
+            summary["mean"] = round(self.sum_seconds / self.count * 1000, 2)
+            summary["max"] = round(self.max_us / 1000, 2)
+        return summary
+
+def _prometheus_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _read_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # Peak rather than current RSS, but the best the platform offers without /proc. KiB on Linux, bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+class MetricsRegistry:
+    """
+    In-process collection point for the numbers the heartbeat reports: per-stage latency windows,
+    cache hit/miss counters, gauges sampled through callbacks (e.g. admission queue depth), process
+    CPU and memory, and event-loop lag. Everything is kept in memory and read in O(window) time.
+    Full-flow stage durations are additionally kept in cumulative histograms per (stage, source),
+    which get_local_status and the Prometheus endpoint report.
+    """
+    def __init__(self, window_size: Optional[int] = None):
+        self.window_size = window_size if window_size is not None else settings.metrics.latency_window_size
+        self._latency: Dict[str, LatencyWindow] = {}
+        self._cache_hits: Dict[str, int] = {}
+        self._cache_misses: Dict[str, int] = {}
+        self._gauges: Dict[str, Callable[[], Optional[float]]] = {}
+        self._loop_lag = LatencyWindow(self.window_size)
+        self._cpu_mark = (time.monotonic(), time.process_time())
+        self._last_sent: Dict[str, Any] = {}
+        self._last_cache_counts: Dict[str, tuple] = {}
+        self._heartbeat_seq = 0
+        self._gpu_handle = None
+        self._gpu_checked = False
+        self._stage_histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+    # --- Recording (hot path) ---
+    def observe(self, stage: str, seconds: float) -> None:
+        window = self._latency.get(stage)
+        if window is None:
+            window = self._latency[stage] = LatencyWindow(self.window_size)
+        window.observe(seconds)
+
+    def observe_stage(self, stage: str, source: str, seconds: float) -> None:
+        """Adds a stage duration to the histogram for (stage, source), where source is the request's final result source."""
+        histogram = self._stage_histograms.get((stage, source))
+        if histogram is None:
+            histogram = self._stage_histograms[(stage, source)] = LatencyHistogram(settings.metrics.histogram_sub_bucket_bits)
+        histogram.observe(seconds)
+
+    def record_cache(self, cache_name: str, hit: bool) -> None:
+        counts = self._cache_hits if hit else self._cache_misses
+        counts[cache_name] = counts.get(cache_name, 0) + 1
+
+    def register_gauge(self, name: str, read_func: Callable[[], Optional[float]]) -> None:
+        """Registers a callback read on every snapshot; it must be cheap and non-blocking."""
+        self._gauges[name] = read_func
+
+    def observe_loop_lag(self, seconds: float) -> None:
+        self._loop_lag.observe(seconds)
+
+    # --- Reading ---
+    def _cpu_percent(self) -> Optional[float]:
+        """Process CPU use since the previous call, as a percentage of one core."""
+        now_wall, now_cpu = time.monotonic(), time.process_time()
+        last_wall, last_cpu = self._cpu_mark
+        self._cpu_mark = (now_wall, now_cpu)
+        elapsed = now_wall - last_wall
+        if elapsed <= 0:
+            return None
+        return round(100.0 * (now_cpu - last_cpu) / elapsed, 1)
+
+    def _gpu_percent(self) -> Optional[float]:
+        if pynvml is None:
+            return None
+        if not self._gpu_checked:
+            self._gpu_checked = True
+            try:
+                pynvml.nvmlInit()
+                self._gpu_handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+            except Exception as e:
+                logger.info(f"MetricsRegistry: GPU utilisation unavailable: {e}")
+        if self._gpu_handle is None:
+            return None
+        try:
+            return float(pynvml.nvmlDeviceGetUtilizationRates(self._gpu_handle).gpu)
+        except Exception:
+            return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Flat dict of current values, e.g. {"cpu_percent": 12.5, "latency.confidence.p95": 3.1, ...}."""
+        values: Dict[str, Any] = {"cpu_percent": self._cpu_percent()}
+        rss = _read_rss_bytes()
+        values["memory_rss_mb"] = round(rss / (1024 * 1024), 1) if rss is not None else None
+        values["gpu_usage_percent"] = self._gpu_percent()
+        for name, quantile_ms in self._loop_lag.percentiles().items():
+            values[f"loop_lag_ms.{name}"] = quantile_ms
+        for stage, window in self._latency.items():
+            for name, quantile_ms in window.percentiles().items():
+                values[f"latency.{stage}.{name}"] = quantile_ms
+            values[f"latency.{stage}.count"] = window.total_count
+        for cache_name in set(self._cache_hits) | set(self._cache_misses):
+            hits, misses = self._cache_hits.get(cache_name, 0), self._cache_misses.get(cache_name, 0)
+            values[f"cache.{cache_name}.hit_rate"] = round(hits / (hits + misses), 4) if hits + misses else None
+        for name, read_func in self._gauges.items():
+            try:
+                values[name] = read_func()
+            except Exception as e:
+                logger.debug(f"MetricsRegistry: Gauge {name} failed: {e}")
+        return values
+
+    def stage_histograms(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """{stage: {source: {"count", "p50", "p90", "p99", "p99.9", "mean", "max"}}} in milliseconds."""
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (stage, source), histogram in sorted(self._stage_histograms.items()):
+            result.setdefault(stage, {})[source] = histogram.summary()
+        return result
+
+    def render_prometheus(self) -> str:
+        """The stage histograms in the Prometheus text exposition format (version 0.0.4)."""
+        name = "local_server_stage_duration_seconds"
+        bounds_ms = sorted(settings.metrics.prometheus_buckets_ms)
+        lines = [
+            f"# HELP {name} Full-flow stage durations by stage and final result source.",
+            f"# TYPE {name} histogram",
+        ]
+        for (stage, source), histogram in sorted(self._stage_histograms.items()):
+            labels = f'stage="{_prometheus_label(stage)}",source="{_prometheus_label(source)}"'
+            for bound_ms, cumulative in zip(bounds_ms, histogram.cumulative_counts(bounds_ms)):
+                lines.append(f'{name}_bucket{{{labels},le="{bound_ms / 1000:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum_seconds:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def last_value(self, key: str) -> Any:
+        """Value of `key` in the snapshot taken for the most recent heartbeat."""
+        return self._last_sent.get(key)
+
+    def heartbeat_delta(self) -> Dict[str, Any]:
+        """
+        Metrics for the next heartbeat, delta-encoded: only values that changed since the previous
+        beat, plus per-cache hit/miss counts accumulated since then. Every `full_snapshot_every`
+        beats (and on the first) the whole snapshot is sent so the receiver can resynchronise.
+        """
+        self._heartbeat_seq += 1
+        current = self.snapshot()
+        full = self._heartbeat_seq == 1 or self._heartbeat_seq % max(1, settings.metrics.full_snapshot_every) == 0
+        if full:
+            changed = dict(current)
+        else:
+            changed = {key: value for key, value in current.items() if self._last_sent.get(key) != value}
+        self._last_sent = current
+
+        for cache_name in set(self._cache_hits) | set(self._cache_misses):
+            hits, misses = self._cache_hits.get(cache_name, 0), self._cache_misses.get(cache_name, 0)
+            last_hits, last_misses = self._last_cache_counts.get(cache_name, (0, 0))
+            if full or hits != last_hits or misses != last_misses:
+                changed[f"cache.{cache_name}.hits_delta"] = hits - last_hits
+                changed[f"cache.{cache_name}.misses_delta"] = misses - last_misses
+            self._last_cache_counts[cache_name] = (hits, misses)
+
+        return {"seq": self._heartbeat_seq, "full": full, "values": changed}
+
+# Process-wide registry used by the orchestrator, TCP client heartbeat and caches.
+metrics = MetricsRegistry()